@@ -0,0 +1,3 @@
+"""
+离线基准测试与本地上游替身
+"""
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+/api/chat 离线基准测试
+使用本地替身代替易快报和DeepSeek，在进程内驱动main:app，统计吞吐、p50/p99延迟和每请求上游调用次数
+
+用法:
+    python -m benchmarks.bench_chat --requests 200 --concurrency 20 --latency-scale 0.1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from benchmarks.mock_upstream import MockUpstream, configure_offline_environment
+
+DEFAULT_MESSAGES = [
+    "帮我申请出差上海3000元，明天出发",
+    "出差北京2500元下周一",
+    "申请市场推广项目费用5000元",
+]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """p取0~100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def run_benchmark(total_requests: int = 100, concurrency: int = 10, latency_scale: float = 1.0,
+                        messages: Optional[List[str]] = None, upstream: Optional[MockUpstream] = None) -> Dict[str, Any]:
+    """
+    启动应用生命周期（含预热）后并发发送聊天请求，返回统计结果
+
+    上游调用次数只统计压测阶段（预热阶段的调用单独给出）。
+    """
+    import httpx
+    import main
+    from services.resilience import get_gateway
+
+    messages = messages or DEFAULT_MESSAGES
+    upstream = upstream or MockUpstream(latency_scale=latency_scale)
+    get_gateway().set_transport(upstream.transport())
+
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with main.lifespan(main.app):
+        while not main.warmup_service.state.is_ready:
+            await asyncio.sleep(0.01)
+        warmup_calls = dict(upstream.counts)
+        upstream.reset()
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+
+            async def send(index: int):
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post("/api/chat", json={
+                            "message": messages[index % len(messages)],
+                            "history": []
+                        })
+                        status = response.json().get("type", "error") if response.status_code == 200 else f"http_{response.status_code}"
+                    except Exception as e:
+                        status = type(e).__name__
+                    latencies.append(time.perf_counter() - started)
+                    statuses[status] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*[send(i) for i in range(total_requests)])
+            elapsed = time.perf_counter() - started
+
+    per_request = {
+        f"{name}:{endpoint}": round(count / total_requests, 2)
+        for (name, endpoint), count in sorted(upstream.counts.items())
+    }
+    upstream_totals = Counter()
+    for (name, _), count in upstream.counts.items():
+        upstream_totals[name] += count
+
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "latency_scale": latency_scale,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "results": dict(statuses),
+        "upstream_calls_per_request": per_request,
+        "upstream_totals_per_request": {name: round(count / total_requests, 2) for name, count in upstream_totals.items()},
+        "warmup_calls": {f"{name}:{endpoint}": count for (name, endpoint), count in sorted(warmup_calls.items())}
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print("=" * 60)
+    print("/api/chat 离线基准测试")
+    print("=" * 60)
+    print(f"请求数: {report['requests']}  并发: {report['concurrency']}  延迟倍率: {report['latency_scale']}")
+    print(f"耗时: {report['elapsed_s']}s  吞吐: {report['throughput_rps']} req/s")
+    print(f"延迟: p50={report['p50_ms']}ms  p99={report['p99_ms']}ms")
+    print(f"结果分布: {report['results']}")
+    print("每请求上游调用次数:")
+    for name, count in report["upstream_calls_per_request"].items():
+        print(f"   {name}: {count}")
+    print(f"预热阶段上游调用: {report['warmup_calls']}")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="/api/chat 离线基准测试")
+    parser.add_argument("--requests", type=int, default=100, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发数")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="上游延迟倍率（0表示无延迟）")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    parser.add_argument("--log-level", default="WARNING", help="应用日志级别")
+    args = parser.parse_args()
+
+    import main  # 导入后再调整日志级别（main模块导入时会配置日志）
+    logging.getLogger().setLevel(args.log_level)
+
+    report = asyncio.run(run_benchmark(args.requests, args.concurrency, args.latency_scale))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    configure_offline_environment()
+    sys.exit(cli())
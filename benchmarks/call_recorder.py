@@ -0,0 +1,119 @@
+"""
+上游调用记录器
+包装出站网关的底层传输，记录一段工作单元内发出的每个易快报/DeepSeek请求，
+并按调用预算断言（超出预算时给出多余调用的差异清单），让调用次数回归像功能回归一样被测试发现
+
+用法:
+    recorder = CallRecorder(MockUpstream().transport())
+    get_gateway().set_transport(recorder)
+    with recorder.unit_of_work("create_smart_expense") as calls:
+        await mcp.create_smart_expense("出差上海3000元")
+    calls.assert_budget({"ekuaibao": 1, "deepseek": 1})
+"""
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.mock_upstream import classify
+
+_current_unit: contextvars.ContextVar[Optional["UnitOfWork"]] = contextvars.ContextVar("upstream_unit_of_work", default=None)
+
+
+@dataclass
+class RecordedCall:
+    """一次出站请求"""
+    upstream: str
+    endpoint: str
+    method: str
+    path: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.upstream}:{self.endpoint}"
+
+    def __str__(self) -> str:
+        return f"{self.method} {self.key} {self.path}"
+
+
+class CallBudgetExceeded(AssertionError):
+    """工作单元的上游调用超出预算"""
+
+
+class UnitOfWork:
+    """一段工作单元内记录到的上游调用"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: List[RecordedCall] = []
+
+    def count(self, key: str) -> int:
+        """key为上游名（如"ekuaibao"）或"上游:接口"（如"ekuaibao:flow/data"）"""
+        return sum(1 for call in self.calls if key in (call.upstream, call.key))
+
+    def _budget_key(self, call: RecordedCall, budget: Dict[str, int]) -> Optional[str]:
+        """接口级预算优先于上游级预算"""
+        if call.key in budget:
+            return call.key
+        if call.upstream in budget:
+            return call.upstream
+        return None
+
+    def assert_budget(self, budget: Dict[str, int], strict: bool = True):
+        """
+        断言调用次数不超过预算
+
+        budget的key为上游名或"上游:接口"；strict为True时未列出的上游预算视为0。
+        超出预算时抛出CallBudgetExceeded，消息中按顺序列出全部调用，多余的调用以"+"标记。
+        """
+        used: Dict[str, int] = {}
+        lines = []
+        exceeded = False
+        for call in self.calls:
+            key = self._budget_key(call, budget)
+            if key is None and not strict:
+                lines.append(f"  {call}")
+                continue
+            used[key] = used.get(key, 0) + 1
+            if used[key] > budget.get(key, 0):
+                exceeded = True
+                lines.append(f"+ {call}")
+            else:
+                lines.append(f"  {call}")
+
+        if exceeded:
+            summary = ", ".join(
+                f"{key or '未列出'}: {count}/{budget.get(key, 0)}" for key, count in used.items()
+            )
+            raise CallBudgetExceeded(
+                f"{self.name} 上游调用超出预算 ({summary})\n" + "\n".join(lines)
+            )
+
+
+class CallRecorder(httpx.AsyncBaseTransport):
+    """记录出站请求的传输包装器（只记录当前工作单元上下文内发出的请求，后台任务不计入）"""
+
+    def __init__(self, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        unit = _current_unit.get()
+        if unit is not None:
+            upstream, endpoint = classify(request)
+            unit.calls.append(RecordedCall(upstream, endpoint, request.method, request.url.path))
+        return await self.inner.handle_async_request(request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    @contextmanager
+    def unit_of_work(self, name: str):
+        """记录代码块（及其中创建的子任务）发出的全部上游请求"""
+        unit = UnitOfWork(name)
+        token = _current_unit.set(unit)
+        try:
+            yield unit
+        finally:
+            _current_unit.reset(token)
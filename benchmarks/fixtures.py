@@ -0,0 +1,56 @@
+"""
+离线测试的公共准备
+重置进程内单例（出站网关、共享缓存、熔断器、调度器），创建接入本地替身和调用记录器的MCP服务并预热缓存。
+导入本模块时即设置离线环境变量，测试模块需在导入config/services之前导入它。
+"""
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from benchmarks.mock_upstream import MockUpstream, configure_offline_environment
+
+configure_offline_environment()
+
+from benchmarks.call_recorder import CallRecorder
+from services import circuit_breaker, deepseek_service, resilience, scheduler, shared_cache
+from services.extraction_cache import ExtractionCache
+from services.usage_ledger import UsageLedger
+from services.warmup import WarmupService
+from smart_expense_mcp import SmartExpenseMCP
+
+
+def reset_singletons():
+    """丢弃上一个测试留下的进程内单例，每个测试从干净的状态开始"""
+    resilience._gateway = None
+    shared_cache._shared_cache = None
+    scheduler._scheduler = None
+    circuit_breaker._breakers.clear()
+    deepseek_service._call_site_latency.clear()
+
+
+async def warm_mcp(extraction_cache: Optional[ExtractionCache] = None, usage: Optional[UsageLedger] = None,
+                   warm: bool = True, upstream: Optional[MockUpstream] = None,
+                   **upstream_options) -> Tuple[SmartExpenseMCP, CallRecorder]:
+    """
+    创建接入调用记录器的MCP服务（默认预热缓存）
+
+    upstream为测试需要直接修改数据的本地替身，未提供时用upstream_options创建；
+    字段提取模式缓存默认关闭，用量账本默认写入临时库。
+    """
+    reset_singletons()
+    if upstream is None:
+        upstream_options.setdefault("latency_scale", 0)
+        upstream = MockUpstream(**upstream_options)
+    recorder = CallRecorder(upstream.transport())
+    resilience.get_gateway().set_transport(recorder)
+
+    workdir = tempfile.mkdtemp(prefix="expense-test-")
+    mcp = SmartExpenseMCP()
+    mcp.extraction_cache = extraction_cache or ExtractionCache(
+        path=os.path.join(workdir, "cache.json"), enabled=False
+    )
+    mcp.deepseek_service.usage = usage or UsageLedger(path=os.path.join(workdir, "usage.db"))
+    if warm:
+        state = await WarmupService(mcp, mcp.auth_service, timeout=10).run()
+        assert state.status == "ready", state.to_dict()
+    return mcp, recorder
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+/api/chat 负载生成器
+按真实话术类型的加权语料，以目标RPS（开环）向main:app发送请求，输出延迟分位数、错误率、
+按话术类型的统计，以及从 /metrics 拉取的分阶段耗时；可保存基线并与基线对比
+
+用法:
+    # 进程内运行（本地上游替身）
+    python -m benchmarks.loadgen --rps 20 --duration 30 --latency-scale 0.2 --save-baseline baseline.json
+    # 压测已启动的服务
+    python -m benchmarks.loadgen --url http://localhost:8000 --rps 5 --duration 60 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from benchmarks.bench_chat import percentile
+from benchmarks.mock_upstream import MockUpstream, configure_offline_environment
+
+# 默认语料：话术类型、权重和模板（{amount}/{city}/{date}/{project}为随机槽位）
+DEFAULT_CORPUS = [
+    {
+        "type": "field_query",
+        "weight": 1,
+        "utterances": ["查看申请单有哪些字段", "申请表结构是什么", "模板信息给我看看"]
+    },
+    {
+        "type": "create_simple",
+        "weight": 5,
+        "utterances": ["帮我申请培训费用{amount}元", "报销{amount}元办公用品", "写一个采购申请，{amount}元，{date}"]
+    },
+    {
+        "type": "create_dimensions",
+        "weight": 3,
+        "utterances": ["出差{city}{amount}元{date}", "申请{project}费用{amount}元，去{city}出差，{date}出发"]
+    },
+    {
+        "type": "document_lookup",
+        "weight": 1,
+        "utterances": ["查询单据 S{code}", "帮我看看S{code}这张单子"]
+    },
+    {
+        "type": "history_query",
+        "weight": 1,
+        "utterances": ["查看金永志的历史申请记录", "我最近提交过哪些申请"]
+    },
+]
+
+SLOTS = {
+    "amount": lambda rng: str(rng.choice([500, 800, 1200, 2500, 3000, 5000, 12000])),
+    "city": lambda rng: rng.choice(["上海", "北京", "深圳"]),
+    "date": lambda rng: rng.choice(["明天", "下周一", "月底", "3天后", "1月15日"]),
+    "project": lambda rng: rng.choice(["智能申请单项目", "市场推广项目"]),
+    "code": lambda rng: str(rng.randint(25000000, 25009999)),
+}
+
+
+class Corpus:
+    """加权话术语料"""
+
+    def __init__(self, entries: List[Dict[str, Any]], seed: int = 42):
+        self.entries = entries
+        self.weights = [entry["weight"] for entry in entries]
+        self.rng = random.Random(seed)
+
+    @classmethod
+    def load(cls, path: Optional[str], seed: int = 42) -> "Corpus":
+        if not path:
+            return cls(DEFAULT_CORPUS, seed)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), seed)
+
+    def sample(self):
+        """返回 (话术类型, 填充后的话术)"""
+        entry = self.rng.choices(self.entries, weights=self.weights)[0]
+        template = self.rng.choice(entry["utterances"])
+        values = {name: fill(self.rng) for name, fill in SLOTS.items() if "{" + name + "}" in template}
+        return entry["type"], template.format(**values)
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    def ms(p):
+        value = percentile(latencies, p)
+        return round(value * 1000, 1) if value is not None else None
+    return {"count": len(latencies), "p50_ms": ms(50), "p90_ms": ms(90), "p99_ms": ms(99)}
+
+
+def stage_breakdown(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """根据压测前后的 /metrics 快照计算各阶段的次数和平均耗时（分位数取压测后的滚动窗口）"""
+    stages = {}
+    for name, stats in after.get("stages", {}).items():
+        prev = before.get("stages", {}).get(name, {"count": 0, "total_ms": 0.0})
+        count = stats["count"] - prev["count"]
+        if count <= 0:
+            continue
+        stages[name] = {
+            "count": count,
+            "avg_ms": round((stats["total_ms"] - prev["total_ms"]) / count, 1),
+            "p50_ms": stats["p50_ms"],
+            "p99_ms": stats["p99_ms"]
+        }
+    counters = {}
+    for name, value in after.get("counters", {}).items():
+        delta = value - before.get("counters", {}).get(name, 0)
+        if delta:
+            counters[name] = delta
+    return {"stages": stages, "counters": counters}
+
+
+async def generate_load(client, corpus: Corpus, rps: float, duration: float, poisson: bool = False) -> Dict[str, Any]:
+    """开环发送请求：按目标速率发出，不等待前一个请求完成"""
+    results: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"latencies": [], "errors": 0, "types": defaultdict(int)})
+    rng = random.Random(7)
+    tasks = []
+
+    async def send(kind: str, message: str):
+        started = time.perf_counter()
+        bucket = results[kind]
+        try:
+            response = await client.post("/api/chat", json={"message": message, "history": []})
+            if response.status_code == 200:
+                bucket["types"][response.json().get("type", "unknown")] += 1
+            else:
+                bucket["errors"] += 1
+                bucket["types"][f"http_{response.status_code}"] += 1
+        except Exception as e:
+            bucket["errors"] += 1
+            bucket["types"][type(e).__name__] += 1
+        bucket["latencies"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    next_send = started
+    while next_send - started < duration:
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, message = corpus.sample()
+        tasks.append(asyncio.create_task(send(kind, message)))
+        next_send += rng.expovariate(rps) if poisson else 1.0 / rps
+    sent_elapsed = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [latency for bucket in results.values() for latency in bucket["latencies"]]
+    total_errors = sum(bucket["errors"] for bucket in results.values())
+    return {
+        "target_rps": rps,
+        "offered_rps": round(len(tasks) / sent_elapsed, 2) if sent_elapsed else None,
+        "completed_rps": round(len(tasks) / elapsed, 2) if elapsed else None,
+        "requests": len(tasks),
+        "error_rate": round(total_errors / len(tasks), 4) if tasks else 0.0,
+        "latency": summarize(all_latencies),
+        "by_type": {
+            kind: dict(summarize(bucket["latencies"]), errors=bucket["errors"], responses=dict(bucket["types"]))
+            for kind, bucket in sorted(results.items())
+        }
+    }
+
+
+async def run_in_process(args, corpus: Corpus) -> Dict[str, Any]:
+    """进程内运行main:app，上游使用本地替身"""
+    import httpx
+    import main
+    from services.resilience import get_gateway
+
+    upstream = MockUpstream(latency_scale=args.latency_scale)
+    get_gateway().set_transport(upstream.transport())
+    async with main.lifespan(main.app):
+        while not main.warmup_service.state.is_ready:
+            await asyncio.sleep(0.01)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadgen", timeout=args.timeout) as client:
+            return await run_against(client, corpus, args)
+
+
+async def run_against(client, corpus: Corpus, args) -> Dict[str, Any]:
+    before = (await client.get("/metrics")).json()
+    report = await generate_load(client, corpus, args.rps, args.duration, args.poisson)
+    after = (await client.get("/metrics")).json()
+    report["metrics"] = stage_breakdown(before, after)
+    return report
+
+
+async def run_remote(args, corpus: Corpus) -> Dict[str, Any]:
+    """压测已启动的服务"""
+    import httpx
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        return await run_against(client, corpus, args)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """与基线对比，返回可读的差异行"""
+    def delta(name, current, previous, unit=""):
+        if current is None or previous in (None, 0):
+            return f"{name}: {current}{unit} (基线 {previous}{unit})"
+        change = (current - previous) / previous * 100
+        return f"{name}: {current}{unit} (基线 {previous}{unit}, {change:+.1f}%)"
+
+    lines = [
+        delta("完成RPS", report["completed_rps"], baseline.get("completed_rps")),
+        delta("错误率", report["error_rate"], baseline.get("error_rate")),
+    ]
+    for p in ("p50_ms", "p90_ms", "p99_ms"):
+        lines.append(delta(f"延迟{p}", report["latency"][p], baseline.get("latency", {}).get(p), "ms"))
+    for stage, stats in report["metrics"]["stages"].items():
+        previous = baseline.get("metrics", {}).get("stages", {}).get(stage, {}).get("avg_ms")
+        lines.append(delta(f"阶段{stage}平均", stats["avg_ms"], previous, "ms"))
+    return lines
+
+
+def print_report(report: Dict[str, Any]):
+    print("=" * 60)
+    print("/api/chat 负载测试")
+    print("=" * 60)
+    print(f"目标RPS: {report['target_rps']}  实际发出: {report['offered_rps']}  完成: {report['completed_rps']}")
+    print(f"请求数: {report['requests']}  错误率: {report['error_rate'] * 100:.2f}%")
+    latency = report["latency"]
+    print(f"延迟: p50={latency['p50_ms']}ms  p90={latency['p90_ms']}ms  p99={latency['p99_ms']}ms")
+    print("\n按话术类型:")
+    for kind, stats in report["by_type"].items():
+        print(f"   {kind}: n={stats['count']} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+              f"errors={stats['errors']} {stats['responses']}")
+    print("\n分阶段耗时:")
+    for stage, stats in report["metrics"]["stages"].items():
+        print(f"   {stage}: n={stats['count']} avg={stats['avg_ms']}ms p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+    upstream = {name: count for name, count in report["metrics"]["counters"].items() if name.startswith("upstream.")}
+    if upstream and report["requests"]:
+        print("\n每请求上游调用次数:")
+        for name, count in sorted(upstream.items()):
+            print(f"   {name[len('upstream.'):]}: {count / report['requests']:.2f}")
+    counters = report["metrics"]["counters"]
+    hits, misses = counters.get("extract_cache.hit", 0), counters.get("extract_cache.miss", 0)
+    if hits or misses:
+        print(f"\n字段提取模式缓存: 命中 {hits} / 未命中 {misses} ({hits / (hits + misses) * 100:.1f}%)")
+    sites = sorted(name.split(".")[1] for name in counters
+                   if name.startswith("deepseek.") and name.endswith(".prompt_tokens"))
+    if sites:
+        print("\n提示词上下文缓存命中:")
+        for site in sites:
+            prompt_tokens = counters[f"deepseek.{site}.prompt_tokens"]
+            hit_tokens = counters.get(f"deepseek.{site}.prompt_cache_hit_tokens", 0)
+            print(f"   {site}: {hit_tokens}/{prompt_tokens} tokens ({hit_tokens / prompt_tokens * 100 if prompt_tokens else 0:.1f}%)")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="/api/chat 负载生成器")
+    parser.add_argument("--url", help="目标服务地址，不指定时进程内运行main:app并使用本地上游替身")
+    parser.add_argument("--rps", type=float, default=10.0, help="目标每秒请求数")
+    parser.add_argument("--duration", type=float, default=30.0, help="发送持续时间（秒）")
+    parser.add_argument("--poisson", action="store_true", help="按泊松过程发送（默认匀速）")
+    parser.add_argument("--corpus", help="自定义语料JSON文件（格式同DEFAULT_CORPUS）")
+    parser.add_argument("--seed", type=int, default=42, help="语料抽样随机种子")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="本地替身的上游延迟倍率")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--save-baseline", help="将结果保存为基线JSON文件")
+    parser.add_argument("--compare", help="与指定的基线JSON文件对比")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    parser.add_argument("--log-level", default="WARNING", help="进程内运行时的应用日志级别")
+    args = parser.parse_args()
+
+    corpus = Corpus.load(args.corpus, args.seed)
+    if args.url:
+        report = asyncio.run(run_remote(args, corpus))
+    else:
+        import main  # 导入后再调整日志级别（main模块导入时会配置日志）
+        logging.getLogger().setLevel(args.log_level)
+        report = asyncio.run(run_in_process(args, corpus))
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n与基线对比:")
+        for line in compare(report, baseline):
+            print(f"   {line}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存: {args.save_baseline}")
+
+
+if __name__ == "__main__":
+    configure_offline_environment()
+    sys.exit(cli())
@@ -0,0 +1,316 @@
+"""
+易快报/DeepSeek本地替身
+按录制的响应结构回放各接口（latestByType、byIds/editable、dimensions、dimensions/items、
+flow/data、auth、DeepSeek chat completions），可配置每个接口的延迟，并统计调用次数
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+# 各接口默认延迟（秒），接近线上观测值
+DEFAULT_LATENCY = {
+    "auth": 0.15,
+    "latestByType": 0.2,
+    "byIds/editable": 0.3,
+    "dimensions": 0.15,
+    "dimensions/items": 0.15,
+    "flow/data": 0.4,
+    "chat": 1.2,
+    "models": 0.05,
+}
+
+TEMPLATE_ID = "ID01spec:ai"
+TEMPLATE_VERSION_ID = "ID01spec:ai:3f9a2c"
+
+TEMPLATE_LIST = {
+    "items": [
+        {"id": "ID01spec:travel", "name": "差旅申请单", "active": True, "type": "requisition", "updateTime": 1735660800000},
+        {"id": TEMPLATE_ID, "name": "AI申请单", "active": True, "type": "requisition", "updateTime": 1736870400000},
+    ]
+}
+
+TEMPLATE_DETAIL = {
+    "items": [
+        {
+            "id": TEMPLATE_VERSION_ID,
+            "name": "AI申请单",
+            "form": [
+                {"title": {"label": "标题", "type": "text", "optional": False}},
+                {"description": {"label": "申请事由", "type": "textarea", "optional": True}},
+                {"requisitionMoney": {"label": "申请金额", "type": "money", "optional": False}},
+                {"requisitionDate": {"label": "申请日期", "type": "date", "optional": False}},
+                {"u_项目": {"label": "项目", "type": "ref", "optional": True, "valueFrom": "basedata.Dimension.项目"}},
+                {"u_城市": {"label": "出差城市", "type": "ref", "optional": True, "valueFrom": "basedata.Dimension.城市"}},
+            ]
+        }
+    ]
+}
+
+DIMENSIONS = {
+    "count": 2,
+    "items": [
+        {"id": "ID01dim:project", "name": "项目", "code": "XM", "active": True},
+        {"id": "ID01dim:city", "name": "城市", "code": "CS", "active": True},
+    ]
+}
+
+DIMENSION_ITEMS = {
+    "ID01dim:project": [
+        {"id": "ID01item:p1", "name": "智能申请单项目", "code": "XM001"},
+        {"id": "ID01item:p2", "name": "市场推广项目", "code": "XM002"},
+    ],
+    "ID01dim:city": [
+        {"id": "ID01item:c1", "name": "上海", "code": "SH"},
+        {"id": "ID01item:c2", "name": "北京", "code": "BJ"},
+        {"id": "ID01item:c3", "name": "深圳", "code": "SZ"},
+    ],
+}
+
+# 支持ETag条件请求的接口
+ETAG_ENDPOINTS = {"latestByType", "byIds/editable", "dimensions", "dimensions/items"}
+
+CITY_NAMES = [item["name"] for item in DIMENSION_ITEMS["ID01dim:city"]]
+
+# 流式输出：首个输出块前的延迟占比和每块字符数
+STREAM_FIRST_CHUNK_SHARE = 0.3
+STREAM_CHUNK_CHARS = 16
+
+
+def classify(request: httpx.Request) -> Tuple[str, str]:
+    """按URL归类出站请求，返回 (上游, 接口)"""
+    path = request.url.path
+    if "deepseek" in request.url.host:
+        return "deepseek", "chat" if path.endswith("/chat/completions") else "models"
+    for marker, endpoint in (
+        ("/auth/", "auth"),
+        ("/specifications/latestByType", "latestByType"),
+        ("/specifications/byIds/editable", "byIds/editable"),
+        ("/dimensions/items", "dimensions/items"),
+        ("/dimension/items", "dimensions/items"),
+        ("/dimensions", "dimensions"),
+        ("/flow/data", "flow/data"),
+    ):
+        if marker in path:
+            return "ekuaibao", endpoint
+    return "ekuaibao", "unknown"
+
+
+class MockUpstream:
+    """易快报和DeepSeek的本地替身（作为httpx.MockTransport的异步处理函数使用）"""
+
+    def __init__(self, latency_scale: float = 1.0, latency: Optional[Dict[str, float]] = None, etags: bool = True,
+                 flow_max_lengths: Optional[Dict[str, int]] = None, extra_dimension_items: int = 0):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.latency_scale = latency_scale
+        self.etags = etags
+        self.flow_max_lengths = flow_max_lengths or {}  # 模拟模板配置之外的服务端长度校验：字段名 -> 最大长度
+        # 模拟大租户：项目档案额外追加的档案项数量（超过单页条数时需要翻页）
+        self.dimension_items = dict(DIMENSION_ITEMS, **{"ID01dim:project": DIMENSION_ITEMS["ID01dim:project"] + [
+            {"id": f"ID01item:x{index}", "name": f"扩展项目{index}", "code": f"XMX{index:05d}"}
+            for index in range(extra_dimension_items)
+        ]})
+        self.calls: List[Tuple[str, str, str]] = []
+        self._document_seq = 25000130
+        self._prompt_prefixes: Set[str] = set()  # 模拟上下文缓存：见过的提示词前缀
+
+    @property
+    def counts(self) -> Counter:
+        """按(上游, 接口)统计的调用次数"""
+        return Counter((upstream, endpoint) for upstream, endpoint, _ in self.calls)
+
+    def reset(self):
+        self.calls.clear()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        upstream, endpoint = classify(request)
+        self.calls.append((upstream, endpoint, request.method))
+        delay = self.latency.get(endpoint, 0.05) * self.latency_scale
+        if endpoint == "chat" and json.loads(request.content).get("stream"):
+            # 流式输出：首个输出块前等待一部分延迟，其余延迟分摊到各个输出块
+            await asyncio.sleep(delay * STREAM_FIRST_CHUNK_SHARE)
+            return self._chat_stream(request, delay * (1 - STREAM_FIRST_CHUNK_SHARE))
+        if delay:
+            await asyncio.sleep(delay)
+        response = getattr(self, "_" + endpoint.replace("/", "_").replace(".", "_"), self._not_found)(request)
+        if self.etags and endpoint in ETAG_ENDPOINTS and response.status_code == 200:
+            etag = '"' + hashlib.md5(response.content).hexdigest() + '"'
+            if request.headers.get("if-none-match") == etag:
+                return httpx.Response(304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+        return response
+
+    def _not_found(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404, json={"message": f"unknown path {request.url.path}"})
+
+    def _auth(self, request: httpx.Request) -> httpx.Response:
+        now_ms = int(time.time() * 1000)
+        return httpx.Response(200, json={
+            "value": {
+                "accessToken": f"mock-access-{now_ms}",
+                "refreshToken": f"mock-refresh-{now_ms}",
+                "expireTime": now_ms + 2 * 3600 * 1000,
+                "corporationId": "ID01mockcorp"
+            }
+        })
+
+    def _latestByType(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=TEMPLATE_LIST)
+
+    def _byIds_editable(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=TEMPLATE_DETAIL)
+
+    @staticmethod
+    def _page(request: httpx.Request, items: List[Dict[str, Any]]) -> httpx.Response:
+        """按 start/count 分页，count字段为总数"""
+        start = int(request.url.params.get("start", 0))
+        count = int(request.url.params.get("count", 100))
+        return httpx.Response(200, json={"count": len(items), "items": items[start:start + count]})
+
+    def _dimensions(self, request: httpx.Request) -> httpx.Response:
+        return self._page(request, DIMENSIONS["items"])
+
+    def _dimensions_items(self, request: httpx.Request) -> httpx.Response:
+        return self._page(request, self.dimension_items.get(request.url.params.get("dimensionId"), []))
+
+    def _flow_data(self, request: httpx.Request) -> httpx.Response:
+        form = json.loads(request.content).get("form", {})
+        for name, max_length in self.flow_max_lengths.items():
+            if len(str(form.get(name, ""))) > max_length:
+                return httpx.Response(400, json={
+                    "errorCode": 400,
+                    "errorMessage": f"字段[{name}]长度不能超过{max_length}个字符"
+                })
+        self._document_seq += 1
+        return httpx.Response(200, json={
+            "flow": {
+                "id": f"ID01flow:{self._document_seq}",
+                "form": dict(form, code=f"S{self._document_seq}")
+            }
+        })
+
+    def _models(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+
+    def _chat(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        user_text = payload["messages"][-1]["content"]
+        if payload.get("tools"):
+            message = self._intent_message(user_text)
+            completion_tokens = 20
+        else:
+            message = {"role": "assistant", "content": json.dumps(self._extraction(user_text), ensure_ascii=False)}
+            completion_tokens = 120
+        prompt_tokens = sum(len(m.get("content") or "") for m in payload["messages"])
+        # 模拟上下文缓存：除最后一条消息外的前缀（含工具定义）出现过则计为缓存命中
+        prefix = json.dumps([payload["messages"][:-1], payload.get("tools")], ensure_ascii=False)
+        hit_tokens = sum(len(m.get("content") or "") for m in payload["messages"][:-1]) if prefix in self._prompt_prefixes else 0
+        self._prompt_prefixes.add(prefix)
+        return httpx.Response(200, json={
+            "id": "mock-completion",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": hit_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - hit_tokens
+            }
+        })
+
+    def _chat_stream(self, request: httpx.Request, duration: float) -> httpx.Response:
+        """以SSE逐块输出_chat的回复内容，最后输出token用量"""
+        completion = json.loads(self._chat(request).content)
+        content = completion["choices"][0]["message"].get("content") or ""
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+
+        def event(data: Dict[str, Any]) -> bytes:
+            return b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+        async def events():
+            for piece in pieces:
+                if duration:
+                    await asyncio.sleep(duration / len(pieces))
+                yield event({"choices": [{"index": 0, "delta": {"content": piece}}]})
+            yield event({"choices": [], "usage": completion["usage"]})
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+
+    def _intent_message(self, user_text: str) -> Dict[str, Any]:
+        """模拟意图识别：按关键词选择工具"""
+        if "历史" in user_text:
+            return {"role": "assistant", "content": "历史单据查询功能暂未开放"}
+        if "可选" in user_text:
+            name, arguments = "get_available_archive_options", {}
+        elif "档案" in user_text:
+            name, arguments = "get_archive_categories", {}
+        elif "字段" in user_text:
+            name, arguments = "get_template_fields", {}
+        elif re.search(r"[A-Z]\d{8}", user_text):
+            name, arguments = "get_document_by_code", {"code": re.search(r"[A-Z]\d{8}", user_text).group()}
+        else:
+            name, arguments = "create_smart_expense", {"user_input": user_text}
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_mock",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}
+            }]
+        }
+
+    def _extraction(self, prompt: str) -> Dict[str, Any]:
+        """模拟字段提取：从提示词中的用户输入解析金额、城市和相对日期"""
+        match = re.search(r"用户输入[:：]\s*(.+)", prompt)
+        user_input = match.group(1).strip() if match else prompt
+        amount = re.search(r"(\d+(?:\.\d+)?)\s*元", user_input)
+        city = next((name for name in CITY_NAMES if name in user_input), None)
+        days_ahead = next((days for word, days in (("大后天", 3), ("后天", 2), ("明天", 1)) if word in user_input), 0)
+        mapping = {
+            "title": (f"出差{city}" if city else "费用申请")[:14],
+            "description": user_input,
+            "requisitionMoney": {
+                "standard": f"{float(amount.group(1)) if amount else 1000:.2f}",
+                "standardUnit": "元",
+                "standardScale": 2,
+                "standardSymbol": "¥",
+                "standardNumCode": "156",
+                "standardStrCode": "CNY"
+            },
+            "requisitionDate": int((time.time() + 86400 * days_ahead) * 1000),
+            "u_项目": "智能申请单项目"
+        }
+        if city:
+            mapping["u_城市"] = city
+        return mapping
+
+
+def configure_offline_environment() -> str:
+    """
+    设置离线运行所需的环境变量（需在导入config/main之前调用）
+
+    Token、共享缓存、审计日志、字段映射缓存和用量库写入临时目录，避免覆盖真实的文件；关闭后台健康探测的频繁轮询。
+    返回临时目录路径。
+    """
+    workdir = tempfile.mkdtemp(prefix="expense-bench-")
+    os.environ.setdefault("TOKEN_CACHE_FILE", os.path.join(workdir, ".token_cache.json"))
+    os.environ.setdefault("AUDIT_LOG_FILE", os.path.join(workdir, ".audit_log.jsonl"))
+    os.environ.setdefault("FIELD_MAPPING_CACHE_FILE", os.path.join(workdir, ".field_mapping_cache.json"))
+    os.environ.setdefault("USAGE_DB_FILE", os.path.join(workdir, ".usage.db"))
+    os.environ.setdefault("SHARED_CACHE_BACKEND", "memory")
+    os.environ.setdefault("HEALTH_PROBE_INTERVAL", "3600")
+    return workdir
@@ -1,6 +1,7 @@
 """
 配置管理模块
 """
+import json
 import os
 from dotenv import load_dotenv
 
@@ -10,19 +11,75 @@ load_dotenv()
 # DeepSeek AI配置
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-43816199a7fd42f88e93b14358954b88")
 DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/chat/completions")
+DEEPSEEK_RATE_LIMIT = float(os.getenv("DEEPSEEK_RATE_LIMIT", "20"))  # 每秒最多发出的DeepSeek请求数，0表示不限速
+DEEPSEEK_BURST = float(os.getenv("DEEPSEEK_BURST", "40"))  # 令牌桶容量（允许的瞬时突发请求数）
+DEEPSEEK_MAX_IN_FLIGHT = int(os.getenv("DEEPSEEK_MAX_IN_FLIGHT", "32"))  # 同时进行的DeepSeek请求上限，0表示不限
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")  # 调用场景未指定模型时使用
+# 按调用场景的模型和参数（model/max_tokens/temperature/json/timeout/hedge），未列出的键使用默认值；
+# 环境变量DEEPSEEK_CALL_PROFILES（JSON）按场景覆盖，如 {"extract": {"model": "deepseek-chat", "max_tokens": 600}}
+DEEPSEEK_CALL_PROFILES = {
+    "intent": {"max_tokens": 512, "hedge": True, "timeout": 20},  # 只需要输出一个工具调用
+    "extract": {"max_tokens": 800, "json": True, "timeout": 60},  # 字段映射JSON
+    "repair": {"max_tokens": 400, "json": True, "timeout": 30}  # 只重新提取几个字段
+}
+for _site, _overrides in json.loads(os.getenv("DEEPSEEK_CALL_PROFILES", "{}")).items():
+    DEEPSEEK_CALL_PROFILES[_site] = dict(DEEPSEEK_CALL_PROFILES.get(_site, {}), **_overrides)
+DEEPSEEK_HEDGING_ENABLED = os.getenv("DEEPSEEK_HEDGING_ENABLED", "false").lower() == "true"  # 超过p95未返回时发送对冲请求
 
 # 易快报认证配置
 EK_APP_KEY = os.getenv("EK_APP_KEY", "b433ffa4-ff6e-4e76-95e6-1a7bed8777eb")
 EK_APP_SECURITY = os.getenv("EK_APP_SECURITY", "60ec2aa6-6354-40b5-a742-0e1034962b2f")
 EK_BASE_URL = os.getenv("EK_BASE_URL", "https://app.ekuaibao.com/api/openapi")
+EKUAIBAO_PAGE_SIZE = int(os.getenv("EKUAIBAO_PAGE_SIZE", "100"))  # 列表接口每页条数（start/count分页）
+EKUAIBAO_PAGE_PARALLELISM = int(os.getenv("EKUAIBAO_PAGE_PARALLELISM", "4"))  # 总数已知时同时拉取的页数
+EKUAIBAO_MAX_LIST_ITEMS = int(os.getenv("EKUAIBAO_MAX_LIST_ITEMS", "50000"))  # 单个列表最多读取的条数（安全上限）
 
 # 服务配置
 SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
 
 # 缓存配置
-TOKEN_CACHE_FILE = ".token_cache.json"
-FIELD_MAPPING_CACHE_FILE = ".field_mapping_cache.json"
+TOKEN_CACHE_FILE = os.getenv("TOKEN_CACHE_FILE", ".token_cache.json")
+TOKEN_LOCK_TIMEOUT = float(os.getenv("TOKEN_LOCK_TIMEOUT", "30"))  # 跨worker刷新锁等待上限（秒）
+TOKEN_STARTUP_REUSE_SECONDS = int(os.getenv("TOKEN_STARTUP_REUSE_SECONDS", "120"))  # 启动时复用其他worker刚刷新的Token
+FIELD_MAPPING_CACHE_FILE = os.getenv("FIELD_MAPPING_CACHE_FILE", ".field_mapping_cache.json")
+FIELD_MAPPING_CACHE_ENABLED = os.getenv("FIELD_MAPPING_CACHE_ENABLED", "true").lower() == "true"  # 字段提取模式缓存
+FIELD_MAPPING_CACHE_MAX_ENTRIES = int(os.getenv("FIELD_MAPPING_CACHE_MAX_ENTRIES", "2000"))
+EXTRACTION_STREAMING_ENABLED = os.getenv("EXTRACTION_STREAMING_ENABLED", "true").lower() == "true"  # 字段提取使用流式输出
+
+# 跨worker共享缓存配置（sqlite: 本机WAL文件；memory: 仅当前进程；redis: 多机共享，需安装redis包）
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "sqlite")
+SHARED_CACHE_FILE = os.getenv("SHARED_CACHE_FILE", ".shared_cache.db")
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0")
+CACHE_VERSION_CHECK_INTERVAL = float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "1.0"))  # 失效广播最大感知延迟（秒）
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "60"))  # 模板缓存秒数，0表示每次实时拉取
+DIMENSION_CACHE_TTL = int(os.getenv("DIMENSION_CACHE_TTL", "300"))  # 档案类别/档案项缓存秒数，0表示不缓存
+LEARNED_CONSTRAINT_TTL = int(os.getenv("LEARNED_CONSTRAINT_TTL", "604800"))  # 从400错误中学到的字段约束保留秒数（按模板版本）
+
+# 申请单创建幂等（同一幂等键在窗口内只创建一次）
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", "600"))  # 已完成结果保留秒数，重复提交直接返回
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))  # 等待进行中创建的最长秒数
+
+# 启动预热配置
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "20"))  # 预热时间预算，超时后带降级状态就绪
+SPECULATIVE_PREFETCH_ENABLED = os.getenv("SPECULATIVE_PREFETCH_ENABLED", "true").lower() == "true"  # 意图识别期间预取创建申请单所需数据
+
+# 健康探测与熔断配置
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))  # 后台探测间隔（秒）
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "3"))  # 单次探测超时（秒）
+READYZ_REQUIRE_UPSTREAMS = os.getenv("READYZ_REQUIRE_UPSTREAMS", "false").lower() == "true"  # 上游熔断时就绪探针是否失败
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # 连续失败多少次后熔断
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))  # 熔断后多久半开重试
+
+# 出站调用弹性配置（超时取观测p99延迟×倍数，并限制在上下限之间；重试仅用于幂等GET）
+UPSTREAM_DEFAULT_TIMEOUT = float(os.getenv("UPSTREAM_DEFAULT_TIMEOUT", "30"))  # 延迟样本不足时的超时（秒）
+UPSTREAM_MIN_TIMEOUT = float(os.getenv("UPSTREAM_MIN_TIMEOUT", "2"))
+UPSTREAM_MAX_TIMEOUT = float(os.getenv("UPSTREAM_MAX_TIMEOUT", "30"))
+UPSTREAM_TIMEOUT_P99_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_P99_MULTIPLIER", "2.0"))
+UPSTREAM_RETRY_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))  # 退避基数（秒）
 
 # 日志配置
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -33,3 +90,24 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 
 
+LOG_FILE = os.getenv("LOG_FILE", "")  # 为空时只输出到控制台
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text 或 json（每行一个JSON对象）
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))  # DEBUG级别记录请求/响应内容时的截断长度
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))  # DEBUG级别记录请求/响应内容的采样率
+
+# 申请单创建审计日志（JSONL，后台线程批量写入并fsync，按大小轮转）
+AUDIT_LOG_ENABLED = os.getenv("AUDIT_LOG_ENABLED", "true").lower() == "true"
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", ".audit_log.jsonl")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # 单个文件上限，超出后轮转
+AUDIT_LOG_BACKUP_COUNT = int(os.getenv("AUDIT_LOG_BACKUP_COUNT", "5"))  # 保留的历史文件数
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "1.0"))  # 批量写入间隔（秒）
+
+# DeepSeek用量记账（按调用场景/会话/用户汇总token和延迟，定期写入SQLite）与费用预算
+USAGE_DB_FILE = os.getenv("USAGE_DB_FILE", ".usage.db")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))  # 内存汇总写入SQLite的间隔（秒）
+DEEPSEEK_PRICE_INPUT = float(os.getenv("DEEPSEEK_PRICE_INPUT", "2"))  # 元/百万输入token（未命中上下文缓存）
+DEEPSEEK_PRICE_INPUT_CACHE_HIT = float(os.getenv("DEEPSEEK_PRICE_INPUT_CACHE_HIT", "0.5"))  # 元/百万输入token（命中缓存）
+DEEPSEEK_PRICE_OUTPUT = float(os.getenv("DEEPSEEK_PRICE_OUTPUT", "8"))  # 元/百万输出token
+DEEPSEEK_TOKENS_PER_CHAR = float(os.getenv("DEEPSEEK_TOKENS_PER_CHAR", "0.6"))  # 流式输出中断、拿不到用量时按字符数估算token
+USAGE_USER_DAILY_BUDGET = float(os.getenv("USAGE_USER_DAILY_BUDGET", "0"))  # 每个用户每天的费用上限（元），0表示不限
+USAGE_GLOBAL_DAILY_BUDGET = float(os.getenv("USAGE_GLOBAL_DAILY_BUDGET", "0"))  # 全局每天的费用上限（元），0表示不限
@@ -2,33 +2,77 @@
 FastAPI主服务
 处理聊天接口和工具调用路由
 """
+import asyncio
 import json
 import logging
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import uvicorn
 
 from services.auth_service import AuthService
 from services.deepseek_service import DeepSeekService
+from services.health_service import HealthProber
+from services.logging_setup import configure_logging, log_payload
+from services.metrics import metrics
+from services.resilience import CircuitOpenError, get_gateway
+from services.speculation import SpeculativeExecutor
+from services.tool_registry import ToolError
+from services.usage_ledger import bind_usage_context
+from services.warmup import WarmupService
 from smart_expense_mcp import SmartExpenseMCP
-from config import SERVER_HOST, SERVER_PORT
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from config import (
+    SERVER_HOST, SERVER_PORT, WARMUP_ENABLED, WARMUP_TIMEOUT_SECONDS,
+    HEALTH_PROBE_INTERVAL, READYZ_REQUIRE_UPSTREAMS, SPECULATIVE_PREFETCH_ENABLED
 )
+
+# 配置日志（经队列异步输出，LOG_LEVEL/LOG_FILE/LOG_FORMAT可配置）
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# 初始化服务
+auth_service = AuthService()
+deepseek_service = DeepSeekService()
+mcp_service = SmartExpenseMCP()
+warmup_service = WarmupService(mcp_service, auth_service, timeout=WARMUP_TIMEOUT_SECONDS)
+health_prober = HealthProber(mcp_service.auth_service, deepseek_service, interval=HEALTH_PROBE_INTERVAL)
+speculation = SpeculativeExecutor("create")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：后台执行启动预热和上游健康探测，监听跨worker缓存失效广播"""
+    background_tasks = [
+        asyncio.create_task(mcp_service.cache.listen_invalidations()),
+        asyncio.create_task(health_prober.run()),
+        asyncio.create_task(deepseek_service.usage.run_flusher())
+    ]
+    if WARMUP_ENABLED:
+        background_tasks.append(asyncio.create_task(warmup_service.run()))
+    else:
+        warmup_service.state.status = "disabled"
+    
+    yield
+    
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await warmup_service.aclose()
+    await speculation.shutdown()
+    await get_gateway().aclose()
+    await asyncio.to_thread(mcp_service.audit_log.stop)  # 写完剩余的审计记录
+    await asyncio.to_thread(deepseek_service.usage.flush)  # 写入剩余的用量汇总
+
 # 创建FastAPI应用
 app = FastAPI(
     title="AI智能申请单系统",
     description="基于DeepSeek AI的智能申请单创建系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -40,11 +84,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化服务
-auth_service = AuthService()
-deepseek_service = DeepSeekService()
-mcp_service = SmartExpenseMCP()
-
 # 请求模型
 class ChatMessage(BaseModel):
     role: str
@@ -53,6 +92,8 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: List[ChatMessage] = []
+    session_id: Optional[str] = None  # 前端会话ID，用于识别重复提交和按会话统计用量
+    user_id: Optional[str] = None  # 用户标识，用于按用户统计用量和执行预算
 
 class ChatResponse(BaseModel):
     message: str
@@ -88,16 +129,10 @@ async def get_version():
             ]
         }
         
-        # 获取易快报API版本信息
-        try:
-            token = await auth_service.get_access_token()
-            # 可以通过调用易快报API获取版本信息
-            version_info["ekuaibao_status"] = "connected"
-            version_info["token_status"] = "active"
-        except Exception as e:
-            version_info["ekuaibao_status"] = "error"
-            version_info["token_status"] = "inactive"
-            logger.warning(f"获取易快报版本信息失败: {e}")
+        # 易快报状态取自后台健康探测的缓存结果，不发起上游调用
+        ekuaibao_ok = health_prober.upstreams["ekuaibao"]["status"] == "ok"
+        version_info["ekuaibao_status"] = "connected" if ekuaibao_ok else "error"
+        version_info["token_status"] = "active" if mcp_service.auth_service.token_store.is_valid(margin_seconds=0) else "inactive"
         
         return version_info
         
@@ -107,41 +142,71 @@ async def get_version():
             "error": f"获取版本信息失败: {str(e)}"
         }
 
+@app.get("/livez")
+async def liveness_check():
+    """存活探针：进程能响应即存活，不访问任何上游"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_check():
+    """就绪探针：启动预热完成（或超出时间预算降级）后才报告就绪，上游状态取自后台探测缓存"""
+    warmup = warmup_service.state
+    ready = warmup.is_ready
+    if READYZ_REQUIRE_UPSTREAMS and not health_prober.all_healthy:
+        ready = False
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else ("warming_up" if not warmup.is_ready else "upstream_unavailable"),
+            "warmup": warmup.to_dict(),
+            "health": health_prober.snapshot()
+        }
+    )
+
 @app.get("/health")
 async def health_check():
-    """健康检查"""
-    try:
-        # 测试认证服务
-        auth_status = await auth_service.test_connection()
-        
-        # 测试AI服务
-        ai_status = await deepseek_service.test_connection()
-        
-        return {
-            "status": "healthy",
-            "services": {
-                "auth_service": "ok" if auth_status else "error",
-                "deepseek_service": "ok" if ai_status else "error"
-            }
-        }
-    except Exception as e:
-        logger.error(f"健康检查失败: {e}")
-        return {
-            "status": "unhealthy",
-            "error": str(e)
-        }
+    """健康检查（读取后台探测缓存的状态，不发起上游调用）"""
+    upstreams = health_prober.upstreams
+    return {
+        "status": "healthy" if health_prober.all_healthy else "unhealthy",
+        "services": {
+            "auth_service": upstreams["ekuaibao"]["status"],
+            "deepseek_service": upstreams["deepseek"]["status"]
+        },
+        "breakers": health_prober.snapshot()["breakers"]
+    }
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """聊天接口"""
+async def chat_endpoint(request: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    """聊天接口（可通过Idempotency-Key请求头指定幂等键）"""
+    
+    with metrics.timer("chat.total"):
+        response = await _handle_chat(request, idempotency_key)
+    metrics.incr(f"chat.response.{response.type}")
+    return response
+
+async def _handle_chat(request: ChatRequest, idempotency_key: Optional[str] = None) -> ChatResponse:
+    """处理一次聊天请求"""
     
+    prefetch = None
+    prefetch_used = False
     try:
         user_message = request.message.strip()
         
         if not user_message:
             raise HTTPException(status_code=400, detail="消息不能为空")
         
-        logger.info(f"收到用户消息: {user_message}")
+        logger.info("收到用户消息: %s", user_message)
+        bind_usage_context(request.session_id, request.user_id)
+        
+        # 重复提交：同一幂等键已完成创建时直接返回结果，不再做意图识别
+        key = mcp_service.idempotency.derive_key(idempotency_key, request.session_id, user_message)
+        stored = await mcp_service.idempotency.completed(key)
+        if stored is not None:
+            metrics.incr("idempotency.replayed")
+            logger.info("♻️ 重复的创建请求，返回已完成的结果")
+            return ChatResponse(message=stored["message"], type="success")
+        mcp_service.idempotency.bind(key)
         
         # 构建对话历史
         messages = []
@@ -149,50 +214,47 @@ async def chat_endpoint(request: ChatRequest):
             messages.append({"role": msg.role, "content": msg.content})
         messages.append({"role": "user", "content": user_message})
         
-        # 获取MCP工具定义
-        tools = deepseek_service.get_mcp_tools()
+        # 像是创建申请单时，在意图识别期间并发预取模板、档案和Token
+        if SPECULATIVE_PREFETCH_ENABLED and mcp_service.looks_like_creation(user_message):
+            prefetch = speculation.start(mcp_service.prefetch_for_creation())
         
-        # 调用AI进行对话
-        ai_result = await deepseek_service.chat_with_tools(messages, tools)
+        # 调用AI进行对话（工具定义由MCP工具注册表预先序列化）；用量超出预算时创建申请单在本地识别意图
+        if not deepseek_service.usage.within_budget() and mcp_service.looks_like_creation(user_message):
+            logger.warning("💰 DeepSeek用量超出预算，本地识别为创建申请单")
+            metrics.incr("usage.budget_degraded")
+            ai_result = _local_tool_call("create_smart_expense", {"user_input": user_message})
+        else:
+            with metrics.timer("chat.intent"):
+                ai_result = await deepseek_service.chat_with_tools(messages, mcp_service.tools.schemas_json)
         
-        logger.info(f"AI响应: {ai_result}")
+        log_payload(logger, "AI响应", ai_result)
         
         # 解析AI响应
         if ai_result.get("choices"):
             ai_message = ai_result["choices"][0]["message"]
             
-            logger.info(f"AI消息: {ai_message}")
-            
             # 检查是否有工具调用
             if ai_message.get("tool_calls"):
                 # AI要求调用工具
                 tool_call = ai_message["tool_calls"][0]
                 tool_name = tool_call["function"]["name"]
-                tool_args = json.loads(tool_call["function"]["arguments"])
+                tool_args = tool_call["function"]["arguments"]
+                prefetch_used = tool_name == "create_smart_expense"
                 
-                logger.info(f"AI请求调用工具: {tool_name}, 参数: {tool_args}")
+                logger.info("AI请求调用工具: %s, 参数: %s", tool_name, tool_args)
+                metrics.incr(f"chat.tool.{tool_name}")
+                tool_started = time.perf_counter()
                 
-                # 调用MCP工具
-                if tool_name == "get_template_fields":
-                    mcp_result = await mcp_service.get_template_fields()
+                # 调用MCP工具（按名称查找并校验参数）
+                try:
+                    spec, mcp_result = await mcp_service.tools.dispatch(mcp_service, tool_name, tool_args)
                     response_message = mcp_result["message"]
-                    response_type = "template_fields" if mcp_result["success"] else "error"
-                
-                elif tool_name == "create_smart_expense":
-                    user_input = tool_args.get("user_input", "")
-                    mcp_result = await mcp_service.create_smart_expense(user_input)
-                    response_message = mcp_result["message"]
-                    response_type = "success" if mcp_result["success"] else "error"
-                
-                elif tool_name == "get_document_by_code":
-                    code = tool_args.get("code", "")
-                    mcp_result = await mcp_service.get_document_by_code(code)
-                    response_message = mcp_result["message"]
-                    response_type = "success" if mcp_result["success"] else "error"
-                
-                else:
-                    response_message = f"未知的工具调用: {tool_name}"
+                    response_type = spec.response_type if mcp_result["success"] else "error"
+                except ToolError as e:
+                    response_message = str(e)
                     response_type = "error"
+                
+                metrics.observe(f"chat.tool.{tool_name}", time.perf_counter() - tool_started)
             
             else:
                 # AI直接回复
@@ -210,9 +272,65 @@ async def chat_endpoint(request: ChatRequest):
     
     except HTTPException:
         raise
+    except CircuitOpenError as e:
+        # 上游熔断：快速返回，不让请求堆积等待超时
+        logger.warning("聊天处理快速失败: %s", e)
+        return ChatResponse(
+            message="⚠️ AI服务暂时不可用，请稍后重试",
+            type="error"
+        )
     except Exception as e:
-        logger.error(f"聊天处理失败: {e}")
+        logger.error("聊天处理失败: %s", e)
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+    finally:
+        if prefetch is not None:
+            speculation.settle(prefetch, prefetch_used)
+
+def _local_tool_call(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """本地确定的工具调用（与DeepSeek工具调用响应格式相同）"""
+    return {"choices": [{"message": {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{"type": "function", "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}}]
+    }}]}
+
+@app.get("/api/usage")
+async def get_usage(day: Optional[str] = None, group_by: str = "call_site"):
+    """DeepSeek用量与估算费用（按call_site/user_id/session_id分组，默认当天）"""
+    ledger = deepseek_service.usage
+    try:
+        rows = await asyncio.to_thread(ledger.report, day, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "day": day or time.strftime("%Y-%m-%d"),
+        "group_by": group_by,
+        "rows": rows,
+        "budget": {
+            "global_daily": ledger.global_daily_budget or None,
+            "user_daily": ledger.user_daily_budget or None,
+            "global_spent": round(ledger.spent(), 6)
+        }
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标：各阶段耗时分位数、计数器和上游延迟"""
+    snapshot = metrics.snapshot()
+    snapshot["upstream_latency"] = get_gateway().latency_stats()
+    return snapshot
+
+@app.post("/api/cache/invalidate")
+async def invalidate_cache(namespace: str = "template"):
+    """使共享缓存失效（template/dimension），所有worker同步感知"""
+    if namespace not in ("template", "dimension"):
+        raise HTTPException(status_code=400, detail=f"未知的缓存命名空间: {namespace}")
+    version = await mcp_service.invalidate_cache(namespace)
+    return {
+        "success": True,
+        "message": f"缓存 {namespace} 已失效",
+        "version": version
+    }
 
 @app.post("/api/test-auth")
 async def test_auth():
@@ -0,0 +1,140 @@
+"""
+申请单创建审计日志
+每次创建申请单追加一条紧凑的JSONL记录（用户输入哈希、提取的字段映射、模板版本、单据编号、各阶段耗时），
+由后台线程批量写入并fsync，文件超过上限时轮转；写入队列满时丢弃记录，绝不阻塞请求
+"""
+import atexit
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import (
+    AUDIT_LOG_ENABLED, AUDIT_LOG_FILE, AUDIT_LOG_MAX_BYTES, AUDIT_LOG_BACKUP_COUNT, AUDIT_LOG_FLUSH_INTERVAL
+)
+from services.json_codec import dumps_bytes
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def hash_text(text: str) -> str:
+    """用户输入只记录哈希（SHA-256前16位），不落原文"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class AuditLog:
+    """追加写入的JSONL审计日志（后台线程写入）"""
+
+    MAX_QUEUE = 10000
+    MAX_BATCH = 500
+
+    def __init__(self, path: str, max_bytes: int = AUDIT_LOG_MAX_BYTES, backup_count: int = AUDIT_LOG_BACKUP_COUNT,
+                 flush_interval: float = AUDIT_LOG_FLUSH_INTERVAL, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=self.MAX_QUEUE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        metrics.register_gauge("audit.queue_size", self._queue.qsize)
+
+    def record(self, event: str, **fields: Any):
+        """追加一条审计记录（只做编码和入队，不做任何I/O）"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        entry = {"ts": round(time.time(), 3), "event": event, **fields}
+        try:
+            self._queue.put_nowait(dumps_bytes(entry) + b"\n")
+            metrics.incr("audit.recorded")
+        except queue.Full:
+            metrics.incr("audit.dropped")
+        except Exception as e:
+            metrics.incr("audit.dropped")
+            logger.warning("审计记录编码失败: %s", e)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """写完队列中剩余的记录后停止后台线程"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        """后台线程：按flush_interval批量写入，每批一次fsync"""
+        stopping = False
+        while not stopping:
+            batch: List[bytes] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.MAX_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[bytes]):
+        try:
+            self._rotate_if_needed()
+            # 无缓冲追加：每批一次write系统调用，多个worker写同一文件时记录不会交错
+            with open(self.path, "ab", buffering=0) as f:
+                f.write(b"".join(batch))
+                os.fsync(f.fileno())
+            metrics.incr("audit.flushes")
+        except OSError as e:
+            metrics.incr("audit.dropped", len(batch))
+            logger.error("写入审计日志失败: %s", e)
+
+    def _rotate_if_needed(self):
+        """文件超过上限时轮转：path -> path.1 -> path.2 ...，最旧的文件被删除"""
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+_audit_log: Optional[AuditLog] = None
+
+
+def get_audit_log() -> AuditLog:
+    """获取进程内唯一的审计日志"""
+    global _audit_log
+    if _audit_log is None:
+        _audit_log = AuditLog(AUDIT_LOG_FILE, enabled=AUDIT_LOG_ENABLED)
+    return _audit_log
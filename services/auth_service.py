@@ -2,12 +2,15 @@
 易快报认证服务
 实现Token获取、刷新和缓存管理
 """
-import httpx
-import json
-import time
 import logging
 from typing import Optional
-from config import EK_APP_KEY, EK_APP_SECURITY, EK_BASE_URL, TOKEN_CACHE_FILE
+from config import (
+    EK_APP_KEY, EK_APP_SECURITY, EK_BASE_URL, TOKEN_CACHE_FILE,
+    TOKEN_LOCK_TIMEOUT, TOKEN_STARTUP_REUSE_SECONDS, SHARED_CACHE_BACKEND, HEALTH_PROBE_TIMEOUT
+)
+from services.resilience import get_gateway
+from services.shared_cache import get_shared_cache
+from services.token_store import TokenStore
 
 logger = logging.getLogger(__name__)
 
@@ -19,69 +22,72 @@ class AuthService:
         self.app_security = EK_APP_SECURITY
         self.base_url = EK_BASE_URL
         self.cache_file = TOKEN_CACHE_FILE
-        self._token_cache = None
+        self.gateway = get_gateway()
+        # 本机多worker通过Token文件+文件锁共享；Redis共享缓存时改用共享缓存，支持多机共享
+        shared_cache = get_shared_cache() if SHARED_CACHE_BACKEND == "redis" else None
+        self.token_store = TokenStore(TOKEN_CACHE_FILE, lock_timeout=TOKEN_LOCK_TIMEOUT, shared_cache=shared_cache)
         self._startup_token_refreshed = False  # 标记启动时是否已刷新TOKEN
     
+    @property
+    def _token_cache(self) -> Optional[dict]:
+        """当前内存中的令牌（兼容旧属性名）"""
+        return self.token_store.token
+    
     async def get_access_token(self) -> str:
-        """获取访问令牌（每次启动强制刷新）"""
+        """获取访问令牌（每次启动强制刷新，多worker共享同一个有效令牌）"""
+        
+        # 热路径：内存令牌有效时直接返回，不触碰磁盘
+        if self._startup_token_refreshed and self._is_token_valid():
+            return self._token_cache["accessToken"]
         
-        # 启动时强制刷新TOKEN
-        if not self._startup_token_refreshed:
-            logger.info("🔄 启动时强制刷新TOKEN")
-            self._startup_token_refreshed = True
+        async with self.token_store.exclusive():
+            # 拿到锁后重新读取磁盘：其他worker可能刚刚刷新过令牌
+            await self.token_store.load()
             
-            # 加载缓存的token
-            self._load_token_cache()
+            # 启动时强制刷新TOKEN（其他worker刚在启动窗口内刷新过的令牌直接复用）
+            if not self._startup_token_refreshed:
+                self._startup_token_refreshed = True
+                if self._is_token_valid() and self.token_store.refreshed_within(TOKEN_STARTUP_REUSE_SECONDS):
+                    logger.info("复用其他worker刚刷新的访问令牌")
+                    return self._token_cache["accessToken"]
+                
+                logger.info("🔄 启动时强制刷新TOKEN")
+                if self._token_cache and self._token_cache.get("refreshToken"):
+                    logger.info("使用refreshToken刷新访问令牌")
+                    if await self._refresh_token_locked():
+                        return self._token_cache["accessToken"]
+                
+                # 如果刷新失败，获取新令牌
+                logger.info("获取全新的访问令牌")
+                return await self._get_new_token()
+            
+            if self._is_token_valid():
+                logger.info("使用缓存的访问令牌")
+                return self._token_cache["accessToken"]
             
             # 尝试刷新令牌
             if self._token_cache and self._token_cache.get("refreshToken"):
-                logger.info("使用refreshToken刷新访问令牌")
-                if await self._refresh_token():
+                logger.info("尝试刷新访问令牌")
+                if await self._refresh_token_locked():
                     return self._token_cache["accessToken"]
             
-            # 如果刷新失败，获取新令牌
-            logger.info("获取全新的访问令牌")
+            # 重新获取令牌
+            logger.info("获取新的访问令牌")
             return await self._get_new_token()
-        
-        # 非启动时检查缓存
-        if self._is_token_valid():
-            logger.info("使用缓存的访问令牌")
-            return self._token_cache["accessToken"]
-        
-        # 尝试刷新令牌
-        if self._token_cache and self._token_cache.get("refreshToken"):
-            logger.info("尝试刷新访问令牌")
-            if await self._refresh_token():
-                return self._token_cache["accessToken"]
-        
-        # 重新获取令牌
-        logger.info("获取新的访问令牌")
-        return await self._get_new_token()
     
     def _is_token_valid(self) -> bool:
-        """检查令牌是否有效"""
-        
-        if not self._token_cache:
-            self._load_token_cache()
-        
-        if not self._token_cache:
-            return False
-        
-        # 检查是否过期（提前5分钟刷新）
-        expire_time = self._token_cache.get("expireTime", 0) / 1000
-        current_time = time.time()
-        
-        is_valid = current_time < (expire_time - 300)  # 提前5分钟
+        """检查内存中的令牌是否有效（提前5分钟刷新）"""
+        is_valid = self.token_store.is_valid(margin_seconds=300)
         
         if is_valid:
-            logger.debug(f"Token有效，过期时间: {expire_time}, 当前时间: {current_time}")
+            logger.debug("Token有效，过期时间: %s", self._token_cache.get('expireTime', 0) / 1000)
         else:
-            logger.debug(f"Token已过期或即将过期，过期时间: {expire_time}, 当前时间: {current_time}")
+            logger.debug("Token不存在、已过期或即将过期")
         
         return is_valid
     
     async def _get_new_token(self) -> str:
-        """获取新的访问令牌"""
+        """获取新的访问令牌（调用方需持有token_store锁）"""
         
         url = f"{self.base_url}/v1/auth/getAccessToken"
         payload = {
@@ -91,20 +97,18 @@ class AuthService:
         
         logger.info(f"调用易快报API获取新Token: {url}")
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            logger.info(f"获取Token成功: {result.get('value', {}).get('accessToken', 'Unknown')[:20]}...")
-            
-            self._token_cache = result["value"]
-            self._save_token_cache()
-            
-            return self._token_cache["accessToken"]
+        response = await self.gateway.request("ekuaibao", "auth", "POST", url, json=payload)
+        response.raise_for_status()
+        
+        result = response.json()
+        logger.info(f"获取Token成功: {result.get('value', {}).get('accessToken', 'Unknown')[:20]}...")
+        
+        await self.token_store.save(result["value"])
+        
+        return self._token_cache["accessToken"]
     
-    async def _refresh_token(self) -> bool:
-        """刷新访问令牌"""
+    async def _refresh_token_locked(self) -> bool:
+        """刷新访问令牌（调用方需持有token_store锁）"""
         
         try:
             url = f"{self.base_url}/v2/auth/refreshToken"
@@ -116,43 +120,33 @@ class AuthService:
             
             logger.info(f"刷新Token: {url}")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, params=params)
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.info(f"刷新Token成功: {result.get('value', {}).get('accessToken', 'Unknown')[:20]}...")
-                
-                self._token_cache = result["value"]
-                self._save_token_cache()
-                
-                return True
+            response = await self.gateway.request("ekuaibao", "auth", "POST", url, params=params)
+            response.raise_for_status()
+            
+            result = response.json()
+            logger.info(f"刷新Token成功: {result.get('value', {}).get('accessToken', 'Unknown')[:20]}...")
+            
+            await self.token_store.save(result["value"])
+            
+            return True
                 
         except Exception as e:
             logger.error(f"刷新令牌失败: {e}")
             return False
     
-    def _load_token_cache(self):
-        """加载令牌缓存"""
-        try:
-            with open(self.cache_file, 'r') as f:
-                self._token_cache = json.load(f)
-                logger.debug("加载Token缓存成功")
-        except FileNotFoundError:
-            logger.debug("Token缓存文件不存在")
-            self._token_cache = None
-        except Exception as e:
-            logger.error(f"加载Token缓存失败: {e}")
-            self._token_cache = None
-    
-    def _save_token_cache(self):
-        """保存令牌缓存"""
-        try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self._token_cache, f)
-                logger.debug("保存Token缓存成功")
-        except Exception as e:
-            logger.error(f"保存Token缓存失败: {e}")
+    async def probe(self) -> bool:
+        """轻量健康探测：使用缓存的令牌读取一条档案类别"""
+        url = f"{self.base_url}/v1/dimensions"
+        params = {
+            "accessToken": await self.get_access_token(),
+            "start": 0,
+            "count": 1
+        }
+        response = await self.gateway.request(
+            "ekuaibao", "probe", "GET", url, params=params, timeout=HEALTH_PROBE_TIMEOUT
+        )
+        response.raise_for_status()
+        return True
     
     async def test_connection(self) -> bool:
         """测试连接是否正常"""
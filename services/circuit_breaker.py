@@ -0,0 +1,84 @@
+"""
+熔断器
+连续失败达到阈值后打开，冷却期后半开放行一次探测请求，成功则关闭
+"""
+import time
+from typing import Any, Dict
+
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_SECONDS
+
+
+class CircuitBreaker:
+    """单个上游（或上游端点）的熔断器"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = CIRCUIT_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._half_open_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def is_open(self) -> bool:
+        """熔断打开（不含半开）"""
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        """是否放行请求：关闭时放行，半开时只放行一个探测请求"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._half_open_in_flight:
+            self._half_open_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._half_open_in_flight = False
+
+    def release_probe(self):
+        """探测请求没有结果就结束（被取消或由调用方中止）时交还探测名额，不计成功也不计失败"""
+        self._half_open_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._half_open_in_flight = False
+        if self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """按名称获取（或创建）进程内共享的熔断器"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """所有熔断器的当前状态"""
+    return {name: breaker.to_dict() for name, breaker in _breakers.items()}
@@ -2,21 +2,64 @@
 DeepSeek AI服务
 处理AI对话和工具调用
 """
-import httpx
+import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Optional
-from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+import time
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple, Union
+from config import (
+    DEEPSEEK_API_KEY, DEEPSEEK_API_URL, DEEPSEEK_MODEL, DEEPSEEK_CALL_PROFILES, DEEPSEEK_HEDGING_ENABLED,
+    DEEPSEEK_TOKENS_PER_CHAR, HEALTH_PROBE_TIMEOUT
+)
+from services.json_codec import dumps_bytes, JSON_CONTENT_TYPE
+from services.metrics import LatencyTracker, metrics
+from services.resilience import get_gateway
+from services.scheduler import get_scheduler
+from services.usage_ledger import get_usage_ledger
 
 logger = logging.getLogger(__name__)
 
+# 调用场景对应的调度优先级类别（未列出的场景按批量处理）
+CALL_SITE_PRIORITY = {
+    "intent": "interactive",
+    "chat": "interactive",
+    "extract": "extraction",
+    "repair": "extraction",
+    "probe": "probe"
+}
+HEDGE_MIN_SAMPLES = 20  # 调用场景的延迟样本不足时不对冲
+
+
+class CallProfile:
+    """一个调用场景的模型和请求参数"""
+
+    __slots__ = ("model", "max_tokens", "temperature", "json", "timeout", "hedge")
+
+    def __init__(self, model: str = DEEPSEEK_MODEL, max_tokens: int = 2000, temperature: float = 0.0,
+                 json: bool = False, timeout: Optional[float] = None, hedge: bool = False):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature  # 降低随机性，提高工具调用一致性
+        self.json = json  # 要求输出JSON对象（response_format=json_object）
+        self.timeout = timeout  # None表示使用网关按p99自适应的超时
+        self.hedge = hedge  # 超过该场景p95延迟未返回时发送对冲请求
+
+
+# 各调用场景的端到端延迟（对冲时机取p95）
+_call_site_latency: Dict[str, LatencyTracker] = {}
+
 class DeepSeekService:
     """DeepSeek AI服务"""
     
     def __init__(self):
         self.api_key = DEEPSEEK_API_KEY
         self.api_url = DEEPSEEK_API_URL
-        self.model = "deepseek-chat"
+        self.profiles = {site: CallProfile(**params) for site, params in DEEPSEEK_CALL_PROFILES.items()}
+        self.default_profile = CallProfile()
+        self.hedging = DEEPSEEK_HEDGING_ENABLED
+        self.gateway = get_gateway()
+        self.scheduler = get_scheduler()
+        self.usage = get_usage_ledger()
         
         # 强化自然语言理解的系统提示词
         self.system_prompt = """
@@ -38,6 +81,10 @@ class DeepSeekService:
    - "查询单据" + 编号
    → 调用 get_document_by_code()
 
+4. 查询档案信息：
+   - "有哪些档案"、"档案类别" → 调用 get_archive_categories()
+   - "项目可以选哪些"、"城市能填什么"、"有哪些可选项" → 调用 get_available_archive_options()
+
 核心理念：理解用户真实意图，不拘泥于具体用词。
 - "创建"、"提交"、"写一个"、"帮我做"都是同一个意思
 - 用户说话可能很随意，要智能理解背后的需求
@@ -46,40 +93,235 @@ class DeepSeekService:
 你必须调用工具，不能直接回复文字！
 """
     
-    async def chat_with_tools(self, messages: List[Dict[str, str]], tools: List[Dict] = None) -> Dict[str, Any]:
-        """与AI对话（支持工具调用）"""
-        
-        # 添加系统提示词
+    async def chat_with_tools(self, messages: List[Dict[str, str]],
+                              tools: Union[List[Dict], bytes, None] = None) -> Dict[str, Any]:
+        """
+        与AI对话（支持工具调用），自动在对话前加上意图识别系统提示词
+
+        tools可以是工具定义列表，也可以是预先序列化好的JSON数组字节（ToolRegistry.schemas_json），
+        后者直接拼接进请求体，不再逐次序列化工具定义。
+        """
         system_message = {"role": "system", "content": self.system_prompt}
-        full_messages = [system_message] + messages
+        return await self.chat([system_message] + messages, tools, call_site="intent")
+    
+    async def chat(self, messages: List[Dict[str, str]], tools: Union[List[Dict], bytes, None] = None,
+                   call_site: str = "chat") -> Dict[str, Any]:
+        """
+        发送对话请求（消息原样发送，不附加系统提示词）
+
+        call_site决定模型和请求参数、调度优先级，并用于按场景统计token用量和上下文缓存命中。
+        """
+        profile = self.profile(call_site)
+        payload = self._payload(messages, profile)
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        # 如果提供了工具，添加到请求中（强制AI使用工具，不允许纯文本回复）
+        if isinstance(tools, (bytes, bytearray)):
+            body = dumps_bytes(payload)[:-1] + b',"tools":' + tools + b',"tool_choice":"required"}'
+        else:
+            if tools:
+                payload["tools"] = tools
+                payload["tool_choice"] = "required"
+            body = dumps_bytes(payload)
         
-        payload = {
-            "model": self.model,
-            "messages": full_messages,
-            "max_tokens": 2000,
-            "temperature": 0.0,  # 降低随机性，提高工具调用一致性
-        }
+        logger.debug("调用DeepSeek API（%s），消息数量: %d", call_site, len(messages))
         
-        # 如果提供了工具，添加到请求中
-        if tools:
-            payload["tools"] = tools
-            payload["tool_choice"] = "required"  # 强制AI使用工具，不允许纯文本回复
+        started = time.perf_counter()
+        response, hedge_losers = await self._send(body, call_site, profile)
+        response.raise_for_status()
         
-        logger.info(f"调用DeepSeek API，消息数量: {len(full_messages)}")
+        result = response.json()
+        latency = time.perf_counter() - started
+        self._record_usage(call_site, result.get("usage"), latency)
+        for loser_usage in hedge_losers:
+            # 对冲落败的请求同样计费：没有拿到它的用量时按胜出请求估算（提示词相同）
+            metrics.incr(f"deepseek.{call_site}.hedge_billed")
+            self._record_usage(call_site, loser_usage or result.get("usage"), latency)
+        logger.debug("DeepSeek API响应成功")
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(self.api_url, headers=headers, json=payload)
-            response.raise_for_status()
+        return result
+    
+    async def chat_stream(self, messages: List[Dict[str, str]], call_site: str = "chat") -> AsyncIterator[str]:
+        """
+        流式对话（SSE）：逐段产出回复内容，结束时记录token用量
+
+        输出中途中断（调用方提前结束、被取消或连接出错）时同样记录用量：
+        已开始生成的请求照常计费，拿不到用量时按字符数估算。
+        """
+        profile = self.profile(call_site)
+        payload = self._payload(messages, profile)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        
+        logger.debug("调用DeepSeek流式API（%s），消息数量: %d", call_site, len(messages))
+        
+        started = time.perf_counter()
+        usage = None
+        generating = False
+        produced: List[str] = []
+        try:
+            async with self.scheduler.slot(self._priority(call_site)), \
+                    self.gateway.stream("deepseek", "chat", "POST", self.api_url, timeout=profile.timeout,
+                                        headers=self._headers(), content=dumps_bytes(payload)) as response:
+                self._check_throttled(response)
+                if response.status_code >= 400:
+                    await response.aread()
+                    response.raise_for_status()
+                generating = True
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            produced.append(content)
+                            yield content
+        finally:
+            if generating:
+                if usage is None:
+                    metrics.incr(f"deepseek.{call_site}.stream_interrupted")
+                    usage = self._estimated_usage(messages, "".join(produced))
+                self._record_usage(call_site, usage, time.perf_counter() - started)
+    
+    def profile(self, call_site: str) -> CallProfile:
+        return self.profiles.get(call_site, self.default_profile)
+    
+    async def _post(self, body: bytes, call_site: str, profile: CallProfile):
+        """经调度器发出一次对话请求"""
+        async with self.scheduler.slot(self._priority(call_site)):
+            response = await self.gateway.request("deepseek", "chat", "POST", self.api_url, timeout=profile.timeout,
+                                                  headers=self._headers(), content=body)
+        self._check_throttled(response)
+        return response
+    
+    def _hedge_delay(self, call_site: str, profile: CallProfile) -> Optional[float]:
+        """对冲等待时间：该场景的p95延迟（未开启对冲或样本不足时返回None）"""
+        if not (self.hedging and profile.hedge):
+            return None
+        tracker = _call_site_latency.get(call_site)
+        if tracker is None or len(tracker.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return tracker.percentile(95)
+    
+    async def _send(self, body: bytes, call_site: str,
+                    profile: CallProfile) -> Tuple[Any, List[Optional[Dict[str, Any]]]]:
+        """
+        发送对话请求；开启对冲时，超过该场景p95仍未返回且调度器没有排队请求时再发一份相同请求，
+        取先成功返回的响应并取消另一份
+
+        返回 (响应, 落败请求的用量列表)：落败但已发出的请求同样计费，仍在途被取消的记为None。
+        """
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(self._post(body, call_site, profile))]
+        try:
+            delay = self._hedge_delay(call_site, profile)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.scheduler.queue_depth() == 0:
+                    metrics.incr(f"deepseek.{call_site}.hedged")
+                    logger.debug("DeepSeek（%s）超过p95 %.0fms未返回，发送对冲请求", call_site, delay * 1000)
+                    tasks.append(asyncio.ensure_future(self._post(body, call_site, profile)))
             
-            result = response.json()
-            logger.info(f"DeepSeek API响应成功")
+            pending = set(tasks)
+            failed = winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        winner = task
+                        break
+                    failed = task
+            if winner is None:
+                return failed.result(), []  # 全部失败：抛出异常或返回最后的5xx响应
             
-            return result
+            response = winner.result()
+            if response.status_code < 400:
+                _call_site_latency.setdefault(call_site, LatencyTracker()).record(time.perf_counter() - started)
+            if len(tasks) > 1 and winner is tasks[1]:
+                metrics.incr(f"deepseek.{call_site}.hedge_won")
+            return response, self._billed_losers(tasks, winner)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    @staticmethod
+    def _billed_losers(tasks: List[asyncio.Future], winner: asyncio.Future) -> List[Optional[Dict[str, Any]]]:
+        """对冲落败的请求：已成功返回的取其用量，仍在途（随后取消）的记为None"""
+        billed = []
+        for task in tasks:
+            if task is winner:
+                continue
+            if not task.done():
+                billed.append(None)
+            elif not task.cancelled() and task.exception() is None and task.result().status_code < 400:
+                try:
+                    billed.append(task.result().json().get("usage"))
+                except ValueError:
+                    billed.append(None)
+        return billed
+    
+    @staticmethod
+    def _priority(call_site: str) -> str:
+        return CALL_SITE_PRIORITY.get(call_site, "bulk")
+    
+    def _check_throttled(self, response):
+        """429限流：按Retry-After（默认1秒）暂停调度器放行，避免后续请求继续撞限流"""
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get("retry-after", "1"))
+            except ValueError:
+                retry_after = 1.0
+            self.scheduler.throttle(retry_after)
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": JSON_CONTENT_TYPE
+        }
+    
+    @staticmethod
+    def _payload(messages: List[Dict[str, str]], profile: CallProfile) -> Dict[str, Any]:
+        payload = {
+            "model": profile.model,
+            "messages": messages,
+            "max_tokens": profile.max_tokens,
+            "temperature": profile.temperature,
+        }
+        if profile.json:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    @staticmethod
+    def _estimated_usage(messages: List[Dict[str, str]], completion: str) -> Dict[str, int]:
+        """按字符数估算一次调用的token用量（按未命中上下文缓存计）"""
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        return {
+            "prompt_tokens": round(prompt_chars * DEEPSEEK_TOKENS_PER_CHAR),
+            "prompt_cache_hit_tokens": 0,
+            "completion_tokens": round(len(completion) * DEEPSEEK_TOKENS_PER_CHAR)
+        }
+    
+    def _record_usage(self, call_site: str, usage: Optional[Dict[str, Any]], latency: float):
+        """按调用场景累计token用量和上下文缓存命中的前缀token数，并记入用量账本（按会话和用户）"""
+        self.usage.record(call_site, usage, latency)
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        hit_tokens = usage.get("prompt_cache_hit_tokens", 0)
+        metrics.incr(f"deepseek.{call_site}.prompt_tokens", prompt_tokens)
+        metrics.incr(f"deepseek.{call_site}.prompt_cache_hit_tokens", hit_tokens)
+        metrics.incr(f"deepseek.{call_site}.completion_tokens", usage.get("completion_tokens", 0))
+        logger.debug("DeepSeek token用量（%s）: 提示词 %d（缓存命中 %d），输出 %d",
+                     call_site, prompt_tokens, hit_tokens, usage.get("completion_tokens", 0))
+    
+    def is_available(self) -> bool:
+        """DeepSeek对话端点是否可用（熔断未打开）"""
+        return self.gateway.is_available("deepseek", "chat")
     
     async def simple_chat(self, user_message: str) -> str:
         """简单对话（无工具调用）"""
@@ -87,7 +329,7 @@ class DeepSeekService:
         messages = [{"role": "user", "content": user_message}]
         
         try:
-            result = await self.chat_with_tools(messages)
+            result = await self.chat(messages)
             
             if result.get("choices"):
                 return result["choices"][0]["message"]["content"]
@@ -98,60 +340,21 @@ class DeepSeekService:
             logger.error(f"简单对话失败: {e}")
             return f"AI服务错误: {str(e)}"
     
-    def get_mcp_tools(self) -> List[Dict]:
-        """获取MCP工具定义"""
-        
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_template_fields",
-                    "description": "获取AI申请单模板的详细信息，包括所有可填字段及其规则。当用户要创建申请单时必须先调用此工具。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function", 
-                "function": {
-                    "name": "create_smart_expense",
-                    "description": "创建申请单，根据用户输入的信息智能创建申请单",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "user_input": {
-                                "type": "string",
-                                "description": "用户输入的申请单信息，包含标题、金额、项目等"
-                            }
-                        },
-                        "required": ["user_input"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_document_by_code", 
-                    "description": "根据申请单编号查询申请单详情",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "code": {
-                                "type": "string",
-                                "description": "申请单编号，如S25000089"
-                            }
-                        },
-                        "required": ["code"]
-                    }
-                }
-            }
-        ]
+    async def probe(self) -> bool:
+        """轻量健康探测：查询模型列表（不产生对话计费）"""
+        models_url = self.api_url.replace("/chat/completions", "/models")
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        started = time.perf_counter()
+        async with self.scheduler.slot(self._priority("probe")):
+            response = await self.gateway.request(
+                "deepseek", "probe", "GET", models_url, headers=headers, timeout=HEALTH_PROBE_TIMEOUT
+            )
+        response.raise_for_status()
+        self.usage.record("probe", None, time.perf_counter() - started)
+        return True
     
     async def test_connection(self) -> bool:
-        """测试AI服务连接"""
+        """测试AI服务连接（发起一次真实对话，会产生计费，探针请使用probe）"""
         try:
             result = await self.simple_chat("你好")
             logger.info(f"DeepSeek服务测试成功: {result[:50]}...")
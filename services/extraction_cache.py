@@ -0,0 +1,294 @@
+"""
+字段提取模式缓存
+把用户输入中的金额、日期、档案项名称替换为类型化占位符得到规范化模式（如"出差{{N}}{{A}}元{{D}}"），
+按模板版本缓存AI返回的字段映射骨架；相同模式的后续请求直接在本地回填占位符，跳过AI字段提取调用
+"""
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import FIELD_MAPPING_CACHE_FILE, FIELD_MAPPING_CACHE_ENABLED, FIELD_MAPPING_CACHE_MAX_ENTRIES
+from services.metrics import metrics
+from services.token_store import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+WEEKDAY_INDEX = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+RELATIVE_DAYS = {"今天": 0, "明天": 1, "后天": 2, "大后天": 3}
+
+DATE_PATTERN = re.compile(
+    r"(?P<ymd>(?P<y>\d{4})[-/年](?P<m>\d{1,2})[-/月](?P<d>\d{1,2})[日号]?)"
+    r"|(?P<md>(?P<m2>\d{1,2})月(?P<d2>\d{1,2})[日号])"
+    r"|(?P<rel>大后天|后天|明天|今天)"
+    r"|(?P<week>(?P<wp>下下|下|本|这)?(?:周|星期|礼拜)(?P<wd>[一二三四五六日天]))"
+    r"|(?P<after>(?P<n>\d{1,3})天[以之]?后)"
+)
+AMOUNT_PATTERN = re.compile(r"[￥¥]\s*(?P<a1>\d+(?:\.\d+)?)|(?<![\d.])(?P<a2>\d+(?:\.\d+)?)(?=\s*(?:元|块))")
+TOKEN_PATTERN = re.compile(r"\{\{(?P<slot>[A-Z]\d*|INPUT|T[+-]\d+)(?:(?P<sep>[:@])(?P<arg>[^}]*))?\}\}")
+TIMESTAMP_RANGE = (10 ** 12, 10 ** 13)  # 毫秒时间戳
+
+
+def parse_date_expression(text: str, today: date) -> Optional[date]:
+    """把常见中文日期表达解析为日期，无法解析时返回None"""
+    match = DATE_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    try:
+        if match.group("ymd"):
+            return date(int(match.group("y")), int(match.group("m")), int(match.group("d")))
+        if match.group("md"):
+            return date(today.year, int(match.group("m2")), int(match.group("d2")))
+    except ValueError:
+        return None
+    if match.group("rel"):
+        return today + timedelta(days=RELATIVE_DAYS[match.group("rel")])
+    if match.group("week"):
+        weeks = {"下下": 2, "下": 1}.get(match.group("wp") or "", 0)
+        monday = today - timedelta(days=today.weekday())
+        return monday + timedelta(weeks=weeks, days=WEEKDAY_INDEX[match.group("wd")])
+    return today + timedelta(days=int(match.group("n")))
+
+
+def day_start_ms(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day).timestamp() * 1000)
+
+
+class Slot:
+    """用户输入中的一个可替换片段"""
+
+    __slots__ = ("kind", "name", "raw", "value")
+
+    def __init__(self, kind: str, index: int, raw: str, value: Any):
+        self.kind = kind  # A: 金额, D: 日期, N: 档案项名称
+        self.name = f"{kind}{index}"
+        self.raw = raw
+        self.value = value
+
+
+class Pattern:
+    """规范化后的用户输入"""
+
+    __slots__ = ("text", "slots", "today")
+
+    def __init__(self, text: str, slots: List[Slot], today: date):
+        self.text = text
+        self.slots = slots
+        self.today = today
+
+
+class ExtractionCache:
+    """字段映射骨架缓存（LRU，持久化到JSON文件）"""
+
+    def __init__(self, path: str = FIELD_MAPPING_CACHE_FILE, max_entries: int = FIELD_MAPPING_CACHE_MAX_ENTRIES,
+                 enabled: bool = FIELD_MAPPING_CACHE_ENABLED, fingerprint: str = ""):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.fingerprint = fingerprint  # 提示词规则变化后旧骨架作废
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._loaded = False
+        self._save_lock = asyncio.Lock()
+        self._vocabulary_key: Tuple[str, ...] = ()
+        self._vocabulary_pattern: Optional[re.Pattern] = None
+        self.hits = 0
+        self.misses = 0
+        metrics.register_gauge("extract_cache.size", lambda: len(self._entries))
+        metrics.register_gauge("extract_cache.hit_rate", self.hit_rate)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else 0.0
+
+    def _load(self):
+        self._loaded = True
+        try:
+            data = read_json(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning("读取字段映射缓存失败: %s", e)
+            return
+        if not isinstance(data, dict) or data.get("version") != CACHE_FORMAT_VERSION \
+                or data.get("fingerprint") != self.fingerprint:
+            return
+        for key, skeleton in list(data.get("entries", {}).items())[-self.max_entries:]:
+            self._entries[key] = skeleton
+        logger.info("📦 加载字段映射缓存: %d 个模式", len(self._entries))
+
+    def canonicalize(self, user_input: str, vocabulary: Sequence[str], today: Optional[date] = None) -> Pattern:
+        """把金额、日期和档案项名称替换为占位符（无法本地解析的片段保留原文）"""
+        today = today or date.today()
+        spans = []
+        for match in DATE_PATTERN.finditer(user_input):
+            day = parse_date_expression(match.group(), today)
+            if day is not None:
+                spans.append((match.start(), match.end(), "D", day))
+        for match in AMOUNT_PATTERN.finditer(user_input):
+            group = "a1" if match.group("a1") else "a2"
+            spans.append((match.start(group), match.end(group), "A", float(match.group(group))))
+        names = self._vocabulary(vocabulary)
+        if names is not None:
+            for match in names.finditer(user_input):
+                spans.append((match.start(), match.end(), "N", match.group()))
+
+        # 重叠片段取起始位置靠前、长度更长的
+        spans.sort(key=lambda span: (span[0], span[0] - span[1]))
+        parts, slots, counts, position = [], [], {}, 0
+        for start, end, kind, value in spans:
+            if start < position:
+                continue
+            index = counts.get(kind, 0)
+            counts[kind] = index + 1
+            slots.append(Slot(kind, index, user_input[start:end], value))
+            parts.append(user_input[position:start])
+            parts.append("{{" + kind + "}}")
+            position = end
+        parts.append(user_input[position:])
+        return Pattern("".join(parts), slots, today)
+
+    def _vocabulary(self, vocabulary: Sequence[str]) -> Optional[re.Pattern]:
+        """档案项名称的匹配正则（名称集合不变时复用）"""
+        key = tuple(sorted({name for name in vocabulary if name}, key=lambda name: (-len(name), name)))
+        if key != self._vocabulary_key:
+            self._vocabulary_key = key
+            self._vocabulary_pattern = re.compile("|".join(map(re.escape, key))) if key else None
+        return self._vocabulary_pattern
+
+    def lookup(self, template_id: str, user_input: str, vocabulary: Sequence[str],
+               now: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], Pattern]:
+        """查找模式缓存，命中时返回回填后的字段映射；同时返回规范化结果供未命中时写入"""
+        if not self._loaded:
+            self._load()
+        pattern = self.canonicalize(user_input, vocabulary, datetime.fromtimestamp(now).date() if now else None)
+        key = f"{template_id}|{pattern.text}"
+        skeleton = self._entries.get(key)
+        if skeleton is None:
+            self.misses += 1
+            metrics.incr("extract_cache.miss")
+            return None, pattern
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.incr("extract_cache.hit")
+        return self._fill(skeleton, pattern, user_input), pattern
+
+    async def store(self, template_id: str, pattern: Pattern, user_input: str, field_mapping: Dict[str, Any]) -> bool:
+        """把AI返回的字段映射转换为骨架写入缓存并持久化，无法安全模板化时不缓存"""
+        skeleton = self._skeletonize(field_mapping, pattern, user_input)
+        if skeleton is None or self._fill(skeleton, pattern, user_input) != field_mapping:
+            metrics.incr("extract_cache.uncacheable")
+            return False
+        self._entries[f"{template_id}|{pattern.text}"] = skeleton
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.incr("extract_cache.store")
+        await self.save()
+        return True
+
+    async def save(self):
+        """在线程中原子写入缓存文件"""
+        async with self._save_lock:
+            data = {
+                "version": CACHE_FORMAT_VERSION,
+                "fingerprint": self.fingerprint,
+                "entries": dict(self._entries)
+            }
+            try:
+                await asyncio.to_thread(atomic_write_json, self.path, data)
+            except OSError as e:
+                logger.warning("保存字段映射缓存失败: %s", e)
+
+    def _skeletonize(self, field_mapping: Dict[str, Any], pattern: Pattern, user_input: str) -> Optional[Any]:
+        """把字段映射中来自用户输入的值替换为占位符，每个片段都必须被引用到"""
+        slots = pattern.slots
+        if len({slot.raw for slot in slots}) < len(slots):
+            return None  # 同一片段出现多次，无法确定对应关系
+        used = set()
+        substitutions = [
+            (slot, re.compile(rf"(?<!\d){re.escape(slot.raw)}(?!\d)" if slot.kind == "A" else re.escape(slot.raw)))
+            for slot in sorted(slots, key=lambda slot: -len(slot.raw))
+        ]
+
+        def unique(candidates: List[Slot]) -> Optional[Slot]:
+            return candidates[0] if len(candidates) == 1 else None
+
+        def convert(value: Any) -> Any:
+            if isinstance(value, dict):
+                return {key: convert(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [convert(item) for item in value]
+            if isinstance(value, str):
+                if "{{" in value:
+                    raise ValueError("字段值包含占位符语法")
+                if value == user_input:
+                    return "{{INPUT}}"
+                money = unique([slot for slot in slots if slot.kind == "A" and f"{slot.value:.2f}" == value])
+                if money is not None:
+                    used.add(money.name)
+                    return "{{" + money.name + ":money}}"
+                for slot, regex in substitutions:
+                    value, count = regex.subn("{{" + slot.name + "}}", value)
+                    if count:
+                        used.add(slot.name)
+                return value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if TIMESTAMP_RANGE[0] <= value < TIMESTAMP_RANGE[1]:
+                    day = datetime.fromtimestamp(value / 1000).date()
+                    offset = int(value) - day_start_ms(day)
+                    matched = [slot for slot in slots if slot.kind == "D" and slot.value == day]
+                    if len(matched) > 1:
+                        raise ValueError("日期对应多个片段")
+                    if matched:
+                        used.add(matched[0].name)
+                        return "{{" + matched[0].name + f"@{offset}}}}}"
+                    # 未对应输入片段的时间戳只接受当天（默认当前时间），回填为请求当天的同一时刻
+                    if day != pattern.today:
+                        raise ValueError("时间戳无法对应输入片段")
+                    return "{{" + f"T+0@{offset}}}}}"
+                amount = unique([slot for slot in slots if slot.kind == "A" and slot.value == value])
+                if amount is not None:
+                    used.add(amount.name)
+                    return "{{" + amount.name + ":number}}"
+            return value
+
+        try:
+            skeleton = convert(field_mapping)
+        except ValueError:
+            return None
+        if len(used) < len(slots):
+            return None  # 有片段未在结果中出现，可能被AI以无法识别的方式使用
+        return skeleton
+
+    def _fill(self, skeleton: Any, pattern: Pattern, user_input: str) -> Any:
+        """用本次输入的片段回填骨架"""
+        slots = {slot.name: slot for slot in pattern.slots}
+
+        def full(match: re.Match) -> Any:
+            name, sep, arg = match.group("slot"), match.group("sep"), match.group("arg")
+            if name == "INPUT":
+                return user_input
+            if name.startswith("T"):
+                return day_start_ms(pattern.today + timedelta(days=int(name[1:]))) + int(arg)
+            slot = slots[name]
+            if sep == "@":
+                return day_start_ms(slot.value) + int(arg)
+            if arg == "money":
+                return f"{slot.value:.2f}"
+            if arg == "number":
+                return int(slot.value) if slot.value == int(slot.value) else slot.value
+            return slot.raw
+
+        def fill(value: Any) -> Any:
+            if isinstance(value, dict):
+                return {key: fill(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [fill(item) for item in value]
+            if isinstance(value, str) and "{{" in value:
+                match = TOKEN_PATTERN.fullmatch(value)
+                if match:
+                    return full(match)
+                return TOKEN_PATTERN.sub(lambda m: slots[m.group("slot")].raw, value)
+            return value
+
+        return fill(skeleton)
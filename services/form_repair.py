@@ -0,0 +1,224 @@
+"""
+申请单表单校验与自动修复
+提交前按模板字段编译的约束（类型、必填、档案可选项、金额精度、日期范围、长度上限）校验字段映射：
+能确定性修复的直接修复（截断标题、规整金额结构、补默认日期、档案名称归一），其余字段交给调用方让AI只重新提取这几个字段；
+易快报返回的400错误被解析为新约束，同一模板版本的后续请求提前规避
+"""
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.template_schema import FieldSpec, TemplateSchema
+
+MONEY_DEFAULTS = {
+    "standardUnit": "元",
+    "standardSymbol": "¥",
+    "standardNumCode": "156",
+    "standardStrCode": "CNY"
+}
+DAY_MS = 86400 * 1000
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+# 400错误信息中的约束
+MAX_LENGTH_PATTERN = re.compile(r"(?:长度|字数|字符)[^\d，,。]{0,8}?(\d+)")
+REQUIRED_PATTERN = re.compile(r"不能为空|必填|缺少|required", re.IGNORECASE)
+
+
+class Violation:
+    """一个无法确定性修复的字段问题"""
+
+    __slots__ = ("field", "label", "reason", "options")
+
+    def __init__(self, field: str, label: str, reason: str, options: Optional[List[str]] = None):
+        self.field = field
+        self.label = label
+        self.reason = reason
+        self.options = options
+
+    @property
+    def message(self) -> str:
+        if self.reason == "缺失":
+            return f"缺少必填字段：{self.label}"
+        return f"{self.label}{self.reason}"
+
+    def __repr__(self) -> str:
+        return f"Violation({self.field}: {self.reason})"
+
+
+class RepairResult:
+    """校验修复结果：修复后的字段映射、已做的修复、仍未解决的问题"""
+
+    __slots__ = ("mapping", "fixes", "violations")
+
+    def __init__(self, mapping: Dict[str, Any], fixes: List[str], violations: List[Violation]):
+        self.mapping = mapping
+        self.fixes = fixes
+        self.violations = violations
+
+
+class FormRepairer:
+    """按模板字段约束校验并修复字段映射"""
+
+    def __init__(self, base_rules: Optional[Dict[str, Dict[str, Any]]] = None,
+                 date_past_days: int = 365, date_future_days: int = 730):
+        self.base_rules = base_rules or {}  # 按字段名的固定约束，如 {"title": {"max_length": 14}}
+        self.date_past_days = date_past_days
+        self.date_future_days = date_future_days
+
+    def rules_for(self, field: FieldSpec, learned: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        rules = dict(self.base_rules.get(field.name, {}))
+        rules.update(learned.get(field.name, {}))
+        return rules
+
+    def repair(self, schema: TemplateSchema, field_mapping: Dict[str, Any],
+               options: Optional[Dict[str, List[str]]] = None,
+               learned: Optional[Dict[str, Dict[str, Any]]] = None,
+               final: bool = False, now: Optional[float] = None) -> RepairResult:
+        """
+        校验并修复字段映射（不修改传入的映射）
+
+        options为档案字段的可选项名称；learned为从400错误中学到的约束。
+        final为True时（AI重新提取之后）日期问题回退为当前时间，档案值不在可选项中时保留原值（由档案解析选择默认项）。
+        """
+        options = options or {}
+        learned = learned or {}
+        now_ms = int((time.time() if now is None else now) * 1000)
+        mapping = dict(field_mapping)
+        fixes: List[str] = []
+        violations: List[Violation] = []
+
+        for field in schema.fields:
+            rules = self.rules_for(field, learned)
+            required = field.required or rules.get("required", False)
+            value = mapping.get(field.name)
+
+            if value is None or value == "" or value == {}:
+                if field.type == "日期" and required:
+                    mapping[field.name] = now_ms
+                    fixes.append(f"{field.label}: 补充为当前日期")
+                elif required:
+                    violations.append(Violation(field.name, field.label, "缺失"))
+                continue
+
+            if field.is_archive:
+                repaired, error = self._archive(value, options.get(field.name))
+                if error and final:
+                    continue
+            elif field.type == "金额":
+                repaired, error = self._money(value, rules)
+            elif field.type == "日期":
+                repaired, error = self._date(value, field, now_ms)
+                if error and final:
+                    repaired, error = now_ms, None
+            elif field.type == "数字":
+                repaired, error = self._number(value)
+            else:
+                repaired, error = self._text(value, rules)
+
+            if error:
+                violations.append(Violation(field.name, field.label, error,
+                                            options.get(field.name) if field.is_archive else None))
+            elif repaired != value:
+                mapping[field.name] = repaired
+                fixes.append(f"{field.label}: {self._short(value)} -> {self._short(repaired)}")
+
+        return RepairResult(mapping, fixes, violations)
+
+    @staticmethod
+    def _short(value: Any, limit: int = 30) -> str:
+        text = str(value)
+        return text if len(text) <= limit else text[:limit] + "..."
+
+    @staticmethod
+    def _text(value: Any, rules: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+        if not isinstance(value, str):
+            return value, None  # 复选框、附件、收款信息等非文本值原样保留
+        text = value.strip()
+        max_length = rules.get("max_length")
+        if max_length and len(text) > max_length:
+            text = text[:max_length]
+        return text, None
+
+    @staticmethod
+    def _parse_amount(value: Any) -> Optional[float]:
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            match = NUMBER_PATTERN.search(value.replace(",", "").replace("，", ""))
+            if match:
+                amount = float(match.group())
+                return amount * 10000 if "万" in value[match.end():match.end() + 2] else amount
+        return None
+
+    def _money(self, value: Any, rules: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+        """金额规整为 {"standard": "数字.00", ...} 结构"""
+        source = value.get("standard") if isinstance(value, dict) else value
+        amount = self._parse_amount(source)
+        if amount is None:
+            return value, "格式无效"
+        if amount <= 0:
+            return value, "必须大于0"
+        scale = rules.get("scale", value.get("standardScale", 2) if isinstance(value, dict) else 2)
+        money = dict(MONEY_DEFAULTS, **(value if isinstance(value, dict) else {}))
+        money["standard"] = f"{amount:.{scale}f}"
+        money["standardScale"] = scale
+        return money, None
+
+    def _date(self, value: Any, field: FieldSpec, now_ms: int) -> Tuple[Any, Optional[str]]:
+        """日期转换为毫秒时间戳并检查范围"""
+        try:
+            timestamp = field.convert(value) if not isinstance(value, (int, float)) or isinstance(value, bool) else value
+        except Exception:
+            return value, "格式无效"
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            return value, "格式无效"
+        if timestamp < 10000000000:  # 秒级时间戳
+            timestamp *= 1000
+        timestamp = int(timestamp)
+        if not now_ms - self.date_past_days * DAY_MS <= timestamp <= now_ms + self.date_future_days * DAY_MS:
+            return value, "超出合理范围"
+        return timestamp, None
+
+    @staticmethod
+    def _number(value: Any) -> Tuple[Any, Optional[str]]:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value, None
+        match = NUMBER_PATTERN.search(str(value))
+        if not match:
+            return value, "格式无效"
+        number = float(match.group())
+        return (int(number) if number.is_integer() else number), None
+
+    @staticmethod
+    def _archive(value: Any, choices: Optional[List[str]]) -> Tuple[Any, Optional[str]]:
+        """档案值归一为可选项名称（精确或包含匹配，多个候选时无法确定）"""
+        if not choices:
+            return value, None
+        text = str(value).strip()
+        if text in choices:
+            return text, None
+        candidates = [choice for choice in choices if text in choice or choice in text]
+        if len(candidates) == 1:
+            return candidates[0], None
+        return value, "不在可选项中" if not candidates else "匹配到多个可选项"
+
+    def learn(self, schema: TemplateSchema, error_body: str) -> Dict[str, Dict[str, Any]]:
+        """从400错误信息中解析字段约束（按字段名或标签定位字段），返回新学到的约束"""
+        learned: Dict[str, Dict[str, Any]] = {}
+        for field in schema.fields:
+            rules: Dict[str, Any] = {}
+            for token in {field.name, field.label}:
+                position = error_body.find(token)
+                if position < 0:
+                    continue
+                context = error_body[position:position + len(token) + 40]
+                match = MAX_LENGTH_PATTERN.search(context)
+                if match:
+                    rules["max_length"] = int(match.group(1))
+                if REQUIRED_PATTERN.search(context):
+                    rules["required"] = True
+            if rules:
+                learned[field.name] = rules
+        return learned
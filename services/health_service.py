@@ -0,0 +1,74 @@
+"""
+健康探测服务
+后台按固定间隔用轻量请求探测上游，探针接口只读取缓存的健康状态，不产生上游调用
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from services.circuit_breaker import breaker_states, get_breaker
+from services.resilience import get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProber:
+    """上游健康探测器"""
+
+    def __init__(self, auth_service, deepseek_service, interval: float):
+        self.interval = interval
+        self.probes: Dict[str, Callable[[], Awaitable[bool]]] = {
+            "ekuaibao": auth_service.probe,
+            "deepseek": deepseek_service.probe,
+        }
+        self.upstreams: Dict[str, Dict[str, Any]] = {
+            name: {"status": "unknown"} for name in self.probes
+        }
+
+    async def probe_once(self):
+        """并发探测所有上游一次，更新缓存状态和熔断器"""
+        await asyncio.gather(*[self._probe(name, probe) for name, probe in self.probes.items()])
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[bool]]):
+        breaker = get_breaker(name)
+        started = time.perf_counter()
+        try:
+            ok = await probe()
+            error = None
+        except Exception as e:
+            ok = False
+            error = str(e)
+
+        if ok:
+            breaker.record_success()
+        else:
+            error = error or "探测返回失败"
+            breaker.record_failure()
+            logger.warning(f"上游 {name} 健康探测失败: {error}")
+
+        self.upstreams[name] = {
+            "status": "ok" if ok else "error",
+            "latency_ms": round((time.perf_counter() - started) * 1000),
+            "checked_at": time.time(),
+            "error": error,
+            "breaker": breaker.state
+        }
+
+    async def run(self):
+        """后台循环探测（作为应用生命周期内的后台任务运行）"""
+        while True:
+            await self.probe_once()
+            await asyncio.sleep(self.interval)
+
+    @property
+    def all_healthy(self) -> bool:
+        return all(upstream["status"] == "ok" for upstream in self.upstreams.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前缓存的健康状态"""
+        return {
+            "upstreams": self.upstreams,
+            "breakers": breaker_states(),
+            "latency": get_gateway().latency_stats()
+        }
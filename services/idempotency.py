@@ -0,0 +1,93 @@
+"""
+申请单创建幂等
+客户端超时重试或用户重复点击时，同一幂等键（客户端提供的Idempotency-Key，或会话+规范化输入在时间窗口内的哈希）
+只创建一次申请单：已完成的创建直接返回保存的结果，进行中的创建由重试请求等待并共享结果（跨worker经共享缓存租约）
+"""
+import logging
+import re
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import IDEMPOTENCY_ENABLED, IDEMPOTENCY_WINDOW_SECONDS, IDEMPOTENCY_LEASE_SECONDS
+from services.audit_log import hash_text
+from services.metrics import metrics
+from services.shared_cache import CacheTier
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "idempotency"
+# 规范化输入时忽略的空白和结尾标点（"出差上海3000元。"与"出差上海 3000元"视为同一输入）
+IGNORED_CHARS = re.compile(r"\s+|[。.！!？?~～]+$")
+
+# 当前请求的幂等键
+_current_key: ContextVar[Optional[str]] = ContextVar("idempotency_key", default=None)
+
+
+def normalize_input(message: str) -> str:
+    return IGNORED_CHARS.sub("", message.strip())
+
+
+class IdempotencyGuard:
+    """按幂等键去重申请单创建"""
+
+    def __init__(self, cache: CacheTier, window: float = IDEMPOTENCY_WINDOW_SECONDS,
+                 lease_ttl: float = IDEMPOTENCY_LEASE_SECONDS, enabled: bool = IDEMPOTENCY_ENABLED):
+        self.cache = cache
+        self.window = window  # 已完成结果的保存秒数（会话+输入哈希的去重窗口）
+        self.lease_ttl = lease_ttl  # 等待其他worker进行中创建的最长秒数，应大于一次创建的耗时
+        self.enabled = enabled and window > 0
+
+    def derive_key(self, client_key: Optional[str], session_id: Optional[str], message: str) -> Optional[str]:
+        """客户端幂等键优先，其次为会话+规范化输入；两者都没有时不去重"""
+        if not self.enabled:
+            return None
+        if client_key:
+            return "client:" + hash_text(client_key)
+        if session_id:
+            return "session:" + hash_text(f"{session_id}\n{normalize_input(message)}")
+        return None
+
+    @staticmethod
+    def bind(key: Optional[str]):
+        """把幂等键绑定到当前请求，供之后的create_smart_expense使用"""
+        _current_key.set(key)
+
+    async def completed(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """幂等键对应的已完成创建结果（没有时返回None）"""
+        if key is None:
+            return None
+        return await self.cache.get(NAMESPACE, key)
+
+    async def run(self, operation: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        在当前请求的幂等键下执行创建
+
+        只保存成功的结果：失败的创建（校验错误、上游400等）允许重试时重新执行。
+        """
+        key = _current_key.get()
+        if key is None:
+            return await operation()
+
+        stored = await self.completed(key)
+        if stored is not None:
+            metrics.incr("idempotency.replayed")
+            logger.info("♻️ 重复的创建请求，返回已完成的结果: %s", key)
+            return dict(stored, deduplicated=True)
+
+        executed = False
+
+        async def load() -> Dict[str, Any]:
+            nonlocal executed
+            executed = True
+            return await operation()
+
+        result = await self.cache.get_or_load(
+            NAMESPACE, key, load, ttl=self.window,
+            cacheable=lambda value: bool(value.get("success")), lease_ttl=self.lease_ttl
+        )
+        if executed:
+            metrics.incr("idempotency.executed")
+            return result
+        metrics.incr("idempotency.attached")
+        logger.info("♻️ 重复的创建请求，等待进行中的创建并共享结果: %s", key)
+        return dict(result, deduplicated=True)
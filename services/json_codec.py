@@ -0,0 +1,20 @@
+"""
+JSON编码
+安装了orjson时使用orjson（直接输出UTF-8字节），否则回退为标准库json
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖
+    orjson = None
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def dumps_bytes(data: Any) -> bytes:
+    """紧凑编码为UTF-8字节（中文不转义），可直接作为HTTP请求体"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
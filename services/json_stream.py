@@ -0,0 +1,78 @@
+"""
+增量JSON解析
+逐块喂入流式输出的文本，顶层对象的每个成员（"键": 值）一完整就立即产出，
+无需等整段输出结束；对象前后的说明文字或```json代码块标记会被忽略
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalObjectParser:
+    """从文本流中增量解析第一个顶层JSON对象"""
+
+    def __init__(self):
+        self.result: Dict[str, Any] = {}
+        self.complete = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member: List[str] = []
+        self._separated = False  # 上一个成员后是否已有逗号
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """喂入一段文本，返回本段内完成的 (键, 值) 列表"""
+        completed = []
+        for char in chunk:
+            if self.complete:
+                break
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._member.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            if self._depth == 1 and char == ",":
+                self._finish_member(completed)
+                self._separated = True
+                continue
+            if self._depth == 0:
+                self._finish_member(completed, closing=True)
+                self.complete = True
+                break
+            self._member.append(char)
+        return completed
+
+    def _finish_member(self, completed: List[Tuple[str, Any]], closing: bool = False):
+        text = "".join(self._member).strip()
+        self._member.clear()
+        if not text:
+            # 只有空对象{}允许没有成员；多余的逗号（{"a":1,}、{,}）和json.loads一样视为不合法
+            if closing and not self._separated:
+                return
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, 0)
+        self._separated = False
+        member = json.loads("{" + text + "}")  # 成员不合法时抛出JSONDecodeError
+        for key, value in member.items():
+            self.result[key] = value
+            completed.append((key, value))
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """输出结束：对象完整时返回解析结果，否则返回None"""
+        return self.result if self.complete else None
@@ -0,0 +1,93 @@
+"""
+日志配置
+所有日志先写入内存队列（QueueHandler），由后台线程（QueueListener）输出到控制台和文件，
+磁盘/终端I/O不会阻塞事件循环；请求和响应内容只在DEBUG级别按采样率记录，并截断到固定长度
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from typing import Any, Optional
+
+from config import LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_PAYLOAD_MAX_CHARS, LOG_PAYLOAD_SAMPLE_RATE
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level: str = LOG_LEVEL, log_file: str = LOG_FILE, log_format: str = LOG_FORMAT):
+    """
+    配置根日志：替换已有的处理器为队列处理器，并启动后台输出线程（重复调用只调整级别）
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    # httpx每个请求都记INFO日志，且URL中带accessToken
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class _Truncated:
+    """日志参数：真正输出时才序列化并截断"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if isinstance(self.value, (bytes, bytearray)):
+            text = self.value.decode("utf-8", errors="replace")
+        elif isinstance(self.value, str):
+            text = self.value
+        else:
+            text = json.dumps(self.value, ensure_ascii=False, default=str)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}...(共{len(text)}字符，已截断)"
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any,
+                sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE, limit: int = LOG_PAYLOAD_MAX_CHARS):
+    """在DEBUG级别按采样率记录请求/响应内容（截断到limit字符），未开启DEBUG时几乎无开销"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.debug("%s: %s", label, _Truncated(payload, limit))
@@ -0,0 +1,100 @@
+"""
+指标服务
+进程内的阶段耗时、计数器和仪表盘指标，通过 /metrics 接口输出
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+class LatencyTracker:
+    """滚动窗口延迟统计"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        """p取0~100，样本为空时返回None"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 1),
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99))
+        }
+
+
+class StageTimer:
+    """timer()产出的计时结果，代码块结束后seconds为耗时"""
+
+    __slots__ = ("seconds",)
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.stages: Dict[str, LatencyTracker] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        """记录一次阶段耗时"""
+        tracker = self.stages.get(stage)
+        if tracker is None:
+            tracker = self.stages[stage] = LatencyTracker(self.window)
+        tracker.record(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """统计代码块耗时（异常时同样记录），as得到的StageTimer在代码块结束后可读取耗时"""
+        timing = StageTimer()
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds = time.perf_counter() - started
+            self.observe(stage, timing.seconds)
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def register_gauge(self, name: str, func: Callable[[], Any]):
+        """注册仪表盘指标（读取快照时调用func取当前值）"""
+        self.gauges[name] = func
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "stages": {name: tracker.to_dict() for name, tracker in sorted(self.stages.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "gauges": {name: func() for name, func in sorted(self.gauges.items())}
+        }
+
+    def reset(self):
+        """清空阶段耗时和计数器（仪表盘指标保留）"""
+        self.stages.clear()
+        self.counters.clear()
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,89 @@
+"""
+易快报列表接口分页
+易快报列表接口按 start/count 分页，响应中的count为总数。paginate逐项产出全部结果：
+总数已知时并发拉取后续页（最多parallel页同时在途），总数未知时消费当前页的同时预取下一页；
+按页顺序产出，消费方提前结束时取消未完成的拉取
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from config import EKUAIBAO_PAGE_SIZE, EKUAIBAO_PAGE_PARALLELISM, EKUAIBAO_MAX_LIST_ITEMS
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# fetch_page(start, count) -> 列表接口的JSON响应（{"count": 总数, "items": [...]}）
+PageFetcher = Callable[[int, int], Awaitable[Dict[str, Any]]]
+
+
+def _total(page: Dict[str, Any]) -> Optional[int]:
+    count = page.get("count")
+    return count if isinstance(count, int) and not isinstance(count, bool) and count >= len(page.get("items", [])) else None
+
+
+def is_single_page(page: Dict[str, Any], page_size: int = EKUAIBAO_PAGE_SIZE) -> bool:
+    """第一页是否就是全部结果：总数已知时总数不超过单页条数，未知时本页不满"""
+    total = _total(page)
+    return total <= page_size if total is not None else len(page.get("items", [])) < page_size
+
+
+async def paginate(fetch_page: PageFetcher, page_size: int = EKUAIBAO_PAGE_SIZE,
+                   parallel: int = EKUAIBAO_PAGE_PARALLELISM, max_items: int = EKUAIBAO_MAX_LIST_ITEMS,
+                   first_page: Optional[Dict[str, Any]] = None, name: str = "list") -> AsyncIterator[Any]:
+    """
+    逐项产出列表接口的全部结果
+
+    first_page为已经拉取的第一页（start=0, count=page_size）时不再重复拉取；
+    max_items为安全上限，防止异常的总数导致无限翻页；达到上限而仍有数据时记录警告和paginate.{name}.truncated。
+    """
+    if first_page is None:
+        first_page = await fetch_page(0, page_size)
+    metrics.incr(f"paginate.{name}.pages")
+    total = _total(first_page)
+    limit = min(total, max_items) if total is not None else max_items
+    ahead = max(1, parallel) if total is not None else 1
+    pending: Deque[asyncio.Task] = deque()
+    next_start = page_size
+
+    def schedule(more: bool):
+        """补足预取窗口：总数已知时按总数，未知时只在上一页是满页时预取下一页"""
+        nonlocal next_start
+        while more and len(pending) < ahead and next_start < limit:
+            pending.append(asyncio.ensure_future(fetch_page(next_start, page_size)))
+            next_start += page_size
+            if total is None:
+                break
+
+    def truncated():
+        metrics.incr(f"paginate.{name}.truncated")
+        logger.warning("⚠️ 列表 %s 达到读取上限 %d 条（总数 %s），其余数据未读取",
+                       name, limit, total if total is not None else "未知")
+
+    page = first_page
+    produced = 0
+    try:
+        while True:
+            items = page.get("items", [])
+            full = len(items) >= page_size
+            schedule(full or total is not None)
+            for item in items:
+                if produced >= limit:
+                    truncated()
+                    return
+                produced += 1
+                yield item
+            if not pending:
+                if produced >= limit and (total > limit if total is not None else full):
+                    truncated()
+                return
+            page = await pending.popleft()
+            metrics.incr(f"paginate.{name}.pages")
+            if not page.get("items"):
+                return
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
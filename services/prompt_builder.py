@@ -0,0 +1,98 @@
+"""
+字段提取提示词构建
+按"固定规则 → 模板字段目录 → 易变内容（当前时间、用户输入）"的顺序组装消息，
+同一模板版本的提示词前缀逐字节不变，可以命中DeepSeek的上下文缓存（缓存命中的前缀计费更低、响应更快）
+"""
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from services.template_schema import TemplateSchema
+
+# 固定规则：不得包含任何随请求变化的内容（时间、用户输入等），否则前缀缓存失效
+EXTRACTION_RULES = """你是一个智能申请单助手。用户想要创建申请单，你需要从他们的自然语言输入中提取字段信息。
+
+请你发挥强大的自然语言理解能力：
+1. 理解用户的真实意图（创建、提交、写一个申请单等都是同一个意思）
+2. 智能匹配用户描述的内容到对应字段
+3. 用户可能用各种表达方式，你要灵活理解
+4. 即使用户没有明确提到某个字段，也要生成合理的默认值
+
+字段格式要求：
+- 金额类型: {"standard": "数字.00", "standardUnit": "元", "standardScale": 2, "standardSymbol": "¥", "standardNumCode": "156", "standardStrCode": "CNY"}
+- 日期类型: 时间戳毫秒数，以消息末尾给出的当前时间为基准，智能理解各种日期表达：
+  * "今天" → 当前时间戳
+  * "明天" → 当前时间戳 + 86400000
+  * "下周一" → 计算对应的时间戳
+  * "2024-01-15" → 转换为时间戳
+  * "1月15日" → 转换为当前年份对应日期的时间戳
+  * "下个月5号" → 计算下个月5号的时间戳
+  * 如果没有明确日期，默认使用当前时间
+- 其他类型: 直接使用合适的值
+
+日期智能理解示例：
+- 用户说"明天开始"、"下周申请"、"月底截止" → 计算对应的具体时间戳
+- 用户说"2024年1月15日"、"1/15"、"01-15" → 转换为标准时间戳
+- 相对时间："3天后"、"下周二"、"下个月" → 基于当前时间计算
+
+请直接返回JSON格式的完整字段映射，包含所有字段。"""
+
+WEEKDAYS = "一二三四五六日"
+
+
+class ExtractionPromptBuilder:
+    """字段提取提示词（每个模板版本的字段目录只生成一次）"""
+
+    def __init__(self, rules: str = EXTRACTION_RULES):
+        self.rules = rules
+        self._prefixes: Dict[str, Tuple[TemplateSchema, str]] = {}  # 模板ID -> (字段模型, 固定前缀)
+
+    def prefix(self, schema: TemplateSchema) -> str:
+        """固定前缀：规则 + 字段目录（模板版本变化时字段模型会重新编译，前缀随之重建）"""
+        cached = self._prefixes.get(schema.template_id)
+        if cached is not None and cached[0] is schema:
+            return cached[1]
+        catalogue = "\n".join(
+            f"- {field.name}: {field.label} ({field.type})" + (" [必填]" if field.required else "")
+            for field in schema.fields
+        )
+        text = f"{self.rules}\n\n模板: {schema.template_name}\n可用字段列表:\n{catalogue}"
+        self._prefixes[schema.template_id] = (schema, text)
+        return text
+
+    def build(self, schema: TemplateSchema, user_input: str, now: Optional[float] = None) -> List[Dict[str, str]]:
+        """组装对话消息：system为固定前缀，user只包含当前时间和用户输入"""
+        return [
+            {"role": "system", "content": self.prefix(schema)},
+            {"role": "user", "content": self._volatile(user_input, now)}
+        ]
+
+    def build_repair(self, schema: TemplateSchema, user_input: str, problems: List[Tuple[str, str, str, Optional[List[str]]]],
+                     now: Optional[float] = None) -> List[Dict[str, str]]:
+        """
+        只重新提取校验失败的字段（与完整提取共用固定前缀）
+
+        problems为 (字段名, 标签, 问题, 可选值或None) 列表。
+        """
+        lines = [
+            f"- {name}（{label}）: {reason}" + (f"，可选值: {'、'.join(options)}" if options else "")
+            for name, label, reason, options in problems
+        ]
+        return [
+            {"role": "system", "content": self.prefix(schema)},
+            {
+                "role": "user",
+                "content": self._volatile(user_input, now)
+                + "\n\n上次提取的以下字段不合法，请只返回这些字段的JSON：\n" + "\n".join(lines)
+            }
+        ]
+
+    @staticmethod
+    def _volatile(user_input: str, now: Optional[float]) -> str:
+        now = time.time() if now is None else now
+        moment = datetime.fromtimestamp(now)
+        return (
+            f"当前时间: {moment:%Y-%m-%d %H:%M} 星期{WEEKDAYS[moment.weekday()]}"
+            f"（时间戳毫秒: {int(now * 1000)}）\n"
+            f"用户输入: {user_input}"
+        )
@@ -0,0 +1,245 @@
+"""
+出站调用弹性层
+所有易快报/DeepSeek调用统一经过这里：按端点熔断、按观测到的p99延迟自适应超时、
+仅对幂等GET做抖动重试，并复用长连接
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from config import (
+    UPSTREAM_DEFAULT_TIMEOUT, UPSTREAM_MIN_TIMEOUT, UPSTREAM_MAX_TIMEOUT,
+    UPSTREAM_TIMEOUT_P99_MULTIPLIER, UPSTREAM_RETRY_ATTEMPTS, UPSTREAM_RETRY_BASE_DELAY
+)
+from services.circuit_breaker import get_breaker
+from services.metrics import LatencyTracker, metrics
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """熔断打开，请求被快速失败"""
+
+    def __init__(self, breaker_name: str):
+        super().__init__(f"上游 {breaker_name} 熔断中，请求已快速失败")
+        self.breaker_name = breaker_name
+
+
+class UpstreamGateway:
+    """出站HTTP网关：每个上游一个共享连接池客户端"""
+
+    MIN_SAMPLES = 20  # 样本不足时使用默认超时
+    COALESCE_IGNORED_PARAMS = frozenset({"accessToken"})  # 合并键不区分令牌（刷新前后的同一请求视为相同）
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._transport: Optional[httpx.AsyncBaseTransport] = None
+        self._inflight = SingleFlight()
+        self._validated: Dict[Tuple, httpx.Response] = {}  # 条件GET：上次带ETag/Last-Modified的响应
+
+    def set_transport(self, transport: Optional[httpx.AsyncBaseTransport]):
+        """替换底层传输（测试和离线基准使用），已创建的客户端会被丢弃"""
+        self._transport = transport
+        self._clients.clear()
+
+    def client(self, upstream: str) -> httpx.AsyncClient:
+        """获取上游对应的共享客户端"""
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=UPSTREAM_DEFAULT_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                transport=self._transport
+            )
+            self._clients[upstream] = client
+        return client
+
+    def latency(self, upstream: str, endpoint: str) -> LatencyTracker:
+        key = f"{upstream}:{endpoint}"
+        tracker = self._latency.get(key)
+        if tracker is None:
+            tracker = self._latency[key] = LatencyTracker()
+        return tracker
+
+    def timeout_for(self, upstream: str, endpoint: str) -> float:
+        """根据观测到的p99延迟计算超时时间"""
+        tracker = self.latency(upstream, endpoint)
+        if len(tracker.samples) < self.MIN_SAMPLES:
+            return UPSTREAM_DEFAULT_TIMEOUT
+        timeout = tracker.percentile(99) * UPSTREAM_TIMEOUT_P99_MULTIPLIER
+        return max(UPSTREAM_MIN_TIMEOUT, min(UPSTREAM_MAX_TIMEOUT, timeout))
+
+    def is_available(self, upstream: str, endpoint: str) -> bool:
+        """上游和端点熔断器均未打开"""
+        return not (get_breaker(upstream).is_open or get_breaker(f"{upstream}:{endpoint}").is_open)
+
+    async def request(self, upstream: str, endpoint: str, method: str, url: str,
+                      timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        发起出站请求
+
+        熔断打开时抛出CircuitOpenError；GET请求在传输错误或5xx时抖动重试，
+        其他方法只尝试一次。返回最后一次的响应，由调用方决定是否raise_for_status。
+        同时在途的相同GET请求（方法、URL、除令牌外的参数均相同）合并为一次上游调用，共享同一个响应；
+        某个调用方被取消不影响其他调用方，全部取消时才取消上游调用。
+        """
+        if method.upper() != "GET":
+            return await self._request(upstream, endpoint, method, url, timeout, **kwargs)
+
+        # 进程内合并：相同的GET同时只有一个在途请求
+        inflight_key = self._coalesce_key(method, url, kwargs.get("params"), kwargs.get("headers"))
+        if self._inflight.in_flight(inflight_key):
+            metrics.incr(f"upstream.{upstream}.{endpoint}.coalesced")
+        return await self._inflight.run(
+            inflight_key, lambda: self._request(upstream, endpoint, method, url, timeout, **kwargs)
+        )
+
+    def _coalesce_key(self, method: str, url: str, params: Optional[Dict[str, Any]],
+                      headers: Optional[Dict[str, str]] = None) -> Tuple:
+        """合并键：方法、URL、排序后的参数（不含令牌）和条件请求头"""
+        items = tuple(sorted(
+            (str(name), str(value)) for name, value in (params or {}).items()
+            if name not in self.COALESCE_IGNORED_PARAMS
+        ))
+        conditions = tuple(
+            value for name, value in (headers or {}).items()
+            if name.lower() in ("if-none-match", "if-modified-since")
+        )
+        return method.upper(), url, items, conditions
+
+    async def revalidating_get(self, upstream: str, endpoint: str, url: str,
+                               **kwargs) -> Tuple[httpx.Response, bool]:
+        """
+        条件GET：带上次响应的ETag/Last-Modified发起请求
+
+        上游返回304时返回上次保存的响应，否则返回新响应（上游未提供校验字段时即普通GET）。
+        返回 (响应, 是否未变化)。
+        """
+        key = self._coalesce_key("GET", url, kwargs.get("params"))
+        previous = self._validated.get(key)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if previous is not None:
+            if previous.headers.get("etag"):
+                headers["If-None-Match"] = previous.headers["etag"]
+            if previous.headers.get("last-modified"):
+                headers["If-Modified-Since"] = previous.headers["last-modified"]
+
+        response = await self.request(upstream, endpoint, "GET", url, headers=headers, **kwargs)
+        if response.status_code == 304 and previous is not None:
+            metrics.incr(f"upstream.{upstream}.{endpoint}.not_modified")
+            return previous, True
+        if response.status_code == 200 and ("etag" in response.headers or "last-modified" in response.headers):
+            self._validated[key] = response
+        return response, False
+
+    async def _request(self, upstream: str, endpoint: str, method: str, url: str,
+                       timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """发起请求（熔断检查 + GET重试）"""
+        breaker = get_breaker(f"{upstream}:{endpoint}")
+        if get_breaker(upstream).is_open or not breaker.allow_request():
+            raise CircuitOpenError(breaker.name)
+
+        attempts = 1 + (UPSTREAM_RETRY_ATTEMPTS if method.upper() == "GET" else 0)
+        request_timeout = timeout or self.timeout_for(upstream, endpoint)
+        tracker = self.latency(upstream, endpoint)
+
+        try:
+            for attempt in range(attempts):
+                metrics.incr(f"upstream.{upstream}.{endpoint}")
+                started = time.perf_counter()
+                try:
+                    response = await self.client(upstream).request(method, url, timeout=request_timeout, **kwargs)
+                except httpx.TransportError as e:
+                    breaker.record_failure()
+                    if attempt + 1 < attempts and breaker.state == breaker.CLOSED:
+                        logger.warning(f"{breaker.name} 请求失败，准备重试({attempt + 1}/{attempts - 1}): {e!r}")
+                        await self._backoff(attempt)
+                        continue
+                    raise
+                except Exception:
+                    breaker.record_failure()
+                    raise
+
+                tracker.record(time.perf_counter() - started)
+                if response.status_code < 500:
+                    breaker.record_success()
+                    return response
+
+                breaker.record_failure()
+                if attempt + 1 < attempts and breaker.state == breaker.CLOSED:
+                    logger.warning(f"{breaker.name} 返回 {response.status_code}，准备重试({attempt + 1}/{attempts - 1})")
+                    await self._backoff(attempt)
+                    continue
+                return response
+        except BaseException:
+            # 被取消（对冲请求落败、客户端断开）等没有记录结果的情况，交还半开探测名额
+            breaker.release_probe()
+            raise
+
+    @asynccontextmanager
+    async def stream(self, upstream: str, endpoint: str, method: str, url: str,
+                     timeout: Optional[float] = None, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        发起流式请求（熔断检查，不重试、不合并）
+
+        收到响应头后交给调用方逐块读取；超时作用于每次读取，取值同request。
+        整个流读完才记录延迟，读取过程中的传输错误和5xx计入熔断失败；
+        被取消或调用方在读取中抛出异常时不计结果，只交还半开探测名额。
+        """
+        breaker = get_breaker(f"{upstream}:{endpoint}")
+        if get_breaker(upstream).is_open or not breaker.allow_request():
+            raise CircuitOpenError(breaker.name)
+
+        metrics.incr(f"upstream.{upstream}.{endpoint}")
+        started = time.perf_counter()
+        request_timeout = timeout or self.timeout_for(upstream, endpoint)
+        try:
+            async with self.client(upstream).stream(method, url, timeout=request_timeout, **kwargs) as response:
+                yield response
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+        if response.status_code < 500:
+            self.latency(upstream, endpoint).record(time.perf_counter() - started)
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+    async def _backoff(self, attempt: int):
+        """指数退避 + 全抖动"""
+        await asyncio.sleep(random.uniform(0, UPSTREAM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+    def latency_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各端点的延迟统计和当前超时"""
+        stats = {}
+        for key, tracker in self._latency.items():
+            upstream, endpoint = key.split(":", 1)
+            stats[key] = dict(tracker.to_dict(), timeout_s=round(self.timeout_for(upstream, endpoint), 2))
+        return stats
+
+    async def aclose(self):
+        """关闭所有共享客户端"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+_gateway: Optional[UpstreamGateway] = None
+
+
+def get_gateway() -> UpstreamGateway:
+    """获取进程内唯一的出站网关"""
+    global _gateway
+    if _gateway is None:
+        _gateway = UpstreamGateway()
+    return _gateway
@@ -0,0 +1,164 @@
+"""
+DeepSeek出站调度
+所有DeepSeek调用按优先级类别排队：令牌桶限速 + 最大并发数，类别间按权重加权公平排队
+（交互 > 字段提取 > 批量 > 健康探测），交互请求延迟稳定，低优先级工作只使用剩余容量且不会饿死；
+收到429时按Retry-After暂停放行
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from config import DEEPSEEK_RATE_LIMIT, DEEPSEEK_BURST, DEEPSEEK_MAX_IN_FLIGHT
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别及其权重（都在排队时，各类别按权重比例分得放行名额）
+PRIORITY_WEIGHTS = {
+    "interactive": 16,
+    "extraction": 8,
+    "bulk": 2,
+    "probe": 1
+}
+
+
+class PriorityScheduler:
+    """令牌桶 + 并发上限 + 加权公平排队"""
+
+    def __init__(self, rate: float = DEEPSEEK_RATE_LIMIT, burst: float = DEEPSEEK_BURST,
+                 max_in_flight: int = DEEPSEEK_MAX_IN_FLIGHT, weights: Optional[Dict[str, int]] = None,
+                 name: str = "deepseek"):
+        self.rate = rate  # 每秒放行数，0表示不限速
+        self.burst = max(burst, 1)
+        self.max_in_flight = max_in_flight  # 0表示不限并发
+        self.weights = weights or PRIORITY_WEIGHTS
+        self.name = name
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        # 等待队列：(虚拟完成时间, 序号, 类别, future)，虚拟完成时间最小的先放行
+        self._queue: List[Tuple[float, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        metrics.register_gauge(f"{name}.scheduler.in_flight", lambda: self._in_flight)
+        metrics.register_gauge(f"{name}.scheduler.queue_depth", lambda: self.queue_depth())
+        for priority in self.weights:
+            metrics.register_gauge(f"{name}.scheduler.{priority}.queue_depth",
+                                   lambda priority=priority: self.queue_depth(priority))
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        return sum(
+            1 for _, _, queued, future in self._queue
+            if not future.done() and (priority is None or queued == priority)
+        )
+
+    @asynccontextmanager
+    async def slot(self, priority: str) -> AsyncIterator[None]:
+        """占用一个放行名额直到调用结束（流式调用在整个输出期间占用）"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str):
+        if priority not in self.weights:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        started = time.perf_counter()
+        if not self._queue and self._take():
+            metrics.observe(f"{self.name}.scheduler.{priority}.wait", 0.0)
+            return
+
+        # 加权公平排队：同一类别的请求虚拟完成时间依次递增 1/权重
+        tag = max(self._virtual_time, self._last_finish.get(priority, 0.0)) + 1.0 / self.weights[priority]
+        self._last_finish[priority] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (tag, next(self._seq), priority, future))
+        metrics.incr(f"{self.name}.scheduler.{priority}.queued")
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # 已放行但调用方被取消，归还名额
+            raise
+        metrics.observe(f"{self.name}.scheduler.{priority}.wait", time.perf_counter() - started)
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def throttle(self, seconds: float):
+        """上游返回429：暂停放行seconds秒并清空令牌桶"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._refilled_at = self._paused_until
+        metrics.incr(f"{self.name}.scheduler.throttled")
+        logger.warning("⏳ %s 被限流，暂停放行 %.1f 秒", self.name, seconds)
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _delay(self) -> float:
+        """距离下一次可放行的秒数（0表示现在就可以）"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self.rate > 0 and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0.0
+
+    def _take(self) -> bool:
+        if self.max_in_flight and self._in_flight >= self.max_in_flight:
+            return False
+        if self._delay() > 0:
+            return False
+        if self.rate > 0:
+            self._tokens -= 1
+        self._in_flight += 1
+        return True
+
+    def _dispatch(self):
+        """按虚拟完成时间放行排队的请求，令牌不足时定时再试（并发已满时由release触发）"""
+        while self._queue:
+            tag, _, _, future = self._queue[0]
+            if future.done():  # 等待中被取消
+                heapq.heappop(self._queue)
+                continue
+            if not self._take():
+                delay = self._delay()
+                loop = asyncio.get_running_loop()
+                if delay > 0 and (self._timer is None or self._timer_loop is not loop):
+                    self._timer = loop.call_later(delay, self._on_timer)
+                    self._timer_loop = loop
+                return
+            heapq.heappop(self._queue)
+            self._virtual_time = tag
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+
+_scheduler: Optional[PriorityScheduler] = None
+
+
+def get_scheduler() -> PriorityScheduler:
+    """获取进程内唯一的DeepSeek调度器（所有DeepSeekService实例共享限速和并发额度）"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PriorityScheduler()
+    return _scheduler
@@ -0,0 +1,365 @@
+"""
+跨worker共享缓存层
+后端采用Redis兼容接口（get/set/delete/incr/publish）：默认SQLite(WAL)本地文件，
+测试可用内存实现替代，配置SHARED_CACHE_URL后可直接使用Redis
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import (
+    SHARED_CACHE_BACKEND, SHARED_CACHE_FILE, SHARED_CACHE_URL,
+    CACHE_VERSION_CHECK_INTERVAL
+)
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Redis上的比较删除：值仍是自己的令牌时才删除（租约过期后被别人拿到时不误删）
+RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class MemoryCache:
+    """进程内缓存后端（Redis接口的本地替身，用于测试和单进程部署）"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._subscribers: List[Callable[[str, str], None]] = []
+
+    def _alive(self, key: str) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            return False
+        return True
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self._data[key][0] if self._alive(key) else None
+
+    async def set(self, key: str, value: Any, ex: Optional[float] = None, nx: bool = False) -> bool:
+        if nx and self._alive(key):
+            return False
+        self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    async def delete_if_equals(self, key: str, value: Any) -> bool:
+        """值等于value时才删除"""
+        if self._alive(key) and self._data[key][0] == value:
+            del self._data[key]
+            return True
+        return False
+
+    async def incr(self, key: str) -> int:
+        value = int(await self.get(key) or 0) + 1
+        self._data[key] = (str(value), self._data.get(key, (None, None))[1])
+        return value
+
+    async def publish(self, channel: str, message: str) -> int:
+        for callback in list(self._subscribers):
+            callback(channel, message)
+        return len(self._subscribers)
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """注册进程内广播回调"""
+        self._subscribers.append(callback)
+
+
+class SQLiteCache:
+    """SQLite(WAL)文件缓存后端：同机多个worker共享，阻塞操作放到线程中执行"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[str, str], None]] = []
+        self._writes = 0
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ex: Optional[float], nx: bool) -> bool:
+        now = time.time()
+        expires_at = now + ex if ex else None
+        with self._lock:
+            if nx:
+                # 过期的旧值视为不存在
+                self._conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                stored = cursor.rowcount == 1
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                stored = True
+            self._writes += 1
+            if self._writes % 500 == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        return stored
+
+    def _delete(self, keys: Tuple[str, ...]) -> int:
+        with self._lock:
+            return sum(self._conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount for key in keys)
+
+    def _delete_if_equals(self, key: str, value: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, value)).rowcount == 1
+
+    def _incr(self, key: str) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+                value = int(row[0]) + 1 if row else 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, NULL)",
+                    (key, str(value))
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ex: Optional[float] = None, nx: bool = False) -> bool:
+        return await asyncio.to_thread(self._set, key, value, ex, nx)
+
+    async def delete(self, *keys: str) -> int:
+        return await asyncio.to_thread(self._delete, keys)
+
+    async def delete_if_equals(self, key: str, value: str) -> bool:
+        """值等于value时才删除"""
+        return await asyncio.to_thread(self._delete_if_equals, key, value)
+
+    async def incr(self, key: str) -> int:
+        return await asyncio.to_thread(self._incr, key)
+
+    async def publish(self, channel: str, message: str) -> int:
+        # 其他worker通过命名空间版本号感知失效（最多延迟CACHE_VERSION_CHECK_INTERVAL秒）
+        for callback in list(self._subscribers):
+            callback(channel, message)
+        return len(self._subscribers)
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """注册进程内广播回调"""
+        self._subscribers.append(callback)
+
+
+def create_backend(backend: str = SHARED_CACHE_BACKEND):
+    """根据配置创建缓存后端"""
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            logger.warning("未安装redis包，共享缓存回退为SQLite")
+        else:
+            return redis_asyncio.from_url(SHARED_CACHE_URL, decode_responses=True)
+    if backend == "memory":
+        return MemoryCache()
+    return SQLiteCache(SHARED_CACHE_FILE)
+
+
+class CacheTier:
+    """
+    共享缓存层：命名空间版本化键 + 失效广播 + 跨worker单飞加载
+
+    键格式为 {namespace}:v{version}:{key}。失效时递增命名空间版本号并广播，
+    旧版本的键自然失效；进程内一级缓存最多CACHE_VERSION_CHECK_INTERVAL秒后感知新版本。
+    """
+
+    def __init__(self, backend=None, version_check_interval: float = CACHE_VERSION_CHECK_INTERVAL):
+        self.backend = backend if backend is not None else create_backend()
+        self.version_check_interval = version_check_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._versions: Dict[str, Tuple[int, float]] = {}
+        self._local: Dict[str, Tuple[Any, float]] = {}
+        self._inflight = SingleFlight()
+        if hasattr(self.backend, "subscribe"):
+            self.backend.subscribe(self._on_invalidate)
+
+    def _on_invalidate(self, channel: str, namespace: str):
+        """收到失效广播：丢弃本地版本号缓存"""
+        if channel == INVALIDATION_CHANNEL:
+            self._versions.pop(namespace, None)
+
+    async def namespace_version(self, namespace: str) -> int:
+        """读取命名空间版本号（本地缓存version_check_interval秒）"""
+        cached = self._versions.get(namespace)
+        now = time.monotonic()
+        if cached and now - cached[1] < self.version_check_interval:
+            return cached[0]
+        version = int(await self.backend.get(f"{namespace}:version") or 0)
+        self._versions[namespace] = (version, now)
+        return version
+
+    async def _versioned_key(self, namespace: str, key: str) -> str:
+        return f"{namespace}:v{await self.namespace_version(namespace)}:{key}"
+
+    async def get(self, namespace: str, key: str, use_local: bool = True) -> Optional[Any]:
+        """读取缓存值（先本地一级缓存，再共享后端；use_local=False时总是读取共享后端）"""
+        full_key = await self._versioned_key(namespace, key)
+        local = self._local.get(full_key)
+        if use_local and local and local[1] > time.time():
+            return local[0]
+        raw = await self.backend.get(full_key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        self._local[full_key] = (entry["value"], entry["expires_at"])
+        return entry["value"]
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: float):
+        """写入缓存值"""
+        full_key = await self._versioned_key(namespace, key)
+        now = time.time()
+        expires_at = now + ttl
+        if len(self._local) > 1024:
+            self._local = {k: v for k, v in self._local.items() if v[1] > now}
+        self._local[full_key] = (value, expires_at)
+        await self.backend.set(full_key, json.dumps({"value": value, "expires_at": expires_at}, ensure_ascii=False), ex=math.ceil(ttl))
+
+    async def invalidate(self, namespace: str) -> int:
+        """使整个命名空间失效并广播给其他worker"""
+        version = await self.backend.incr(f"{namespace}:version")
+        self._versions[namespace] = (version, time.monotonic())
+        prefix = f"{namespace}:"
+        for full_key in [k for k in self._local if k.startswith(prefix)]:
+            del self._local[full_key]
+        await self.backend.publish(INVALIDATION_CHANNEL, namespace)
+        logger.info(f"🧹 缓存命名空间 {namespace} 已失效，新版本: v{version}")
+        return version
+
+    async def listen_invalidations(self):
+        """监听Redis失效广播（仅Redis后端需要，在应用生命周期内作为后台任务运行）"""
+        if not hasattr(self.backend, "pubsub"):
+            return
+        pubsub = self.backend.pubsub()
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        async for message in pubsub.listen():
+            if message.get("type") == "message":
+                self._on_invalidate(INVALIDATION_CHANNEL, message["data"])
+
+    def _lease_token(self) -> str:
+        """每次加锁唯一的租约令牌（释放时只删除自己的租约）"""
+        return f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+
+    async def _release_lease(self, lease_key: str, token: str):
+        """比较删除：租约仍归自己时才删除"""
+        if hasattr(self.backend, "delete_if_equals"):
+            await self.backend.delete_if_equals(lease_key, token)
+        else:
+            await self.backend.eval(RELEASE_LEASE_SCRIPT, 1, lease_key, token)
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 30.0, poll_interval: float = 0.05,
+                   timeout: Optional[float] = None):
+        """
+        跨worker租约锁（SET NX EX），持有者异常退出时租约自动过期
+
+        timeout秒内（默认同ttl）拿不到锁时抛出TimeoutError。
+        """
+        lease_key = f"lock:{name}"
+        token = self._lease_token()
+        deadline = time.monotonic() + (ttl if timeout is None else timeout)
+        while not await self.backend.set(lease_key, token, ex=math.ceil(ttl), nx=True):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"获取租约锁超时: {name}")
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            await self._release_lease(lease_key, token)
+
+    async def get_or_load(self, namespace: str, key: str, loader: Callable[[], Awaitable[Any]],
+                          ttl: float, cacheable: Callable[[Any], bool] = lambda value: True,
+                          lease_ttl: float = 30.0) -> Any:
+        """
+        读取缓存，未命中时只由一个worker调用loader回源，其余worker等待结果
+
+        ttl<=0 时不使用缓存，直接调用loader
+        """
+        if ttl <= 0:
+            return await loader()
+
+        value = await self.get(namespace, key)
+        if value is not None:
+            return value
+
+        # 进程内合并：同一个键同时只有一个回源；某个等待方被取消不影响其他等待方
+        return await self._inflight.run(
+            f"{namespace}:{key}", lambda: self._load_with_lease(namespace, key, loader, ttl, cacheable, lease_ttl)
+        )
+
+    async def _load_with_lease(self, namespace: str, key: str, loader: Callable[[], Awaitable[Any]],
+                               ttl: float, cacheable: Callable[[Any], bool], lease_ttl: float) -> Any:
+        """跨worker单飞：拿到租约的worker回源，其余worker轮询共享后端直到值出现或租约过期"""
+        lease_key = f"lease:{await self._versioned_key(namespace, key)}"
+        token = self._lease_token()
+        deadline = time.monotonic() + lease_ttl
+        leased = True
+        while not await self.backend.set(lease_key, token, ex=math.ceil(lease_ttl), nx=True):
+            await asyncio.sleep(0.05)
+            value = await self.get(namespace, key)
+            if value is not None:
+                return value
+            if time.monotonic() >= deadline:
+                leased = False  # 持有者迟迟没有结果：不持租约自行回源，也不动别人的租约
+                break
+        try:
+            value = await loader()
+            if cacheable(value):
+                await self.set(namespace, key, value, ttl)
+            return value
+        finally:
+            if leased:
+                await self._release_lease(lease_key, token)
+
+
+_shared_cache: Optional[CacheTier] = None
+
+
+def get_shared_cache() -> CacheTier:
+    """获取进程内唯一的共享缓存层实例"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = CacheTier()
+    return _shared_cache
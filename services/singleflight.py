@@ -0,0 +1,45 @@
+"""
+进程内合并同时在途的相同操作
+操作在独立任务中执行，所有调用方（包括发起方）都只是等待方：某个等待方被取消只影响它自己，
+最后一个等待方也取消时才取消操作本身，避免发起方被取消时把CancelledError传给其他等待方
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """按键合并同时在途的操作"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, List[Any]] = {}  # 键 -> [任务, 等待方数量]
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(self, key: Hashable, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """执行operation，或等待同键的进行中操作并共享结果（异常同样共享）"""
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(operation())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                # 所有等待方都已取消：操作不再需要，新的调用方重新发起
+                self._forget(key, task)
+                task.cancel()
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        self._forget(key, task)
+        if not task.cancelled():
+            task.exception()  # 避免无人等待时的"exception never retrieved"警告
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
@@ -0,0 +1,73 @@
+"""
+投机执行
+在意图识别（LLM调用）进行期间提前启动后续大概率需要的只读上游调用（Token、模板、档案），
+与LLM思考时间重叠；意图确认后同一请求直接取用预取结果，意图不符时取消未完成的预取
+（预取经共享缓存和网关合并回源，取消只让预取退出等待，其他请求合并到的回源照常完成）
+"""
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Optional, Set
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的投机预取任务
+_current_prefetch: ContextVar[Optional[asyncio.Task]] = ContextVar("speculative_prefetch", default=None)
+
+
+async def take_prefetched() -> Optional[Any]:
+    """取出当前请求的投机预取结果（等待未完成的预取；没有预取或预取失败时返回None）"""
+    task = _current_prefetch.get()
+    if task is None:
+        return None
+    _current_prefetch.set(None)
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        return None
+
+
+class SpeculativeExecutor:
+    """投机任务的启动、结算和关闭"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Set[asyncio.Task] = set()
+        metrics.register_gauge(f"speculation.{name}.in_flight", lambda: len(self._tasks))
+
+    def start(self, coro: Awaitable[Any]) -> asyncio.Task:
+        """在后台启动投机任务（持有引用，避免任务被回收），并绑定到当前请求供take_prefetched取用"""
+        task = asyncio.ensure_future(coro)
+        _current_prefetch.set(task)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+        metrics.incr(f"speculation.{self.name}.started")
+        return task
+
+    def settle(self, task: asyncio.Task, used: bool):
+        """意图确定后结算投机任务：未用到且仍在进行的任务被取消"""
+        metrics.incr(f"speculation.{self.name}.{'used' if used else 'wasted'}")
+        if not used:
+            if not task.done():
+                task.cancel()
+                metrics.incr(f"speculation.{self.name}.cancelled")
+        elif task.done() and not task.cancelled() and task.exception() is None:
+            metrics.incr(f"speculation.{self.name}.ready_in_time")
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            metrics.incr(f"speculation.{self.name}.failed")
+            logger.debug("投机预取失败（%s）: %s", self.name, error)
+
+    async def shutdown(self):
+        """应用关闭时取消仍在进行的投机任务"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
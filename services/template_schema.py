@@ -0,0 +1,174 @@
+"""
+编译后的模板字段模型
+每个模板版本只解析一次：字段按名称建索引，预先划分档案/日期/金额字段集合，
+并为每个字段绑定好值转换和校验函数，创建申请单时无需反复线性扫描字段列表
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ARCHIVE_PREFIX = "basedata.Dimension."
+
+Converter = Callable[[Any], Any]
+Validator = Callable[[Any], Optional[str]]  # 返回错误信息，校验通过时返回None
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+class FieldSpec:
+    """单个模板字段"""
+
+    __slots__ = ("name", "label", "type", "required", "value_from", "archive_name", "convert", "validate")
+
+    def __init__(self, name: str, label: str, field_type: str, required: bool, value_from: str = "",
+                 convert: Converter = _identity, validate: Optional[Validator] = None):
+        self.name = name
+        self.label = label
+        self.type = field_type
+        self.required = required
+        self.value_from = value_from
+        self.archive_name = value_from[len(ARCHIVE_PREFIX):] if value_from.startswith(ARCHIVE_PREFIX) else None
+        self.convert = convert
+        self.validate = validate
+
+    @property
+    def is_archive(self) -> bool:
+        return self.archive_name is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """与get_template_fields返回的fields结构一致"""
+        return {
+            "name": self.name,
+            "label": self.label,
+            "type": self.type,
+            "required": self.required,
+            "valueFrom": self.value_from
+        }
+
+
+class TemplateSchema:
+    """一个模板版本的字段模型"""
+
+    __slots__ = ("template_id", "template_name", "fields", "by_name",
+                 "required_fields", "archive_fields", "date_fields", "money_fields", "validated_fields",
+                 "_fields_info")
+
+    def __init__(self, template_id: str, template_name: str, fields: List[FieldSpec]):
+        self.template_id = template_id
+        self.template_name = template_name
+        self.fields: Tuple[FieldSpec, ...] = tuple(fields)
+        self.by_name: Dict[str, FieldSpec] = {field.name: field for field in self.fields}
+        self.required_fields = tuple(field for field in self.fields if field.required)
+        self.archive_fields = tuple(field for field in self.fields if field.is_archive)
+        self.date_fields = frozenset(field.name for field in self.fields if field.type == "日期")
+        self.money_fields = frozenset(field.name for field in self.fields if field.type == "金额")
+        self.validated_fields = tuple(field for field in self.fields if field.validate)
+        self._fields_info: Optional[List[Dict[str, Any]]] = None
+
+    @classmethod
+    def compile(cls, template_id: str, template_name: str, form_fields: List[Dict[str, Any]],
+                translate_type: Callable[[str], str],
+                converters: Optional[Dict[str, Converter]] = None,
+                validators: Optional[Dict[str, Validator]] = None) -> "TemplateSchema":
+        """
+        从模板详情的form（字典数组，每项为 {字段名: 字段配置}）编译字段模型
+
+        translate_type把API字段类型翻译为中文类型，converters按中文类型提供值转换函数，
+        validators按字段名提供校验函数。
+        """
+        converters = converters or {}
+        validators = validators or {}
+        fields = []
+        for field_item in form_fields:
+            if not isinstance(field_item, dict):
+                continue
+            for field_name, field_config in field_item.items():
+                if isinstance(field_config, dict) and field_config:
+                    field_type = translate_type(field_config.get("type", "text"))
+                    fields.append(FieldSpec(
+                        field_name,
+                        field_config.get("label", field_name),
+                        field_type,
+                        not field_config.get("optional", False),
+                        field_config.get("valueFrom", ""),
+                        converters.get(field_type, _identity),
+                        validators.get(field_name)
+                    ))
+                else:
+                    # 找不到配置时使用默认值
+                    fields.append(FieldSpec(field_name, field_name, "文本", True, validate=validators.get(field_name)))
+        return cls(template_id, template_name, fields)
+
+    @classmethod
+    def from_fields_info(cls, template_id: str, template_name: str, fields_info: List[Dict[str, Any]],
+                         converters: Optional[Dict[str, Converter]] = None,
+                         validators: Optional[Dict[str, Validator]] = None) -> "TemplateSchema":
+        """从get_template_fields返回的fields（共享缓存中的JSON结构）重建字段模型"""
+        converters = converters or {}
+        validators = validators or {}
+        return cls(template_id, template_name, [
+            FieldSpec(
+                field["name"],
+                field.get("label", field["name"]),
+                field.get("type", "文本"),
+                field.get("required", False),
+                field.get("valueFrom", ""),
+                converters.get(field.get("type", "文本"), _identity),
+                validators.get(field["name"])
+            )
+            for field in fields_info
+        ])
+
+    def get(self, name: str) -> Optional[FieldSpec]:
+        return self.by_name.get(name)
+
+    @property
+    def fields_info(self) -> List[Dict[str, Any]]:
+        """字段列表（字典形式，用于接口返回和提示词）"""
+        if self._fields_info is None:
+            self._fields_info = [field.to_dict() for field in self.fields]
+        return self._fields_info
+
+    def validate(self, field_mapping: Dict[str, Any]) -> Optional[str]:
+        """校验必填字段和字段值，返回第一个错误信息，全部通过时返回None"""
+        for field in self.required_fields:
+            if field.name not in field_mapping:
+                return f"缺少必填字段：{field.label}"
+        for field in self.validated_fields:
+            if field.name in field_mapping:
+                error = field.validate(field_mapping[field.name])
+                if error:
+                    return error
+        return None
+
+    def build_form(self, field_mapping: Dict[str, Any], resolved: Optional[Dict[str, Any]] = None,
+                   base: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        单次遍历构建请求体form并同时校验
+
+        每个字段用编译时绑定的转换函数写入form；resolved为已解析好的字段值（如档案项ID），
+        base为固定字段（如specificationId）。返回 (form, 第一个错误信息或None)。
+        """
+        form = dict(base or {})
+        resolved = resolved or {}
+        by_name = self.by_name
+        required_seen = 0
+        error = None
+        for name, value in field_mapping.items():
+            field = by_name.get(name)
+            if field is None:
+                form[name] = value
+                continue
+            if field.required:
+                required_seen += 1
+            if error is None and field.validate is not None:
+                error = field.validate(value)
+            form[name] = resolved[name] if name in resolved else field.convert(value)
+        if required_seen < len(self.required_fields):
+            error = self.validate(field_mapping)  # 缺少必填字段的错误优先
+        return form, error
+
+    def convert(self, name: str, value: Any) -> Any:
+        """按字段类型转换值，未知字段原样返回"""
+        field = self.by_name.get(name)
+        return field.convert(value) if field else value
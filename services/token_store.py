@@ -0,0 +1,173 @@
+"""
+Token存储
+内存为主、磁盘为辅的令牌缓存：原子写入 + 跨进程文件锁，多个worker共享同一个有效Token
+配置了共享缓存层（如Redis）时，改用共享缓存持久化和租约锁，支持多机共享
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path: str, data: Any):
+    """原子写入JSON文件（先写临时文件，再rename覆盖，避免并发写入导致文件损坏）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(path: str) -> Optional[Any]:
+    """读取JSON文件，文件不存在时返回None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class FileLock:
+    """跨进程文件锁（阻塞调用，需放到线程中执行）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, timeout: float):
+        """获取排他锁，超时抛出TimeoutError"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise TimeoutError(f"获取文件锁超时: {self.path}")
+                time.sleep(0.05)
+
+    def release(self):
+        """释放锁"""
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TokenStore:
+    """令牌存储：内存为主，磁盘持久化在线程中原子完成"""
+
+    CACHE_NAMESPACE = "token"
+    CACHE_KEY = "ekuaibao"
+
+    def __init__(self, cache_file: str, lock_timeout: float = 30.0, shared_cache=None):
+        self.cache_file = cache_file
+        self.lock_timeout = lock_timeout
+        self.shared_cache = shared_cache
+        self._file_lock = FileLock(cache_file + ".lock")
+        self._lock = asyncio.Lock()
+        self._token: Optional[Dict[str, Any]] = None
+
+    @property
+    def token(self) -> Optional[Dict[str, Any]]:
+        """当前内存中的令牌"""
+        return self._token
+
+    def is_valid(self, margin_seconds: int = 300) -> bool:
+        """仅检查内存中的令牌是否有效（提前margin_seconds秒视为过期）"""
+        if not self._token:
+            return False
+        expire_time = self._token.get("expireTime", 0) / 1000
+        return time.time() < (expire_time - margin_seconds)
+
+    def refreshed_within(self, seconds: float) -> bool:
+        """令牌是否在最近seconds秒内被（任一worker）获取或刷新"""
+        if not self._token:
+            return False
+        return time.time() - self._token.get("savedAt", 0) < seconds
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        """从磁盘（或共享缓存）加载令牌到内存"""
+        try:
+            if self.shared_cache:
+                self._token = await self.shared_cache.get(self.CACHE_NAMESPACE, self.CACHE_KEY, use_local=False)
+            else:
+                self._token = await asyncio.to_thread(read_json, self.cache_file)
+            logger.debug("加载Token缓存成功" if self._token else "Token缓存文件不存在")
+        except Exception as e:
+            logger.error(f"加载Token缓存失败: {e}")
+            self._token = None
+        return self._token
+
+    async def save(self, token: Dict[str, Any]):
+        """更新内存令牌并原子写入磁盘（或共享缓存）"""
+        self._token = dict(token, savedAt=time.time())
+        try:
+            if self.shared_cache:
+                ttl = max(self._token.get("expireTime", 0) / 1000 - time.time(), 1)
+                await self.shared_cache.set(self.CACHE_NAMESPACE, self.CACHE_KEY, self._token, ttl)
+            else:
+                await asyncio.to_thread(atomic_write_json, self.cache_file, self._token)
+            logger.debug("保存Token缓存成功")
+        except Exception as e:
+            logger.error(f"保存Token缓存失败: {e}")
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """进程内协程锁 + 跨进程文件锁，保证同一时刻只有一个worker在刷新令牌"""
+        async with self._lock:
+            if self.shared_cache:
+                async with self.shared_cache.lock(self.CACHE_NAMESPACE, ttl=self.lock_timeout):
+                    yield self
+                return
+            acquiring = asyncio.ensure_future(asyncio.to_thread(self._file_lock.acquire, self.lock_timeout))
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # 线程中的acquire不会随取消停止：等它结束，拿到了锁就立即释放，再把取消传出去
+                acquiring.add_done_callback(self._release_abandoned)
+                raise
+            try:
+                yield self
+            finally:
+                await asyncio.to_thread(self._file_lock.release)
+
+    def _release_abandoned(self, acquiring: "asyncio.Future"):
+        """释放等待方已被取消、但线程仍然拿到的文件锁"""
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            self._file_lock.release()
@@ -0,0 +1,121 @@
+"""
+MCP工具注册表
+用@mcp_tool装饰MCP方法即注册为AI可调用的工具：导入时生成一次工具JSON Schema并序列化，
+调用时按名称O(1)查找、校验参数后分发到对应方法
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from services.json_codec import dumps_bytes
+
+# JSON Schema类型与Python类型的对应
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda value: isinstance(value, str),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+}
+
+
+class ToolError(ValueError):
+    """工具不存在或参数不合法"""
+
+
+class ToolSpec:
+    """一个已注册的工具"""
+
+    __slots__ = ("name", "description", "parameters", "required", "response_type", "schema")
+
+    def __init__(self, name: str, description: str, parameters: Dict[str, Dict[str, Any]],
+                 required: Sequence[str], response_type: str):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.required = tuple(required)
+        self.response_type = response_type
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": {
+                    "type": "object",
+                    "properties": parameters,
+                    "required": list(self.required)
+                }
+            }
+        }
+
+    def validate(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """校验参数并返回调用方法用的关键字参数（忽略未声明的参数）"""
+        if not isinstance(arguments, dict):
+            raise ToolError(f"工具 {self.name} 的参数必须是JSON对象")
+        for name in self.required:
+            if name not in arguments:
+                raise ToolError(f"工具 {self.name} 缺少参数: {name}")
+        kwargs = {}
+        for name, prop in self.parameters.items():
+            if name not in arguments:
+                continue
+            value = arguments[name]
+            check = _TYPE_CHECKS.get(prop.get("type"))
+            if check and not check(value):
+                raise ToolError(f"工具 {self.name} 的参数 {name} 应为 {prop.get('type')}")
+            kwargs[name] = value
+        return kwargs
+
+
+def mcp_tool(description: str, parameters: Optional[Dict[str, Dict[str, Any]]] = None,
+             required: Sequence[str] = (), response_type: str = "success"):
+    """
+    把MCP方法注册为工具
+
+    parameters为JSON Schema属性定义（参数名与方法参数一致），response_type为调用成功时的聊天响应类型。
+    """
+    def decorator(func):
+        func.__mcp_tool__ = ToolSpec(func.__name__, description, parameters or {}, required, response_type)
+        return func
+    return decorator
+
+
+class ToolRegistry:
+    """工具注册表（按类收集一次，所有实例共享）"""
+
+    def __init__(self, specs: List[ToolSpec]):
+        self.specs: Dict[str, ToolSpec] = {spec.name: spec for spec in specs}  # 子类覆盖的同名工具只保留一份
+        self.schemas: List[Dict[str, Any]] = [spec.schema for spec in self.specs.values()]
+        self.schemas_json: bytes = dumps_bytes(self.schemas)  # 预先序列化，请求时直接拼接进请求体
+
+    @classmethod
+    def collect(cls, owner: type) -> "ToolRegistry":
+        """按定义顺序收集类中被@mcp_tool装饰的方法"""
+        specs = []
+        for klass in reversed(owner.__mro__):
+            for attr in vars(klass).values():
+                spec = getattr(attr, "__mcp_tool__", None)
+                if isinstance(spec, ToolSpec):
+                    specs.append(spec)
+        return cls(specs)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.specs
+
+    def parse_call(self, name: str, raw_arguments: Any) -> Tuple[ToolSpec, Dict[str, Any]]:
+        """查找工具并校验参数（raw_arguments可以是AI返回的JSON字符串）"""
+        spec = self.specs.get(name)
+        if spec is None:
+            raise ToolError(f"未知的工具调用: {name}")
+        if isinstance(raw_arguments, str):
+            try:
+                raw_arguments = json.loads(raw_arguments) if raw_arguments.strip() else {}
+            except json.JSONDecodeError:
+                raise ToolError(f"工具 {name} 的参数不是合法JSON")
+        return spec, spec.validate(raw_arguments or {})
+
+    async def dispatch(self, instance: Any, name: str, raw_arguments: Any) -> Tuple[ToolSpec, Dict[str, Any]]:
+        """校验参数并调用实例上的工具方法，返回 (工具, 方法返回值)"""
+        spec, kwargs = self.parse_call(name, raw_arguments)
+        result = await getattr(instance, spec.name)(**kwargs)
+        return spec, result
@@ -0,0 +1,209 @@
+"""
+DeepSeek用量记账
+每次DeepSeek调用的输入/缓存命中/输出token数、延迟和估算费用按 (日期, 调用场景, 用户, 会话) 在内存中汇总，
+定期写入SQLite（同机多个worker累加到同一个库）；同时按用户和全局的当日费用执行预算，超出后由调用方降级为本地处理
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+from contextvars import ContextVar
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    USAGE_DB_FILE, USAGE_FLUSH_INTERVAL, DEEPSEEK_PRICE_INPUT, DEEPSEEK_PRICE_INPUT_CACHE_HIT, DEEPSEEK_PRICE_OUTPUT,
+    USAGE_USER_DAILY_BUDGET, USAGE_GLOBAL_DAILY_BUDGET
+)
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS = "anonymous"
+GROUP_COLUMNS = ("call_site", "user_id", "session_id")
+# 汇总列：调用次数、输入token、缓存命中token、输出token、总延迟毫秒、估算费用（元）
+COUNTER_COLUMNS = ("calls", "prompt_tokens", "cache_hit_tokens", "completion_tokens", "latency_ms", "cost")
+
+# 当前请求的 (会话ID, 用户ID)
+_usage_context: ContextVar[Tuple[str, str]] = ContextVar("usage_context", default=("", ANONYMOUS))
+
+
+def bind_usage_context(session_id: Optional[str], user_id: Optional[str]):
+    """
+    把会话和用户绑定到当前请求，之后的DeepSeek调用记到他们名下
+
+    前端不传user_id：未提供时按会话记为"session:<会话ID>"，用户预算按会话执行。
+    """
+    if not user_id and session_id:
+        user_id = f"session:{session_id}"
+    _usage_context.set((session_id or "", user_id or ANONYMOUS))
+
+
+def current_user() -> str:
+    return _usage_context.get()[1]
+
+
+class UsageLedger:
+    """内存汇总 + 定期写入SQLite的用量账本"""
+
+    def __init__(self, path: str = USAGE_DB_FILE, flush_interval: float = USAGE_FLUSH_INTERVAL,
+                 user_daily_budget: float = USAGE_USER_DAILY_BUDGET,
+                 global_daily_budget: float = USAGE_GLOBAL_DAILY_BUDGET):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.user_daily_budget = user_daily_budget
+        self.global_daily_budget = global_daily_budget
+        self.prices = (DEEPSEEK_PRICE_INPUT, DEEPSEEK_PRICE_INPUT_CACHE_HIT, DEEPSEEK_PRICE_OUTPUT)
+        self._lock = threading.Lock()  # 保护内存汇总
+        self._db_lock = threading.Lock()  # 串行化SQLite访问（后台写入线程与报表查询）
+        self._pending: Dict[Tuple[str, str, str, str], List[float]] = {}  # 未写入的汇总
+        # 当日已花费用：库中已有的部分（每次写入后刷新，包含其他worker的用量）+ 本进程未写入的部分
+        self._day = date.today().isoformat()
+        self._stored_cost: Dict[str, float] = {}
+        self._stored_total = 0.0
+        self._pending_cost: Dict[str, float] = {}
+        self._pending_total = 0.0
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage (day TEXT, call_site TEXT, user_id TEXT, session_id TEXT, "
+                + ", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in COUNTER_COLUMNS)
+                + ", PRIMARY KEY (day, call_site, user_id, session_id))"
+            )
+        return self._conn
+
+    def cost(self, prompt_tokens: int, cache_hit_tokens: int, completion_tokens: int) -> float:
+        """按单价估算一次调用的费用（元）"""
+        input_price, hit_price, output_price = self.prices
+        return ((prompt_tokens - cache_hit_tokens) * input_price + cache_hit_tokens * hit_price
+                + completion_tokens * output_price) / 1_000_000
+
+    def record(self, call_site: str, usage: Optional[Dict[str, Any]], latency: float):
+        """记录一次调用（只更新内存汇总，不做I/O）"""
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        hit_tokens = usage.get("prompt_cache_hit_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cost = self.cost(prompt_tokens, hit_tokens, completion_tokens)
+        session_id, user_id = _usage_context.get()
+        today = date.today().isoformat()
+        with self._lock:
+            if today != self._day:
+                self._roll_over(today)
+            row = self._pending.setdefault((today, call_site, user_id, session_id), [0.0] * len(COUNTER_COLUMNS))
+            for index, value in enumerate((1, prompt_tokens, hit_tokens, completion_tokens, latency * 1000, cost)):
+                row[index] += value
+            self._pending_cost[user_id] = self._pending_cost.get(user_id, 0.0) + cost
+            self._pending_total += cost
+        metrics.incr(f"usage.{call_site}.calls")
+
+    def _roll_over(self, today: str):
+        self._day = today
+        self._stored_cost = {}
+        self._stored_total = 0.0
+        self._pending_cost = {}
+        self._pending_total = 0.0
+
+    def spent(self, user_id: Optional[str] = None) -> float:
+        """当日已花费用（元）：user_id为None时为全局"""
+        with self._lock:
+            if user_id is None:
+                return self._stored_total + self._pending_total
+            return self._stored_cost.get(user_id, 0.0) + self._pending_cost.get(user_id, 0.0)
+
+    def within_budget(self, user_id: Optional[str] = None) -> bool:
+        """当前用户（默认取请求绑定的用户）和全局的当日费用都未超出预算"""
+        user_id = user_id or current_user()
+        if self.global_daily_budget and self.spent() >= self.global_daily_budget:
+            return False
+        if self.user_daily_budget and self.spent(user_id) >= self.user_daily_budget:
+            return False
+        return True
+
+    def flush(self):
+        """把内存汇总累加到SQLite，并刷新当日已花费用（阻塞，在线程中调用）"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            with self._db_lock:
+                stored = self._write(pending)
+        except sqlite3.Error as e:
+            logger.error("写入用量记录失败: %s", e)
+            with self._lock:
+                for key, row in pending.items():  # 放回，下次再写（未写入部分的费用一直计在内存中）
+                    current = self._pending.setdefault(key, [0.0] * len(COUNTER_COLUMNS))
+                    for index, value in enumerate(row):
+                        current[index] += value
+            return
+        with self._lock:
+            # 已写入的费用从未写入部分移到库中已有部分
+            for (day, _, user_id, _), row in pending.items():
+                if day == self._day:
+                    self._pending_cost[user_id] = self._pending_cost.get(user_id, 0.0) - row[-1]
+                    self._pending_total -= row[-1]
+            self._stored_cost = stored
+            self._stored_total = sum(stored.values())
+
+    def _write(self, pending: Dict[Tuple[str, str, str, str], List[float]]) -> Dict[str, float]:
+        """累加写入汇总，返回库中各用户的当日费用"""
+        conn = self._connection()
+        if pending:
+            updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNTER_COLUMNS)
+            conn.executemany(
+                f"INSERT INTO usage (day, call_site, user_id, session_id, {', '.join(COUNTER_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (4 + len(COUNTER_COLUMNS)))}) "
+                f"ON CONFLICT (day, call_site, user_id, session_id) DO UPDATE SET {updates}",
+                [key + tuple(row) for key, row in pending.items()]
+            )
+            metrics.incr("usage.flushes")
+        return dict(conn.execute(
+            "SELECT user_id, SUM(cost) FROM usage WHERE day = ? GROUP BY user_id", (self._day,)
+        ).fetchall())
+
+    async def run_flusher(self):
+        """后台任务：每flush_interval秒写入一次（在应用生命周期内运行）"""
+        await asyncio.to_thread(self.flush)  # 启动时读取当日已花费用
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def report(self, day: Optional[str] = None, group_by: str = "call_site") -> List[Dict[str, Any]]:
+        """按调用场景/用户/会话汇总某一天的用量（先写入未写入的部分，阻塞）"""
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"不支持的分组: {group_by}")
+        self.flush()
+        with self._db_lock:
+            rows = self._connection().execute(
+                f"SELECT {group_by}, {', '.join(f'SUM({column})' for column in COUNTER_COLUMNS)} "
+                f"FROM usage WHERE day = ? GROUP BY {group_by} ORDER BY SUM(cost) DESC",
+                (day or date.today().isoformat(),)
+            ).fetchall()
+        report = []
+        for row in rows:
+            calls, prompt_tokens, hit_tokens, completion_tokens, latency_ms, cost = row[1:]
+            report.append({
+                group_by: row[0],
+                "calls": int(calls),
+                "prompt_tokens": int(prompt_tokens),
+                "cache_hit_tokens": int(hit_tokens),
+                "completion_tokens": int(completion_tokens),
+                "cache_hit_ratio": round(hit_tokens / prompt_tokens, 3) if prompt_tokens else None,
+                "avg_latency_ms": round(latency_ms / calls, 1) if calls else None,
+                "cost": round(cost, 6)
+            })
+        return report
+
+
+_usage_ledger: Optional[UsageLedger] = None
+
+
+def get_usage_ledger() -> UsageLedger:
+    """获取进程内唯一的用量账本"""
+    global _usage_ledger
+    if _usage_ledger is None:
+        _usage_ledger = UsageLedger()
+    return _usage_ledger
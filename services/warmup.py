@@ -0,0 +1,142 @@
+"""
+启动预热服务
+应用启动时并发拉取Token、当前模板和档案目录，写入共享缓存后再报告就绪
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupState:
+    """预热状态（供就绪探针读取）"""
+
+    def __init__(self):
+        self.status = "pending"  # pending, running, ready, degraded, disabled
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def is_ready(self) -> bool:
+        """预热结束（包括超时降级和未启用）即视为就绪"""
+        return self.status in ("ready", "degraded", "disabled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        duration = None
+        if self.started_at and self.finished_at:
+            duration = round((self.finished_at - self.started_at) * 1000)
+        return {
+            "status": self.status,
+            "duration_ms": duration,
+            "steps": self.steps
+        }
+
+
+class WarmupService:
+    """启动预热：所有步骤并发执行，受时间预算约束"""
+
+    def __init__(self, mcp_service, auth_service, timeout: float):
+        self.mcp_service = mcp_service
+        self.auth_service = auth_service
+        self.timeout = timeout
+        self.state = WarmupState()
+        self._late_tasks: Set[asyncio.Task] = set()  # 超时后仍在后台填充缓存的步骤
+
+    async def _run_step(self, name: str, coro: Awaitable[Any]):
+        """执行单个预热步骤并记录耗时和结果"""
+        started = time.perf_counter()
+        self.state.steps[name] = {"status": "running"}
+        try:
+            result = await coro
+            ok = result.get("success", False) if isinstance(result, dict) else bool(result)
+            self.state.steps[name] = {
+                "status": "ok" if ok else "error",
+                "duration_ms": round((time.perf_counter() - started) * 1000)
+            }
+            if not ok and isinstance(result, dict):
+                self.state.steps[name]["error"] = result.get("message")
+        except Exception as e:
+            logger.warning(f"预热步骤 {name} 失败: {e}")
+            self.state.steps[name] = {
+                "status": "error",
+                "duration_ms": round((time.perf_counter() - started) * 1000),
+                "error": str(e)
+            }
+
+    async def _warm_dimensions(self) -> Dict[str, Any]:
+        """预热模板中档案字段对应的档案类别和档案项"""
+        template_result, categories_result = await asyncio.gather(
+            self.mcp_service.get_template_fields(),
+            self.mcp_service.get_archive_categories()
+        )
+        if not template_result["success"]:
+            return template_result
+        if not categories_result["success"]:
+            return categories_result
+
+        archive_names = {
+            field.get("valueFrom", "").replace("basedata.Dimension.", "")
+            for field in template_result["data"]["fields"]
+            if field.get("valueFrom", "").startswith("basedata.Dimension.")
+        }
+        dimension_ids = [
+            category["id"] for category in categories_result["data"]["categories"]
+            if category["name"] in archive_names
+        ]
+        results = await asyncio.gather(*[self.mcp_service.get_archive_items(dimension_id) for dimension_id in dimension_ids])
+        failed = [result["message"] for result in results if not result["success"]]
+        return {
+            "success": not failed,
+            "message": "; ".join(failed) if failed else f"预热 {len(dimension_ids)} 个档案目录"
+        }
+
+    async def run(self) -> WarmupState:
+        """执行预热，超出时间预算时以降级状态就绪，未完成的步骤继续在后台填充缓存"""
+        self.state.status = "running"
+        self.state.started_at = time.time()
+        logger.info(f"🔥 开始启动预热（时间预算 {self.timeout} 秒）")
+
+        # 只预热创建申请单会用到的数据
+        steps = {
+            "token": self.mcp_service.auth_service.get_access_token(),
+            "template": self.mcp_service.get_template_fields(),
+            "dimensions": self._warm_dimensions(),
+        }
+        if self.auth_service is not self.mcp_service.auth_service:
+            steps["api_token"] = self.auth_service.get_access_token()
+        tasks = {asyncio.create_task(self._run_step(name, coro)): name for name, coro in steps.items()}
+
+        done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+        for name, step in self.state.steps.items():
+            if step["status"] == "running":
+                step["status"] = "timeout"
+        for task in pending:
+            self._late_tasks.add(task)
+            task.add_done_callback(lambda task, name=tasks[task]: self._finish_late_step(name, task))
+
+        all_ok = not pending and all(step["status"] == "ok" for step in self.state.steps.values())
+        self.state.status = "ready" if all_ok else "degraded"
+        self.state.finished_at = time.time()
+        logger.info(f"🔥 启动预热结束: {self.state.status} {self.state.steps}")
+        return self.state
+
+    def _finish_late_step(self, name: str, task: asyncio.Task):
+        """超时步骤在后台结束：记录结果（取走异常，避免未检索的异常警告）"""
+        self._late_tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.warning(f"预热步骤 {name} 在超时后失败: {error!r}")
+        else:
+            logger.info(f"🔥 预热步骤 {name} 在超时后完成: {self.state.steps.get(name)}")
+
+    async def aclose(self):
+        """应用关闭时取消仍在后台运行的超时步骤"""
+        late_tasks = list(self._late_tasks)
+        for task in late_tasks:
+            task.cancel()
+        await asyncio.gather(*late_tasks, return_exceptions=True)
@@ -4,21 +4,44 @@ AI智能申请单系统 - MCP核心层（清理版）
 处理模板获取、字段映射、申请单创建等核心业务逻辑
 """
 
+import asyncio
 import logging
 import json
 import time
 import re
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
-import httpx
+from typing import Callable, Dict, List, Any, Optional
 from services.auth_service import AuthService
 from services.deepseek_service import DeepSeekService
-from config import EK_BASE_URL
+from services.audit_log import get_audit_log, hash_text
+from services.extraction_cache import ExtractionCache
+from services.form_repair import FormRepairer, RepairResult
+from services.idempotency import IdempotencyGuard
+from services.json_codec import JSON_CONTENT_TYPE, dumps_bytes
+from services.json_stream import IncrementalObjectParser
+from services.logging_setup import log_payload
+from services.metrics import metrics
+from services.paginator import is_single_page, paginate
+from services.prompt_builder import ExtractionPromptBuilder
+from services.resilience import get_gateway
+from services.shared_cache import get_shared_cache
+from services.speculation import take_prefetched
+from services.template_schema import TemplateSchema
+from services.tool_registry import ToolRegistry, mcp_tool
+from config import (
+    EK_BASE_URL, EKUAIBAO_PAGE_SIZE, TEMPLATE_CACHE_TTL, DIMENSION_CACHE_TTL, LEARNED_CONSTRAINT_TTL,
+    EXTRACTION_STREAMING_ENABLED
+)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 看起来像创建申请单的消息（用于意图识别期间的投机预取，误判只会多做一次缓存预热）
+CREATION_HINT = re.compile(r"\d+(?:\.\d+)?\s*(?:元|块)|申请|报销|出差|培训|采购|购买|创建|提交")
+NON_CREATION_HINT = re.compile(r"字段|模板|结构|查询|查看|哪些|历史|可选|档案|[A-Z]\d{8}")
+TITLE_MAX_LENGTH = 14
+
 class SmartExpenseMCP:
     """智能申请单MCP核心控制器"""
     
@@ -26,7 +49,23 @@ class SmartExpenseMCP:
         self.auth_service = AuthService()
         self.deepseek_service = DeepSeekService()
         self.base_url = EK_BASE_URL
-        # 注意：不使用任何缓存，每次都实时拉取最新数据
+        self.gateway = get_gateway()
+        # 模板和档案数据通过跨worker共享缓存层读取（TTL为0时不使用缓存，每次都实时拉取最新数据）
+        self.cache = get_shared_cache()
+        # 条件请求重验证：上次解析的模板/档案结果，上游确认未变化时直接复用，跳过下载和解析
+        self._revalidated: Dict[str, Dict[str, Any]] = {}
+        # 编译后的模板字段模型（按包含版本的完整模板ID）
+        self._schemas: Dict[str, TemplateSchema] = {}
+        # 字段提取提示词（固定前缀按模板缓存）
+        self.prompt_builder = ExtractionPromptBuilder()
+        # 字段提取模式缓存（规则变化时旧骨架作废）
+        self.extraction_cache = ExtractionCache(fingerprint=hash_text(self.prompt_builder.rules))
+        # 提交前的字段校验与自动修复（模板配置不含长度约束，标题上限之外的约束从400错误中学习）
+        self.form_repairer = FormRepairer(base_rules={"title": {"max_length": TITLE_MAX_LENGTH}})
+        # 申请单创建幂等：重复提交返回已完成或进行中的创建结果
+        self.idempotency = IdempotencyGuard(self.cache)
+        # 申请单创建审计日志（后台线程写入）
+        self.audit_log = get_audit_log()
         
         # 不再使用硬编码的特殊字段列表，改为动态判断字段类型
     
@@ -43,64 +82,91 @@ class SmartExpenseMCP:
         }
         return type_mapping.get(api_type, "文本")
 
+    async def invalidate_cache(self, namespace: str) -> int:
+        """使指定命名空间（template/dimension）的共享缓存失效，并广播给所有worker"""
+        for key in [key for key in self._revalidated if key == namespace or key.startswith(f"{namespace}:")]:
+            del self._revalidated[key]
+        return await self.cache.invalidate(namespace)
+
+    @mcp_tool("查询易快报中的自定义档案类别列表（如项目、城市、部门等）")
     async def get_archive_categories(self) -> Dict[str, Any]:
-        """获取自定义档案类别列表"""
+        """获取自定义档案类别列表（共享缓存DIMENSION_CACHE_TTL秒）"""
+        return await self.cache.get_or_load(
+            "dimension", "categories",
+            self._fetch_archive_categories,
+            ttl=DIMENSION_CACHE_TTL,
+            cacheable=lambda result: result.get("success", False)
+        )
+
+    async def _fetch_archive_categories(self) -> Dict[str, Any]:
+        """从易快报拉取自定义档案类别列表"""
         try:
             logger.info("🗃️ 获取自定义档案类别...")
             
-            # 强制刷新token
-            await self.auth_service._refresh_token()
             access_token = await self.auth_service.get_access_token()
             
             url = f"https://app.ekuaibao.com/api/openapi/v1/dimensions"
-            params = {
-                "accessToken": access_token,
-                "start": 0,
-                "count": 100
-            }
-            
             headers = {
                 "content-type": "application/json",
                 "Accept": "application/json"
             }
+            changed_pages = []
             
-            logger.info(f"调用档案类别API: {url}")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, headers=headers)
+            async def fetch_page(start: int, count: int) -> Dict[str, Any]:
+                params = {"accessToken": access_token, "start": start, "count": count}
+                response, unchanged = await self.gateway.revalidating_get(
+                    "ekuaibao", "dimensions", url, params=params, headers=headers
+                )
                 response.raise_for_status()
+                if not unchanged:
+                    changed_pages.append(start)
+                return response.json()
+            
+            logger.debug("调用档案类别API: %s", url)
+            result = await fetch_page(0, EKUAIBAO_PAGE_SIZE)
+            log_payload(logger, "档案类别API响应", result)
+            
+            if result.get("success", True):  # 有些API返回没有success字段
+                # 只有一页且未变化（304）时直接复用上次结果；多页时后续页可能有变化，每页都要重新验证
+                previous = self._revalidated.get("dimension")
+                if not changed_pages and previous and is_single_page(result):
+                    logger.info("档案类别未变化（304），复用上次结果")
+                    return previous["result"]
                 
-                result = response.json()
-                logger.info(f"档案类别API响应: {result}")
+                # 逐页读取全部档案类别（每页都是条件请求）
+                dimensions = [dim async for dim in paginate(fetch_page, first_page=result, name="dimensions")]
+                if not changed_pages and previous:
+                    logger.info("档案类别各页均未变化（304），复用上次结果")
+                    return previous["result"]
                 
-                if result.get("success", True):  # 有些API返回没有success字段
-                    dimensions = result.get("items", [])
-                    
-                    # 格式化档案类别信息
-                    archive_categories = []
-                    for dim in dimensions:
-                        category_info = {
-                            "id": dim.get("id"),
-                            "name": dim.get("name"),
-                            "code": dim.get("code"),
-                            "enabled": dim.get("enabled", True)
-                        }
-                        archive_categories.append(category_info)
-                    
-                    logger.info(f"找到 {len(archive_categories)} 个档案类别")
-                    
-                    return {
-                        "success": True,
-                        "message": f"找到 {len(archive_categories)} 个档案类别",
-                        "data": {
-                            "categories": archive_categories
-                        }
+                # 格式化档案类别信息
+                archive_categories = []
+                for dim in dimensions:
+                    category_info = {
+                        "id": dim.get("id"),
+                        "name": dim.get("name"),
+                        "code": dim.get("code"),
+                        "enabled": dim.get("enabled", True)
                     }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"获取档案类别失败: {result.get('message', '未知错误')}"
+                    archive_categories.append(category_info)
+                
+                logger.info("找到 %d 个档案类别", len(archive_categories))
+                
+                categories_result = {
+                    "success": True,
+                    "message": f"找到 {len(archive_categories)} 个档案类别: " + "、".join(str(category["name"]) for category in archive_categories),
+                    "data": {
+                        "categories": archive_categories
                     }
-                    
+                }
+                self._revalidated["dimension"] = {"result": categories_result}
+                return categories_result
+            else:
+                return {
+                    "success": False,
+                    "message": f"获取档案类别失败: {result.get('message', '未知错误')}"
+                }
+                
         except Exception as e:
             logger.error(f"获取档案类别失败: {e}")
             return {
@@ -109,12 +175,19 @@ class SmartExpenseMCP:
             }
 
     async def get_archive_items(self, dimension_id: str) -> Dict[str, Any]:
-        """获取指定档案类别下的档案项"""
+        """获取指定档案类别下的档案项（共享缓存DIMENSION_CACHE_TTL秒）"""
+        return await self.cache.get_or_load(
+            "dimension", f"items:{dimension_id}",
+            lambda: self._fetch_archive_items(dimension_id),
+            ttl=DIMENSION_CACHE_TTL,
+            cacheable=lambda result: result.get("success", False)
+        )
+
+    async def _fetch_archive_items(self, dimension_id: str) -> Dict[str, Any]:
+        """从易快报拉取指定档案类别下的档案项"""
         try:
-            logger.info(f"🗃️ 获取档案类别 {dimension_id} 的档案项...")
+            logger.info("🗃️ 获取档案类别 %s 的档案项...", dimension_id)
             
-            # 强制刷新token
-            await self.auth_service._refresh_token()
             access_token = await self.auth_service.get_access_token()
             
             # 根据文档，获取档案项的API路径应该是 /v1/dimensions/{id}/items
@@ -124,7 +197,7 @@ class SmartExpenseMCP:
                 "accessToken": access_token,
                 "dimensionId": dimension_id,
                 "start": 0,
-                "count": 100
+                "count": EKUAIBAO_PAGE_SIZE
             }
             
             headers = {
@@ -132,56 +205,85 @@ class SmartExpenseMCP:
                 "Accept": "application/json"
             }
             
-            logger.info(f"调用档案项API: {url} (dimensionId={dimension_id})")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, headers=headers)
+            logger.debug("调用档案项API: %s (dimensionId=%s)", url, dimension_id)
+            response, unchanged = await self.gateway.revalidating_get(
+                "ekuaibao", "dimensions/items", url, params=params, headers=headers
+            )
+            
+            # 如果404，尝试其他API路径
+            if response.status_code == 404:
+                logger.warning(f"API路径1失败，尝试路径2...")
+                url = f"https://app.ekuaibao.com/api/openapi/v1/dimension/items"
+                response, unchanged = await self.gateway.revalidating_get(
+                    "ekuaibao", "dimensions/items", url, params=params, headers=headers
+                )
                 
-                # 如果404，尝试其他API路径
                 if response.status_code == 404:
-                    logger.warning(f"API路径1失败，尝试路径2...")
-                    url2 = f"https://app.ekuaibao.com/api/openapi/v1/dimension/items"
-                    response = await client.get(url2, params=params, headers=headers)
-                    
-                    if response.status_code == 404:
-                        logger.warning(f"API路径2失败，尝试路径3...")
-                        # 尝试使用不同的参数格式
-                        url3 = f"https://app.ekuaibao.com/api/openapi/v1/basedata/dimension/items"
-                        response = await client.get(url3, params=params, headers=headers)
+                    logger.warning(f"API路径2失败，尝试路径3...")
+                    # 尝试使用不同的参数格式
+                    url = f"https://app.ekuaibao.com/api/openapi/v1/basedata/dimension/items"
+                    response, unchanged = await self.gateway.revalidating_get(
+                        "ekuaibao", "dimensions/items", url, params=params, headers=headers
+                    )
+            
+            response.raise_for_status()
+            
+            result = response.json()
+            log_payload(logger, "档案项API响应", result)
+            
+            # 只有一页且未变化（304）时直接复用上次结果；多页时后续页可能有变化，每页都要重新验证
+            previous = self._revalidated.get(f"dimension:items:{dimension_id}")
+            if unchanged and previous and is_single_page(result):
+                logger.info("档案项未变化（304），复用上次结果")
+                return previous["result"]
+            
+            if result.get("success", True):
+                changed_pages = [] if unchanged else [0]
                 
-                response.raise_for_status()
+                # 后续页使用第一页成功的路径，同样是条件请求
+                async def fetch_page(start: int, count: int) -> Dict[str, Any]:
+                    page, page_unchanged = await self.gateway.revalidating_get(
+                        "ekuaibao", "dimensions/items", url,
+                        params=dict(params, start=start, count=count), headers=headers
+                    )
+                    page.raise_for_status()
+                    if not page_unchanged:
+                        changed_pages.append(start)
+                    return page.json()
                 
-                result = response.json()
-                logger.info(f"档案项API响应: {result}")
+                items = [item async for item in paginate(fetch_page, first_page=result, name="dimensions/items")]
+                if not changed_pages and previous:
+                    logger.info("档案项各页均未变化（304），复用上次结果")
+                    return previous["result"]
                 
-                if result.get("success", True):
-                    items = result.get("items", [])
-                    
-                    # 格式化档案项信息
-                    archive_items = []
-                    for item in items:
-                        item_info = {
-                            "id": item.get("id"),
-                            "name": item.get("name"),
-                            "code": item.get("code"),
-                            "enabled": item.get("enabled", True)
-                        }
-                        archive_items.append(item_info)
-                    
-                    logger.info(f"找到 {len(archive_items)} 个档案项")
-                    
-                    return {
-                        "success": True,
-                        "message": f"找到 {len(archive_items)} 个档案项",
-                        "data": {
-                            "items": archive_items
-                        }
+                # 格式化档案项信息
+                archive_items = []
+                for item in items:
+                    item_info = {
+                        "id": item.get("id"),
+                        "name": item.get("name"),
+                        "code": item.get("code"),
+                        "enabled": item.get("enabled", True)
                     }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"获取档案项失败: {result.get('message', '未知错误')}"
+                    archive_items.append(item_info)
+                
+                logger.info("找到 %d 个档案项", len(archive_items))
+                
+                items_result = {
+                    "success": True,
+                    "message": f"找到 {len(archive_items)} 个档案项",
+                    "data": {
+                        "items": archive_items
                     }
-                    
+                }
+                self._revalidated[f"dimension:items:{dimension_id}"] = {"result": items_result}
+                return items_result
+            else:
+                return {
+                    "success": False,
+                    "message": f"获取档案项失败: {result.get('message', '未知错误')}"
+                }
+                
         except Exception as e:
             logger.error(f"获取档案项失败: {e}")
             return {
@@ -189,6 +291,7 @@ class SmartExpenseMCP:
                 "message": f"❌ 获取档案项失败: {str(e)}"
             }
 
+    @mcp_tool("查询当前申请单模板中的档案字段及其可选项（如可选的项目、城市），用户询问某个字段能填什么时调用")
     async def get_available_archive_options(self) -> Dict[str, Any]:
         """获取当前模板中的档案字段及其可选项"""
         try:
@@ -199,20 +302,18 @@ class SmartExpenseMCP:
             if not template_result["success"]:
                 return template_result
             
-            fields_info = template_result["data"]["fields"]
+            schema = self._template_schema(template_result["data"])
             
             # 2. 找出档案字段
-            archive_fields = []
-            for field in fields_info:
-                value_from = field.get("valueFrom", "")
-                if value_from.startswith("basedata.Dimension."):
-                    archive_name = value_from.replace("basedata.Dimension.", "")
-                    archive_fields.append({
-                        "field_name": field["name"],
-                        "field_label": field["label"],
-                        "archive_name": archive_name,
-                        "required": field["required"]
-                    })
+            archive_fields = [
+                {
+                    "field_name": field.name,
+                    "field_label": field.label,
+                    "archive_name": field.archive_name,
+                    "required": field.required
+                }
+                for field in schema.archive_fields
+            ]
             
             if not archive_fields:
                 return {
@@ -316,17 +417,23 @@ class SmartExpenseMCP:
                 "message": f"❌ 获取档案字段选项失败: {str(e)}"
             }
     
+    @mcp_tool("获取AI申请单模板的详细信息，包括所有可填字段及其规则。当用户要创建申请单时必须先调用此工具。",
+              response_type="template_fields")
     async def get_template_fields(self, template_type: str = "requisition") -> Dict[str, Any]:
-        """获取申请单模板字段信息（每次都重新拉取最新模板）"""
+        """获取申请单模板字段信息（共享缓存TEMPLATE_CACHE_TTL秒，TTL为0时每次都重新拉取最新模板）"""
+        return await self.cache.get_or_load(
+            "template", template_type,
+            lambda: self._fetch_template_fields(template_type),
+            ttl=TEMPLATE_CACHE_TTL,
+            cacheable=lambda result: result.get("success", False)
+        )
+
+    async def _fetch_template_fields(self, template_type: str = "requisition") -> Dict[str, Any]:
+        """从易快报拉取最新的申请单模板字段信息"""
         try:
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            logger.info(f"🚨 [{current_time}] 开始获取申请单模板字段 - 强制实时拉取最新版本（不使用任何缓存）")
+            logger.info("🚨 开始从易快报拉取最新版本的申请单模板字段")
             
             # 1. 获取所有申请单模板列表（使用最新版本API）
-            logger.info("🔄 强制刷新TOKEN以获取最新模板数据")
-            # 强制刷新TOKEN，确保获取最新数据
-            await self.auth_service._refresh_token()
-            
             templates_url = f"{self.base_url}/v1/specifications/latestByType"
             params = {
                 "accessToken": await self.auth_service.get_access_token(),
@@ -334,132 +441,103 @@ class SmartExpenseMCP:
                 "specificationGroupId": ""  # 空字符串表示所有分组
             }
             
-            logger.info(f"调用模板列表API: {templates_url}")
+            logger.debug("调用模板列表API: %s", templates_url)
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(templates_url, params=params)
-                response.raise_for_status()
-                
-                templates_result = response.json()
-                templates_count = len(templates_result.get('items', []))
-                logger.info(f"📋 获取到模板列表: {templates_count} 个模板")
-                
-                # 打印所有模板的名称和ID，便于调试
+            response, list_unchanged = await self.gateway.revalidating_get("ekuaibao", "latestByType", templates_url, params=params)
+            response.raise_for_status()
+            
+            previous = self._revalidated.get("template")
+            if list_unchanged and previous:
+                logger.info("📋 模板列表未变化（304），复用上次解析的模板字段")
+                return previous["result"]
+            
+            templates_result = response.json()
+            templates_count = len(templates_result.get('items', []))
+            logger.info("📋 获取到模板列表: %d 个模板", templates_count)
+            
+            # 打印所有模板的名称和ID，便于调试
+            if logger.isEnabledFor(logging.DEBUG):
                 for i, template in enumerate(templates_result.get('items', [])):
-                    logger.info(f"   模板{i+1}: {template.get('name')} (ID: {template.get('id')}, 激活: {template.get('active')})")
-                
-                # 2. 查找激活的申请单模板（优先选择"AI申请单"）
-                templates = templates_result.get("items", [])
-                target_template = None
-                
-                # 优先查找"AI申请单"
+                    logger.debug("   模板%d: %s (ID: %s, 激活: %s)", i + 1, template.get('name'), template.get('id'), template.get('active'))
+            
+            # 2. 查找激活的申请单模板（优先选择"AI申请单"）
+            templates = templates_result.get("items", [])
+            target_template = None
+            
+            # 优先查找"AI申请单"
+            for template in templates:
+                if template.get("active") and template.get("name") == "AI申请单":
+                    target_template = template
+                    logger.info("找到AI申请单模板: %s - ID: %s", template.get('name'), template.get('id'))
+                    break
+            
+            # 如果没有找到AI申请单，选择第一个激活的模板
+            if not target_template:
                 for template in templates:
-                    if template.get("active") and template.get("name") == "AI申请单":
+                    if template.get("active"):
                         target_template = template
-                        logger.info(f"找到AI申请单模板: {template.get('name')} - ID: {template.get('id')}")
+                        logger.info("找到申请单模板: %s - ID: %s", template.get('name'), template.get('id'))
                         break
-                
-                # 如果没有找到AI申请单，选择第一个激活的模板
-                if not target_template:
-                    for template in templates:
-                        if template.get("active"):
-                            target_template = template
-                            logger.info(f"找到申请单模板: {template.get('name')} - ID: {template.get('id')}")
-                            break
-                
-                if not target_template:
-                    return {
-                        "success": False,
-                        "message": "❌ 未找到申请单模板"
-                    }
-                
-                # 3. 获取模板详细字段信息（包含可编辑字段）
-                template_id = target_template["id"]
-                logger.info("🔄 再次强制刷新TOKEN以获取模板详情")
-                await self.auth_service._refresh_token()
-                
-                detail_url = f"{self.base_url}/v2/specifications/byIds/editable/[{template_id}]"
-                detail_params = {
-                    "accessToken": await self.auth_service.get_access_token()
+            
+            if not target_template:
+                return {
+                    "success": False,
+                    "message": "❌ 未找到申请单模板"
                 }
-                
-                logger.info(f"调用模板详情API: {detail_url}")
-                
-                detail_response = await client.get(detail_url, params=detail_params)
-                detail_response.raise_for_status()
-                
-                detail_result = detail_response.json()
-                template_detail = detail_result.get("items", [{}])[0]
-                # 更新为包含版本的完整模板ID
-                full_template_id = template_detail.get("id", template_id)
-                
-                # 4. 解析字段信息
-                fields_info = []
-                form_fields = template_detail.get("form", [])
-                
-                # 从模板详情中解析字段（form现在是字典数组）
-                available_fields = []
-                for field_item in form_fields:
-                    logger.info(f"处理字段项: {field_item}, 类型: {type(field_item)}")
-                    if isinstance(field_item, dict):
-                        # 提取字段名（字典的key）
-                        for field_name, field_config in field_item.items():
-                            available_fields.append(field_name)
-                            logger.info(f"解析到字段: {field_name}, 配置: {field_config}")
-                
-                logger.info(f"📊 可用字段列表: {available_fields}")
-                logger.info(f"📊 字段总数: {len(available_fields)}")
-                
+            
+            # 3. 获取模板详细字段信息（包含可编辑字段）
+            template_id = target_template["id"]
+            
+            # 列表中的版本标识与上次一致时，模板未变化，跳过详情下载和解析
+            template_version = self._template_version(target_template)
+            if previous and template_version and previous["template_id"] == template_id and previous["version"] == template_version:
+                logger.info("📋 模板版本未变化（%s），复用上次解析的模板字段", template_version)
+                return previous["result"]
+            
+            detail_url = f"{self.base_url}/v2/specifications/byIds/editable/[{template_id}]"
+            detail_params = {
+                "accessToken": await self.auth_service.get_access_token()
+            }
+            
+            logger.debug("调用模板详情API: %s", detail_url)
+            
+            detail_response, detail_unchanged = await self.gateway.revalidating_get("ekuaibao", "byIds/editable", detail_url, params=detail_params)
+            detail_response.raise_for_status()
+            
+            if detail_unchanged and previous and previous["template_id"] == template_id:
+                logger.info("📋 模板详情未变化（304），复用上次解析的模板字段")
+                previous["version"] = template_version
+                return previous["result"]
+            
+            detail_result = detail_response.json()
+            template_detail = detail_result.get("items", [{}])[0]
+            # 更新为包含版本的完整模板ID
+            full_template_id = template_detail.get("id", template_id)
+            
+            # 4. 编译字段模型（form是字典数组，每项为 {字段名: 字段配置}），每个模板版本只解析一次
+            schema = TemplateSchema.compile(
+                full_template_id, target_template.get('name'), template_detail.get("form", []),
+                self._translate_field_type, self._field_converters(), self._field_validators()
+            )
+            self._remember_schema(schema)
+            fields_info = schema.fields_info
+            available_fields = list(schema.by_name)
+            
+            logger.info("📊 模板 %s 字段总数: %d", full_template_id, len(available_fields))
+            if logger.isEnabledFor(logging.DEBUG):
                 # 记录模板的完整信息用于变化检测
                 template_signature = f"{target_template.get('name')}:{len(available_fields)}:{sorted(available_fields)}"
-                template_hash = hash(template_signature)
-                logger.info(f"🔍 模板签名: {template_signature}")
-                logger.info(f"🔍 模板哈希值: {template_hash} (用于检测模板变化)")
-                
-                # 动态构建字段信息（基于API返回的实际字段配置）
-                fields_info = []
-                
-                # 遍历所有从API获取的字段，动态构建字段信息
-                for field_name in available_fields:
-                    # 从API响应中查找对应字段的详细配置
-                    field_config = None
-                    for form_field in form_fields:
-                        if isinstance(form_field, dict) and field_name in form_field:
-                            field_config = form_field[field_name]
-                            break
-                    
-                    if field_config:
-                        # 根据API返回的配置动态生成字段信息
-                        field_info = {
-                            "name": field_name,
-                            "label": field_config.get("label", field_name),
-                            "type": self._translate_field_type(field_config.get("type", "text")),
-                            "required": not field_config.get("optional", False),
-                            "valueFrom": field_config.get("valueFrom", "")  # 保留valueFrom信息
-                        }
-                        fields_info.append(field_info)
-                        logger.info(f"动态添加字段: {field_name} -> {field_info}")
-                    else:
-                        # 如果找不到配置，使用默认值
-                        field_info = {
-                            "name": field_name,
-                            "label": field_name,
-                            "type": "文本",
-                            "required": True
-                        }
-                        fields_info.append(field_info)
-                        logger.warning(f"使用默认配置的字段: {field_name}")
-                
-                logger.info(f"解析出 {len(fields_info)} 个字段")
-                
-                # 5. 格式化返回信息
-                fields_display = "\n".join([
-                    f"• **{field['label']}** - {field['type']}" + 
-                    (" [必填]" if field['required'] else " [可选]")
-                    for field in fields_info
-                ])
-                
-                response_message = f"""
+                logger.debug("📊 可用字段列表: %s", available_fields)
+                logger.debug("🔍 模板签名: %s, 哈希值: %s (用于检测模板变化)", template_signature, hash(template_signature))
+            
+            # 5. 格式化返回信息
+            fields_display = "\n".join([
+                f"• **{field['label']}** - {field['type']}" + 
+                (" [必填]" if field['required'] else " [可选]")
+                for field in fields_info
+            ])
+            
+            response_message = f"""
 📋 **申请单模板字段信息**
 
 **模板名称**: {target_template.get('name')}
@@ -470,17 +548,23 @@ class SmartExpenseMCP:
 
 ✅ 请提供以上字段的信息来创建申请单
 """
-                
-                return {
-                    "success": True,
-                    "message": response_message,
-                    "data": {
-                        "template_id": full_template_id,  # 使用包含版本的完整模板ID
-                        "template_name": target_template.get('name'),
-                        "fields": fields_info
-                    }
+            
+            template_fields_result = {
+                "success": True,
+                "message": response_message,
+                "data": {
+                    "template_id": full_template_id,  # 使用包含版本的完整模板ID
+                    "template_name": target_template.get('name'),
+                    "fields": fields_info
                 }
-                
+            }
+            self._revalidated["template"] = {
+                "template_id": template_id,
+                "version": template_version,
+                "result": template_fields_result
+            }
+            return template_fields_result
+            
         except Exception as e:
             logger.error(f"获取模板字段失败: {e}")
             return {
@@ -488,6 +572,43 @@ class SmartExpenseMCP:
                 "message": f"❌ 获取模板字段失败: {str(e)}"
             }
     
+    def _field_converters(self) -> Dict[str, Any]:
+        """按字段类型的值转换函数（档案字段需要查询档案项，在构建请求体时单独处理）"""
+        return {"日期": self._process_date_field}
+    
+    def _field_validators(self) -> Dict[str, Any]:
+        """按字段名的校验函数"""
+        return {
+            "title": lambda value: f"标题长度超过{TITLE_MAX_LENGTH}个字符" if len(str(value)) > TITLE_MAX_LENGTH else None
+        }
+    
+    def _remember_schema(self, schema: TemplateSchema):
+        if len(self._schemas) >= 8:
+            self._schemas.clear()
+        self._schemas[schema.template_id] = schema
+    
+    def _template_schema(self, template_data: Dict[str, Any]) -> TemplateSchema:
+        """获取模板数据对应的字段模型（共享缓存命中时按字段列表重建一次）"""
+        schema = self._schemas.get(template_data["template_id"])
+        if schema is None:
+            schema = TemplateSchema.from_fields_info(
+                template_data["template_id"], template_data.get("template_name"), template_data["fields"],
+                self._field_converters(), self._field_validators()
+            )
+            self._remember_schema(schema)
+        return schema
+    
+    def _template_version(self, template: Dict[str, Any]) -> Optional[str]:
+        """
+        模板列表项中的版本标识：version/updateTime字段，或带版本后缀的完整模板ID（如 ID01spec:ai:3f9a2c）
+        无法判断版本时返回None（此时总是拉取详情）
+        """
+        for key in ("version", "updateTime"):
+            if template.get(key):
+                return str(template[key])
+        template_id = template.get("id", "")
+        return template_id if template_id.count(":") >= 2 else None
+    
     def _get_field_type(self, field_config: Dict[str, Any]) -> str:
         """根据字段配置推断字段类型"""
         field_type = field_config.get("type", "text")
@@ -507,75 +628,131 @@ class SmartExpenseMCP:
         
         return type_mapping.get(field_type, "文本")
     
+    @mcp_tool(
+        "创建申请单，根据用户输入的信息智能创建申请单",
+        parameters={"user_input": {"type": "string", "description": "用户输入的申请单信息，包含标题、金额、项目等"}},
+        required=["user_input"]
+    )
     async def create_smart_expense(self, user_input: str, template_type: str = "requisition") -> Dict[str, Any]:
-        """创建智能申请单"""
+        """创建智能申请单（请求绑定了幂等键时，重复提交不会再次创建）"""
+        return await self.idempotency.run(lambda: self._create_smart_expense(user_input, template_type))
+    
+    async def _create_smart_expense(self, user_input: str, template_type: str) -> Dict[str, Any]:
+        archive_tasks: List[asyncio.Future] = []  # 流式提取期间启动的档案解析任务
         try:
-            logger.info(f"开始创建申请单，用户输入: {user_input}")
+            logger.info("开始创建申请单，用户输入: %s", user_input)
             
-            # 1. 每次都重新获取最新的模板信息（不使用缓存）
-            logger.info("重新拉取最新的申请单模板信息")
-            template_result = await self.get_template_fields(template_type)
+            # 1. 获取最新的模板信息（共享缓存，TTL内的模板变化由400错误触发失效；
+            #    意图识别期间已投机预取时直接使用预取结果）
+            logger.debug("获取申请单模板信息")
+            with metrics.timer("create.template") as template_timer:
+                prefetched = await take_prefetched()
+                if prefetched and prefetched["template_type"] == template_type:
+                    template_result = prefetched["template"]
+                    archive_options = prefetched["archive_options"]
+                else:
+                    template_result = await self.get_template_fields(template_type)
+                    archive_options = None
             if not template_result["success"]:
                 return template_result
             
             template_data = template_result["data"]
             template_id = template_data["template_id"]
-            fields_info = template_data["fields"]
+            schema = self._template_schema(template_data)
+            if archive_options is None:
+                archive_options = await self._archive_options(schema)
+            vocabulary = [name for names in archive_options.values() for name in names]
             
-            logger.info(f"使用模板ID: {template_id}")
+            logger.debug("使用模板ID: %s", template_id)
             
-            # 2. 使用AI解析用户输入，提取字段信息
-            field_mapping = await self._ai_extract_fields(user_input, fields_info)
+            # 2. 使用AI解析用户输入，提取字段信息（流式输出中档案字段一完整就开始解析档案项ID）
+            pending_archives: Dict[str, tuple] = {}
+            
+            def start_archive_resolution(name: str, value: Any):
+                field = schema.get(name)
+                if field is not None and field.is_archive:
+                    task = asyncio.ensure_future(self._process_archive_field(value, field.value_from, name))
+                    archive_tasks.append(task)
+                    pending_archives[name] = (value, task)
+            
+            with metrics.timer("create.extract") as extract_timer:
+                field_mapping = await self._ai_extract_fields(user_input, schema, vocabulary,
+                                                              on_field=start_archive_resolution)
             
             # 2.5. 添加固定的提交人ID
             field_mapping["submitterId"] = "ID01IBfgTxKWAL:S6g73MppKM3A00"
             
-            # 3. 验证必填字段
-            validation_result = self._validate_required_fields(field_mapping, fields_info)
-            if not validation_result[0]:
+            # 2.6. 提交前本地校验并自动修复字段（无法确定性修复的字段只让AI重新提取这几个字段）
+            with metrics.timer("create.repair") as repair_timer:
+                repair = await self._repair_fields(user_input, schema, field_mapping, archive_options)
+            field_mapping = repair.mapping
+            if repair.violations:
                 return {
                     "success": False,
-                    "message": f"❌ {validation_result[1]}"
+                    "message": f"❌ {repair.violations[0].message}"
                 }
             
-            # 4. 构建API请求体
-            request_body = await self._build_request_body(field_mapping, template_id, fields_info)
-            
-            # 5. 调用创建API
-            create_url = f"{self.base_url}/v2.2/flow/data"
-            params = {
-                "accessToken": await self.auth_service.get_access_token()
-            }
-            
-            logger.info(f"调用创建申请单API: {create_url}")
-            logger.info(f"请求体: {json.dumps(request_body, ensure_ascii=False, indent=2)}")
-            logger.info(f"字段映射: {json.dumps(field_mapping, ensure_ascii=False, indent=2)}")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(create_url, params=params, json=request_body)
-                
-                # 如果是400错误，记录详细的错误信息
-                if response.status_code == 400:
-                    error_detail = response.text
-                    logger.error(f"400错误详情: {error_detail}")
+            # 3. 构建API请求体（同时验证必填字段和字段值），只序列化一次
+            with metrics.timer("create.build_body") as build_timer:
+                request_body, validation_error = await self._build_request_body(
+                    field_mapping, template_id, schema, pending_archives
+                )
+                if validation_error:
                     return {
                         "success": False,
-                        "message": f"❌ 创建申请单失败 (400错误): {error_detail}"
+                        "message": f"❌ {validation_error}"
                     }
+                payload = dumps_bytes(request_body)
+            
+            # 4. 调用创建API
+            with metrics.timer("create.submit") as submit_timer:
+                response = await self._submit_flow(payload)
                 
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.info(f"创建申请单成功: {result}")
-                
-                # 6. 解析返回结果
-                flow_data = result.get("flow", {})
-                form_data = flow_data.get("form", {})
-                
-                document_code = form_data.get("code", "未知")
-                document_title = form_data.get("title", "未知")
-                
-                success_message = f"""
+                # 400错误中能解析出字段约束时：记住约束（同一模板版本的后续请求提前修复），按新约束修复后重新提交一次
+                if response.status_code == 400:
+                    error_detail = response.text
+                    logger.error("400错误详情: %s", error_detail)
+                    retry = await self._repair_after_rejection(schema, field_mapping, archive_options, error_detail)
+                    if retry is not None:
+                        logger.info("🔧 按400错误中的约束修复后重新提交: %s", "; ".join(retry.fixes))
+                        metrics.incr("form.resubmitted")
+                        repair.fixes.extend(retry.fixes)
+                        field_mapping = retry.mapping
+                        request_body, validation_error = await self._build_request_body(
+                            field_mapping, template_id, schema, pending_archives
+                        )
+                        if not validation_error:
+                            response = await self._submit_flow(dumps_bytes(request_body))
+            timers = (template_timer, extract_timer, repair_timer, build_timer, submit_timer)
+            
+            # 如果是400错误，记录详细的错误信息
+            if response.status_code == 400:
+                error_detail = response.text
+                # 模板可能已变更，使模板缓存失效，下次重新拉取
+                await self.invalidate_cache("template")
+                self._audit_creation(user_input, template_id, field_mapping, False, timers,
+                                     fixes=repair.fixes, error=error_detail[:500])
+                return {
+                    "success": False,
+                    "message": f"❌ 创建申请单失败 (400错误): {error_detail}"
+                }
+            
+            response.raise_for_status()
+            
+            result = response.json()
+            log_payload(logger, "创建申请单响应", result)
+            
+            # 6. 解析返回结果
+            flow_data = result.get("flow", {})
+            form_data = flow_data.get("form", {})
+            
+            document_code = form_data.get("code", "未知")
+            document_title = form_data.get("title", "未知")
+            logger.info("创建申请单成功: %s", document_code)
+            self._audit_creation(user_input, template_id, field_mapping, True, timers, fixes=repair.fixes,
+                                 document_code=document_code, flow_id=flow_data.get("id"))
+            
+            success_message = f"""
 🎉 **申请单创建成功！**
 
 **单据编号**: {document_code}
@@ -586,92 +763,232 @@ class SmartExpenseMCP:
 
 ✅ 申请单已成功创建，您可以登录易快报系统查看详情
 """
-                
-                return {
-                    "success": True,
-                    "message": success_message,
-                    "data": {
-                        "document_code": document_code,
-                        "document_title": document_title,
-                        "flow_id": flow_data.get("id"),
-                        "form_data": form_data
-                    }
+            
+            return {
+                "success": True,
+                "message": success_message,
+                "data": {
+                    "document_code": document_code,
+                    "document_title": document_title,
+                    "flow_id": flow_data.get("id"),
+                    "form_data": form_data
                 }
-                
+            }
+            
         except Exception as e:
             logger.error(f"创建申请单失败: {e}")
             return {
                 "success": False,
                 "message": f"❌ 创建申请单失败: {str(e)}"
             }
+        finally:
+            # 提前返回（提取降级、校验未通过、熔断）时档案解析任务可能没有被等待：取消并回收。
+            # 档案查询经共享缓存和出站网关合并，取消只让本请求退出等待，其他请求合并到的回源照常完成
+            for task in archive_tasks:
+                task.cancel()
+            if archive_tasks:
+                await asyncio.gather(*archive_tasks, return_exceptions=True)
+    
+
+    async def _submit_flow(self, payload: bytes):
+        """调用创建申请单API（请求体已序列化）"""
+        create_url = f"{self.base_url}/v2.2/flow/data"
+        params = {
+            "accessToken": await self.auth_service.get_access_token()
+        }
+        
+        logger.info("调用创建申请单API: %s (%d 字节)", create_url, len(payload))
+        log_payload(logger, "请求体", payload)
+        return await self.gateway.request(
+            "ekuaibao", "flow/data", "POST", create_url,
+            params=params, content=payload, headers={"content-type": JSON_CONTENT_TYPE}
+        )
     
+    async def _repair_fields(self, user_input: str, schema: TemplateSchema, field_mapping: Dict[str, Any],
+                             archive_options: Dict[str, List[str]]) -> RepairResult:
+        """
+        提交前校验并修复字段映射
 
-    async def _ai_extract_fields(self, user_input: str, fields_info: List[Dict]) -> Dict[str, Any]:
-        """使用AI从用户输入中提取字段信息"""
+        先确定性修复（截断、规整金额、补默认日期、档案名称归一）；仍有问题的字段只让AI重新提取这几个字段，
+        再做一次最终修复，剩余问题由调用方返回给用户。
+        """
+        learned = await self._learned_constraints(schema.template_id)
+        result = self.form_repairer.repair(schema, field_mapping, archive_options, learned)
+        fixes = result.fixes
+        if result.violations:
+            logger.info("字段校验未通过: %s", "; ".join(v.message for v in result.violations))
+            mapping = result.mapping
+            if self.deepseek_service.is_available() and self.deepseek_service.usage.within_budget():
+                corrected = await self._reextract_fields(user_input, schema, result.violations)
+                mapping = dict(mapping, **corrected)
+                fixes = fixes + [f"{schema.by_name[name].label}: AI重新提取" for name in corrected]
+            result = self.form_repairer.repair(schema, mapping, archive_options, learned, final=True)
+            fixes = fixes + result.fixes
+        if fixes:
+            metrics.incr("form.repaired")
+            logger.info("🔧 自动修复字段: %s", "; ".join(fixes))
+        return RepairResult(result.mapping, fixes, result.violations)
+    
+    async def _reextract_fields(self, user_input: str, schema: TemplateSchema, violations: list) -> Dict[str, Any]:
+        """只让AI重新提取校验失败的字段，返回其中AI给出的新值"""
+        metrics.incr("form.reextracted")
+        wanted = {violation.field for violation in violations}
         try:
-            # 构建AI提示词
-            fields_desc = "\n".join([
-                f"- {field['name']}: {field['label']} ({field['type']})" + 
-                (" [必填]" if field['required'] else "")
-                for field in fields_info
+            messages = self.prompt_builder.build_repair(schema, user_input, [
+                (violation.field, violation.label, violation.reason, violation.options) for violation in violations
             ])
-            
-            ai_prompt = f"""
-你是一个智能申请单助手。用户想要创建申请单，你需要从他们的自然语言输入中提取字段信息。
-
-用户输入: {user_input}
-
-可用字段列表:
-{fields_desc}
-
-请你发挥强大的自然语言理解能力：
-1. 理解用户的真实意图（创建、提交、写一个申请单等都是同一个意思）
-2. 智能匹配用户描述的内容到对应字段
-3. 用户可能用各种表达方式，你要灵活理解
-4. 即使用户没有明确提到某个字段，也要生成合理的默认值
-
-字段格式要求：
-- 金额类型: {{"standard": "数字.00", "standardUnit": "元", "standardScale": 2, "standardSymbol": "¥", "standardNumCode": "156", "standardStrCode": "CNY"}}
-- 日期类型: 时间戳毫秒数，智能理解各种日期表达：
-  * "今天" → {int(time.time() * 1000)}
-  * "明天" → {int((time.time() + 86400) * 1000)}
-  * "下周一" → 计算对应的时间戳
-  * "2024-01-15" → 转换为时间戳
-  * "1月15日" → 转换为2024年对应日期的时间戳
-  * "下个月5号" → 计算下个月5号的时间戳
-  * 如果没有明确日期，默认使用当前时间
-- 其他类型: 直接使用合适的值
+            result = await self.deepseek_service.chat(messages, call_site="repair")
+            if not result.get("choices"):
+                return {}
+            parser = IncrementalObjectParser()
+            parser.feed(result["choices"][0]["message"].get("content") or "")
+            return {name: value for name, value in (parser.close() or {}).items() if name in wanted}
+        except Exception as e:
+            logger.warning("AI重新提取字段失败: %s", e)
+            return {}
+    
+    async def _learned_constraints(self, template_id: str) -> Dict[str, Dict[str, Any]]:
+        """从400错误中学到的字段约束（按包含版本的完整模板ID，模板变化后自然作废）"""
+        return await self.cache.get("constraints", template_id) or {}
+    
+    async def _repair_after_rejection(self, schema: TemplateSchema, field_mapping: Dict[str, Any],
+                                      archive_options: Dict[str, List[str]], error_detail: str) -> Optional[RepairResult]:
+        """
+        从400错误中学习字段约束并保存，按新约束修复字段映射
 
-日期智能理解示例：
-- 用户说"明天开始"、"下周申请"、"月底截止" → 计算对应的具体时间戳
-- 用户说"2024年1月15日"、"1/15"、"01-15" → 转换为标准时间戳
-- 相对时间："3天后"、"下周二"、"下个月" → 基于当前时间计算
+        学不到新约束、修复后仍有问题或映射没有变化时返回None（不值得重新提交）。
+        """
+        learned = self.form_repairer.learn(schema, error_detail)
+        if not learned:
+            return None
+        constraints = await self._learned_constraints(schema.template_id)
+        for name, rules in learned.items():
+            constraints.setdefault(name, {}).update(rules)
+        await self.cache.set("constraints", schema.template_id, constraints, ttl=LEARNED_CONSTRAINT_TTL)
+        metrics.incr("form.constraints_learned")
+        logger.info("📐 从400错误中学到字段约束: %s", constraints)
+        
+        result = self.form_repairer.repair(schema, field_mapping, archive_options, constraints, final=True)
+        if result.violations or result.mapping == field_mapping:
+            return None
+        return result
+    
+    def _audit_creation(self, user_input: str, template_id: str, field_mapping: Dict[str, Any], success: bool,
+                        timers: tuple, **fields: Any):
+        """记录一次申请单创建的审计信息（用户输入只记录哈希）"""
+        self.audit_log.record(
+            "requisition_created" if success else "requisition_rejected",
+            input_hash=hash_text(user_input),
+            input_chars=len(user_input),
+            template_id=template_id,
+            mapping=field_mapping,
+            timings_ms={
+                stage: round(timer.seconds * 1000, 1)
+                for stage, timer in zip(("template", "extract", "repair", "build_body", "submit"), timers)
+                if timer is not None
+            },
+            **fields
+        )
+    
+    async def _ai_extract_fields(self, user_input: str, schema: TemplateSchema,
+                                 vocabulary: Optional[List[str]] = None,
+                                 on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """
+        使用AI从用户输入中提取字段信息
 
-请直接返回JSON格式的完整字段映射，包含所有字段：
-"""
+        先查字段提取模式缓存（金额/日期/档案项替换为占位符后的相同输入模式直接本地回填），
+        未命中再调用AI并写入缓存；DeepSeek熔断或用量超出预算时直接使用本地提取。
+        vocabulary为已预取的档案项名称，未提供时从共享缓存读取。
+        流式提取时每个字段的键值一完整就调用on_field(字段名, 值)，调用方可据此提前开始后续处理。
+        """
+        pattern = None
+        if self.extraction_cache.enabled:
+            if vocabulary is None:
+                vocabulary = await self._archive_vocabulary(schema)
+            cached, pattern = self.extraction_cache.lookup(schema.template_id, user_input, vocabulary)
+            if cached is not None:
+                logger.debug("字段提取模式缓存命中: %s", pattern.text)
+                return cached
+        
+        if not self.deepseek_service.is_available():
+            logger.warning("DeepSeek熔断中，跳过AI提取，直接使用备用字段提取")
+            return self._fallback_field_extraction(user_input)
+        if not self.deepseek_service.usage.within_budget():
+            logger.warning("💰 DeepSeek用量超出预算，跳过AI提取，直接使用备用字段提取")
+            metrics.incr("usage.budget_degraded")
+            return self._fallback_field_extraction(user_input)
+        
+        try:
+            # 构建AI提示词（规则和字段目录在前、当前时间和用户输入在后，前缀可命中上下文缓存）
+            messages = self.prompt_builder.build(schema, user_input)
             
-            # 调用DeepSeek API
-            response = await self.deepseek_service.simple_chat(ai_prompt)
+            # 调用DeepSeek API，增量解析输出中的第一个JSON对象（忽略前后的说明文字）
+            parser = IncrementalObjectParser()
+            if EXTRACTION_STREAMING_ENABLED:
+                async for chunk in self.deepseek_service.chat_stream(messages, call_site="extract"):
+                    for name, value in parser.feed(chunk):
+                        if on_field is not None:
+                            on_field(name, value)
+            else:
+                result = await self.deepseek_service.chat(messages, call_site="extract")
+                if not result.get("choices"):
+                    raise ValueError("AI服务未返回结果")
+                parser.feed(result["choices"][0]["message"].get("content") or "")
+            
+            field_mapping = parser.close()
+            if field_mapping is None:
+                raise ValueError("AI响应不包含有效JSON")
+            log_payload(logger, "AI提取的字段映射", field_mapping)
             
-            # 解析JSON响应
-            try:
-                field_mapping = json.loads(response)
-                logger.info(f"AI提取的字段映射: {field_mapping}")
-                return field_mapping
-            except json.JSONDecodeError:
-                # 如果AI返回的不是纯JSON，尝试提取JSON部分
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    field_mapping = json.loads(json_match.group())
-                    logger.info(f"从AI响应中提取的字段映射: {field_mapping}")
-                    return field_mapping
-                else:
-                    raise ValueError("AI响应不包含有效JSON")
-                    
         except Exception as e:
             logger.error(f"AI字段提取失败: {e}")
             # 返回基础的字段映射
             return self._fallback_field_extraction(user_input)
+        
+        if pattern is not None and isinstance(field_mapping, dict):
+            await self.extraction_cache.store(schema.template_id, pattern, user_input, field_mapping)
+        return field_mapping
+    
+    @staticmethod
+    def looks_like_creation(message: str) -> bool:
+        """粗略判断消息是否是创建申请单"""
+        return bool(CREATION_HINT.search(message)) and not NON_CREATION_HINT.search(message)
+    
+    async def prefetch_for_creation(self, template_type: str = "requisition") -> Dict[str, Any]:
+        """
+        投机预取创建申请单所需的Token、模板和档案项
+
+        结果进入共享缓存，同一请求随后的create_smart_expense通过take_prefetched直接取用
+        （缓存TTL为0、每次实时拉取时也不会重复请求）。
+        """
+        with metrics.timer("speculation.prefetch"):
+            template_result, _ = await asyncio.gather(
+                self.get_template_fields(template_type),
+                self.auth_service.get_access_token()
+            )
+            archive_options = None
+            if template_result["success"]:
+                archive_options = await self._archive_options(self._template_schema(template_result["data"]))
+        return {"template_type": template_type, "template": template_result, "archive_options": archive_options}
+    
+    async def _archive_options(self, schema: TemplateSchema) -> Dict[str, List[str]]:
+        """模板各档案字段的可选档案项名称（均来自共享缓存），用于规范化用户输入和校验档案字段"""
+        if not schema.archive_fields:
+            return {}
+        categories_result = await self.get_archive_categories()
+        if not categories_result["success"]:
+            return {}
+        category_ids = {category["name"]: category["id"] for category in categories_result["data"]["categories"]}
+        fields = [field for field in schema.archive_fields if field.archive_name in category_ids]
+        results = await asyncio.gather(*[self.get_archive_items(category_ids[field.archive_name]) for field in fields])
+        return {
+            field.name: [item["name"] for item in result["data"]["items"] if item.get("name")]
+            for field, result in zip(fields, results) if result["success"]
+        }
+    
+    async def _archive_vocabulary(self, schema: TemplateSchema) -> List[str]:
+        """模板档案字段的全部档案项名称"""
+        return [name for names in (await self._archive_options(schema)).values() for name in names]
     
     def _fallback_field_extraction(self, user_input: str) -> Dict[str, Any]:
         """备用字段提取方法"""
@@ -718,83 +1035,35 @@ class SmartExpenseMCP:
             "requisitionDate": int(time.time() * 1000)
         }
     
-    def _validate_required_fields(self, field_mapping: Dict[str, Any], fields_info: List[Dict]) -> tuple[bool, str]:
-        """验证必填字段"""
-        for field in fields_info:
-            if field['required'] and field['name'] not in field_mapping:
-                return False, f"缺少必填字段：{field['label']}"
-        
-        # 验证标题长度
-        title = field_mapping.get("title", "")
-        if len(title) > 14:
-            return False, "标题长度超过14个字符"
-        
-        return True, "验证通过"
-    
-    
-    async def _build_request_body(self, field_mapping: Dict[str, Any], template_id: str, fields_info: List[Dict]) -> Dict[str, Any]:
-        """构建API请求体 - 完全动态处理所有字段"""
-        request_body = {
-            "form": {
-                "specificationId": template_id,
-                "submitterId": "ID01IBfgTxKWAL:S6g73MppKM3A00"  # 固定的提交人ID
-            }
-        }
+    async def _build_request_body(self, field_mapping: Dict[str, Any], template_id: str, schema: TemplateSchema,
+                                  pending_archives: Optional[Dict[str, tuple]] = None) -> tuple[Dict[str, Any], Optional[str]]:
+        """
+        构建API请求体 - 完全动态处理所有字段
         
+        档案字段并发解析为档案项ID（pending_archives中值未变的字段直接等待流式提取期间已启动的解析任务），
+        其余字段由编译好的字段模型单次遍历转换并校验。返回 (请求体, 第一个校验错误或None)。
+        """
         # 确保submitterId在字段映射中
         field_mapping["submitterId"] = "ID01IBfgTxKWAL:S6g73MppKM3A00"
         
-        # 动态处理所有字段，根据字段类型进行相应处理
-        for field_name, field_value in field_mapping.items():
-            # 检查是否为档案字段
-            is_archive_field = False
-            archive_value_from = ""
-            for field in fields_info:
-                if field['name'] == field_name and field.get('valueFrom', '').startswith('basedata.Dimension.'):
-                    is_archive_field = True
-                    archive_value_from = field.get('valueFrom', '')
-                    break
-            
-            if is_archive_field:
-                # 档案字段需要异步处理
-                processed_value = await self._process_archive_field(field_value, archive_value_from, field_name)
-            else:
-                # 其他字段同步处理
-                processed_value = self._process_field_by_type(field_name, field_value, fields_info)
-            
-            request_body["form"][field_name] = processed_value
+        pending_archives = pending_archives or {}
+        archive_fields = [schema.by_name[name] for name in field_mapping if name in schema.by_name and schema.by_name[name].is_archive]
+        archive_values = await asyncio.gather(*[
+            pending_archives[field.name][1]
+            if field.name in pending_archives and pending_archives[field.name][0] == field_mapping[field.name]
+            else self._process_archive_field(field_mapping[field.name], field.value_from, field.name)
+            for field in archive_fields
+        ])
         
-        return request_body
-    
-    def _process_field_by_type(self, field_name: str, field_value: Any, fields_info: List[Dict]) -> Any:
-        """根据字段类型动态处理字段值"""
-        # 查找字段配置
-        field_config = None
-        for field in fields_info:
-            if field['name'] == field_name:
-                field_config = field
-                break
-        
-        # 如果没有找到字段配置，直接返回原值
-        if not field_config:
-            return field_value
-            
-        field_type = field_config.get('type', '文本')
-        value_from = field_config.get('valueFrom', '')
-        
-        # 根据字段类型动态处理
-        if field_type == '金额':
-            # 金额字段保持原格式（AI已经处理为正确格式）
-            return field_value
-        elif field_type == '日期':
-            # 日期字段智能处理
-            return self._process_date_field(field_value)
-        elif value_from.startswith('basedata.Dimension.'):
-            # 档案字段：需要从档案选项中匹配ID
-            return self._process_archive_field(field_value, value_from, field_name)
-        else:
-            # 文本、选择等字段直接返回
-            return field_value
+        form, error = schema.build_form(
+            field_mapping,
+            resolved={field.name: value for field, value in zip(archive_fields, archive_values)},
+            base={
+                "specificationId": template_id,
+                "submitterId": "ID01IBfgTxKWAL:S6g73MppKM3A00"  # 固定的提交人ID
+            }
+        )
+        return {"form": form}, error
 
     async def _process_archive_field(self, field_value: Any, value_from: str, field_name: str) -> str:
         """处理档案字段，将用户输入的档案名称转换为档案ID"""
@@ -803,7 +1072,7 @@ class SmartExpenseMCP:
                 logger.warning(f"档案字段 {field_name} 的值为空")
                 return ""
             
-            logger.info(f"🗃️ 处理档案字段 {field_name}: {field_value} (valueFrom: {value_from})")
+            logger.debug("🗃️ 处理档案字段 %s: %s (valueFrom: %s)", field_name, field_value, value_from)
             
             # 提取档案类别名称
             archive_name = value_from.replace('basedata.Dimension.', '')
@@ -837,13 +1106,13 @@ class SmartExpenseMCP:
                 item_name = item["name"].strip()
                 # 精确匹配或包含匹配
                 if field_value_str == item_name or field_value_str in item_name or item_name in field_value_str:
-                    logger.info(f"✅ 档案字段匹配成功: {field_value} -> {item_name} (ID: {item['id']})")
+                    logger.debug("✅ 档案字段匹配成功: %s -> %s (ID: %s)", field_value, item_name, item['id'])
                     return item["id"]
             
             # 如果没有匹配，返回第一个选项的ID（默认选择）
             if items_result["data"]["items"]:
                 default_item = items_result["data"]["items"][0]
-                logger.warning(f"⚠️ 档案字段未找到精确匹配，使用默认项: {field_value} -> {default_item['name']} (ID: {default_item['id']})")
+                logger.warning("⚠️ 档案字段未找到精确匹配，使用默认项: %s -> %s (ID: %s)", field_value, default_item['name'], default_item['id'])
                 return default_item["id"]
             
             logger.error(f"档案字段 {field_name} 没有可用选项")
@@ -902,13 +1171,22 @@ class SmartExpenseMCP:
                 logger.warning(f"日期解析失败: {date_value}, 错误: {e}")
         
         # 如果都无法解析，返回当前时间
-        logger.info(f"使用当前时间作为日期字段默认值: {date_value}")
+        logger.debug("使用当前时间作为日期字段默认值: %s", date_value)
         return int(time.time() * 1000)
 
-    async def get_document_by_code(self, document_code: str) -> Dict[str, Any]:
+    @mcp_tool(
+        "根据申请单编号查询申请单详情",
+        parameters={"code": {"type": "string", "description": "申请单编号，如S25000089"}},
+        required=["code"]
+    )
+    async def get_document_by_code(self, code: str) -> Dict[str, Any]:
         """根据单据编号查询申请单详情 - 简化版本"""
         return {
             "success": True,
             "message": "单据查询功能需要完整实现",
             "data": {}
         }
+
+
+# 工具注册表：导入时从@mcp_tool装饰的方法生成一次，所有实例共享
+SmartExpenseMCP.tools = ToolRegistry.collect(SmartExpenseMCP)
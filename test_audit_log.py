@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试审计日志的后台写入线程
+记录由后台线程批量写入、停止时写完队列中剩余的记录、停止后再记录会重新启动线程、文件超过上限时轮转
+（可直接运行，也可用pytest执行）
+"""
+
+import json
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.audit_log import AuditLog
+from services.metrics import metrics
+
+
+def read_entries(path: str):
+    with open(path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+
+def new_log(**options) -> AuditLog:
+    return AuditLog(os.path.join(tempfile.mkdtemp(), "audit.jsonl"), **options)
+
+
+def test_background_flush():
+    log = new_log(flush_interval=0.05)
+    for index in range(3):
+        log.record("requisition_created", index=index)
+
+    # 不停止线程，记录也会被后台线程写入
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline and not (os.path.exists(log.path) and len(read_entries(log.path)) == 3):
+        time.sleep(0.01)
+    assert [entry["index"] for entry in read_entries(log.path)] == [0, 1, 2]
+    assert all(entry["event"] == "requisition_created" and entry["ts"] for entry in read_entries(log.path))
+    assert log._thread.is_alive()
+    log.stop()
+
+
+def test_stop_drains_queue():
+    log = new_log(flush_interval=10)
+    flushes = metrics.counters.get("audit.flushes", 0)
+    for index in range(1200):
+        log.record("requisition_created", index=index)
+    thread = log._thread
+    log.stop()
+    assert not thread.is_alive() and log._thread is None
+    assert [entry["index"] for entry in read_entries(log.path)] == list(range(1200))
+    assert metrics.counters["audit.flushes"] - flushes >= 3  # 每批最多MAX_BATCH条
+
+    # 停止后再记录：重新启动写入线程
+    log.record("requisition_rejected", index=1200)
+    log.stop()
+    last = read_entries(log.path)[-1]
+    assert last["event"] == "requisition_rejected" and last["index"] == 1200
+
+
+def test_rotation_and_disabled():
+    log = new_log(max_bytes=200, backup_count=2)
+    for index in range(20):
+        log.record("requisition_created", index=index, padding="x" * 50)
+        log.stop()  # 每条单独写入一批，才会逐批检查文件大小
+    assert os.path.exists(log.path + ".1") and os.path.exists(log.path + ".2")
+    assert not os.path.exists(log.path + ".3")
+    assert read_entries(log.path)[-1]["index"] == 19
+
+    disabled = new_log(enabled=False)
+    disabled.record("requisition_created", index=0)
+    disabled.stop()
+    assert disabled._thread is None and not os.path.exists(disabled.path)
+
+
+if __name__ == "__main__":
+    test_background_flush()
+    test_stop_drains_queue()
+    test_rotation_and_disabled()
+    print("✅ 审计日志写入线程测试通过")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试上游调用预算
+使用本地替身代替易快报和DeepSeek，预热缓存后断言各操作的上游调用次数不超过预算
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from benchmarks.call_recorder import CallBudgetExceeded
+
+
+async def check_create_with_warm_cache():
+    """缓存预热后，创建申请单最多1次易快报调用（提交）和1次DeepSeek调用（字段提取）"""
+    mcp, recorder = await warm_mcp()
+
+    with recorder.unit_of_work("create_smart_expense") as calls:
+        result = await mcp.create_smart_expense("帮我申请出差上海3000元，明天出发")
+
+    assert result["success"], result
+    calls.assert_budget({"ekuaibao": 1, "deepseek": 1})
+    print(f"✅ create_smart_expense 上游调用: {[str(call) for call in calls.calls]}")
+
+
+async def check_cached_lookups():
+    """缓存预热后，模板和档案查询不访问上游"""
+    mcp, recorder = await warm_mcp()
+
+    with recorder.unit_of_work("cached_lookups") as calls:
+        await mcp.get_template_fields()
+        await mcp.get_archive_categories()
+
+    calls.assert_budget({})
+    print("✅ 缓存命中时无上游调用")
+
+
+async def check_concurrent_fetch_coalesced():
+    """不走缓存时，并发的相同模板/档案拉取合并为一次上游调用"""
+    mcp, recorder = await warm_mcp(latency_scale=0.01)  # 替身需要有延迟，请求才会真正并发在途
+
+    with recorder.unit_of_work("concurrent_fetch") as calls:
+        results = await asyncio.gather(
+            *[mcp._fetch_template_fields() for _ in range(5)],
+            *[mcp._fetch_archive_categories() for _ in range(5)]
+        )
+
+    assert all(result["success"] for result in results), results
+    calls.assert_budget({"ekuaibao:latestByType": 1, "ekuaibao:byIds/editable": 1, "ekuaibao:dimensions": 1})
+    print(f"✅ 10个并发拉取的上游调用: {[str(call) for call in calls.calls]}")
+
+
+async def check_template_revalidation():
+    """模板未变化时重新拉取只请求列表：支持ETag时列表返回304，否则按列表中的版本标识跳过详情"""
+    for etags in (True, False):
+        mcp, recorder = await warm_mcp(etags=etags)
+        await mcp._fetch_template_fields()  # 记录上次解析结果（预热可能命中共享缓存而未回源）
+
+        with recorder.unit_of_work(f"revalidate_template(etags={etags})") as calls:
+            result = await mcp._fetch_template_fields()
+
+        assert result["success"], result
+        assert result["data"]["template_id"] == "ID01spec:ai:3f9a2c", result["data"]
+        calls.assert_budget({"ekuaibao:latestByType": 1})
+        print(f"✅ 模板重验证(etags={etags})上游调用: {[str(call) for call in calls.calls]}")
+
+
+async def check_budget_failure_diff():
+    """超出预算时断言失败，并以"+"标出多余的调用"""
+    mcp, recorder = await warm_mcp()
+    await mcp.invalidate_cache("dimension")
+
+    with recorder.unit_of_work("cold_categories") as calls:
+        await mcp.get_archive_categories()
+
+    try:
+        calls.assert_budget({})
+    except CallBudgetExceeded as e:
+        message = str(e)
+        assert "+ GET ekuaibao:dimensions" in message, message
+        print(f"✅ 超出预算时的差异输出:\n{message}")
+    else:
+        raise AssertionError("预期超出预算，但断言通过")
+
+
+def test_create_with_warm_cache():
+    asyncio.run(check_create_with_warm_cache())
+
+
+def test_cached_lookups():
+    asyncio.run(check_cached_lookups())
+
+
+def test_concurrent_fetch_coalesced():
+    asyncio.run(check_concurrent_fetch_coalesced())
+
+
+def test_template_revalidation():
+    asyncio.run(check_template_revalidation())
+
+
+def test_budget_failure_diff():
+    asyncio.run(check_budget_failure_diff())
+
+
+if __name__ == "__main__":
+    test_create_with_warm_cache()
+    test_cached_lookups()
+    test_concurrent_fetch_coalesced()
+    test_template_revalidation()
+    test_budget_failure_diff()
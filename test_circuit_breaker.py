@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+测试熔断器半开探测名额的交还
+探测请求被取消、或流式读取中调用方抛出异常时，不应让熔断器一直拒绝请求
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from services.circuit_breaker import CircuitBreaker, get_breaker
+from services.resilience import UpstreamGateway
+
+URL = "https://upstream.test/api"
+
+
+def half_open_breaker(name: str) -> CircuitBreaker:
+    """冷却期为0、失败一次即打开的熔断器（随即进入半开）"""
+    breaker = get_breaker(name)
+    breaker.failure_threshold = 1
+    breaker.recovery_timeout = 0
+    breaker.record_failure()
+    assert breaker.state == breaker.HALF_OPEN
+    return breaker
+
+
+def slow_gateway() -> UpstreamGateway:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("slow"):
+            await asyncio.sleep(10)
+        return httpx.Response(200, json={"ok": True})
+
+    gateway = UpstreamGateway()
+    gateway.set_transport(httpx.MockTransport(handler))
+    return gateway
+
+
+async def check_cancelled_probe_releases_breaker():
+    gateway = slow_gateway()
+    breaker = half_open_breaker("breaker_test:cancel")
+
+    probe = asyncio.ensure_future(gateway.request("breaker_test", "cancel", "POST", URL, params={"slow": "1"}))
+    await asyncio.sleep(0.05)
+    assert not breaker.allow_request(), "探测请求在途时不应再放行"
+    probe.cancel()
+    await asyncio.gather(probe, return_exceptions=True)
+
+    response = await gateway.request("breaker_test", "cancel", "POST", URL)
+    assert response.status_code == 200 and breaker.state == breaker.CLOSED
+    await gateway.aclose()
+
+
+def test_cancelled_probe_releases_breaker():
+    asyncio.run(check_cancelled_probe_releases_breaker())
+
+
+async def check_stream_consumer_error_releases_breaker():
+    gateway = slow_gateway()
+    breaker = half_open_breaker("breaker_test:stream")
+
+    try:
+        async with gateway.stream("breaker_test", "stream", "GET", URL):
+            raise ValueError("解析失败")
+    except ValueError:
+        pass
+    assert breaker.allow_request(), "调用方异常后应交还探测名额"
+    breaker.release_probe()
+
+    async with gateway.stream("breaker_test", "stream", "GET", URL) as response:
+        assert response.status_code == 200
+    assert breaker.state == breaker.CLOSED
+    await gateway.aclose()
+
+
+def test_stream_consumer_error_releases_breaker():
+    asyncio.run(check_stream_consumer_error_releases_breaker())
+
+
+if __name__ == "__main__":
+    test_cancelled_probe_releases_breaker()
+    test_stream_consumer_error_releases_breaker()
+    print("✅ 熔断器半开探测名额测试通过")
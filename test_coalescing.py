@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+测试合并的并发请求在发起方被取消时的行为
+其他等待方照常拿到结果；全部等待方取消时才取消上游调用
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from services.resilience import UpstreamGateway
+from services.shared_cache import CacheTier, MemoryCache
+
+URL = "https://upstream.test/api/list"
+
+
+class SlowUpstream:
+    """延迟返回的上游，记录请求次数和被取消的请求数"""
+
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+        self.requests = 0
+        self.cancelled = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return httpx.Response(200, json={"items": [1, 2, 3]})
+
+
+async def check_gateway_leader_cancelled():
+    upstream = SlowUpstream()
+    gateway = UpstreamGateway()
+    gateway.set_transport(httpx.MockTransport(upstream.handle))
+
+    leader = asyncio.ensure_future(gateway.request("coalesce_test", "list", "GET", URL))
+    await asyncio.sleep(0.02)
+    follower = asyncio.ensure_future(gateway.request("coalesce_test", "list", "GET", URL))
+    await asyncio.sleep(0.02)
+    leader.cancel()
+
+    response = await follower
+    assert leader.cancelled() and not follower.cancelled()
+    assert response.json() == {"items": [1, 2, 3]} and upstream.requests == 1
+
+    # 全部等待方取消时上游调用也被取消，之后的请求重新发起
+    only = asyncio.ensure_future(gateway.request("coalesce_test", "list", "GET", URL))
+    await asyncio.sleep(0.02)
+    only.cancel()
+    await asyncio.gather(only, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert upstream.cancelled == 1
+    assert (await gateway.request("coalesce_test", "list", "GET", URL)).status_code == 200
+    assert upstream.requests == 3
+    await gateway.aclose()
+
+
+def test_gateway_leader_cancelled():
+    asyncio.run(check_gateway_leader_cancelled())
+
+
+async def check_cache_leader_cancelled():
+    cache = CacheTier(MemoryCache())
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.1)
+        return {"template_id": "tpl:v1"}
+
+    async def follower_loader():
+        raise AssertionError("跟随方不应自行回源")
+
+    leader = asyncio.ensure_future(cache.get_or_load("template", "current", loader, ttl=60))
+    await asyncio.sleep(0.02)
+    follower = asyncio.ensure_future(cache.get_or_load("template", "current", follower_loader, ttl=60))
+    await asyncio.sleep(0.02)
+    leader.cancel()
+
+    assert await follower == {"template_id": "tpl:v1"}
+    assert leader.cancelled() and len(loads) == 1
+    assert await cache.get("template", "current") == {"template_id": "tpl:v1"}
+
+
+def test_cache_leader_cancelled():
+    asyncio.run(check_cache_leader_cancelled())
+
+
+if __name__ == "__main__":
+    test_gateway_leader_cancelled()
+    test_cache_leader_cancelled()
+    print("✅ 合并请求取消测试通过")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试DeepSeek按调用场景的模型参数和对冲请求
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import json
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.mock_upstream import configure_offline_environment
+
+configure_offline_environment()
+
+import httpx
+
+from services import deepseek_service as deepseek_module
+from services.deepseek_service import DeepSeekService
+from services.metrics import LatencyTracker, metrics
+from services.resilience import get_gateway
+from services.usage_ledger import UsageLedger
+
+MESSAGES = [{"role": "user", "content": "帮我申请出差上海3000元"}]
+
+
+def test_call_site_profiles():
+    service = DeepSeekService()
+    intent = service._payload(MESSAGES, service.profile("intent"))
+    extract = service._payload(MESSAGES, service.profile("extract"))
+    other = service._payload(MESSAGES, service.profile("chat"))
+
+    assert intent["max_tokens"] < other["max_tokens"] and "response_format" not in intent
+    assert extract["response_format"] == {"type": "json_object"}
+    assert other["max_tokens"] == 2000 and other["model"] == "deepseek-chat"
+    assert service.profile("extract").timeout == 60 and service.profile("intent").timeout == 20
+    assert service.profile("chat").timeout is None
+
+
+async def check_hedged_request():
+    """首个请求卡住超过p95时发送对冲请求，先返回的响应胜出"""
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        if len(requests) == 1:
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": f"reply-{len(requests)}"}}],
+            "usage": {"prompt_tokens": 100, "prompt_cache_hit_tokens": 0, "completion_tokens": 10}
+        })
+
+    get_gateway().set_transport(httpx.MockTransport(handler))
+    service = DeepSeekService()
+    service.hedging = True
+    service.usage = UsageLedger(path=os.path.join(tempfile.mkdtemp(), "usage.db"))
+    tracker = deepseek_module._call_site_latency["intent"] = LatencyTracker()
+    for _ in range(deepseek_module.HEDGE_MIN_SAMPLES):
+        tracker.record(0.05)
+
+    started = time.perf_counter()
+    result = await service.chat(MESSAGES, call_site="intent")
+    assert time.perf_counter() - started < 0.4, "对冲请求应该在首个请求返回前胜出"
+    assert result["choices"][0]["message"]["content"] == "reply-2"
+    assert len(requests) == 2 and requests[0] == requests[1]
+    assert metrics.counters["deepseek.intent.hedge_won"] >= 1
+    # 落败的请求已发出，同样计入用量（按胜出请求的用量估算）
+    intent = {row["call_site"]: row for row in service.usage.report()}["intent"]
+    assert intent["calls"] == 2 and intent["prompt_tokens"] == 200, intent
+
+    # 未配置对冲的场景不发送对冲请求
+    requests.clear()
+    deepseek_module._call_site_latency["extract"] = tracker
+    started = time.perf_counter()
+    await service.chat(MESSAGES, call_site="extract")
+    assert len(requests) == 1 and time.perf_counter() - started >= 0.5
+    get_gateway().set_transport(None)
+
+
+def test_hedged_request():
+    asyncio.run(check_hedged_request())
+
+
+if __name__ == "__main__":
+    test_call_site_profiles()
+    test_hedged_request()
+    print("✅ DeepSeek调用场景参数与对冲请求测试通过")
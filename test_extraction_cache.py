@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试字段提取模式缓存
+规范化用户输入、骨架回填，以及相同模式的申请单创建跳过AI字段提取调用
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+from datetime import date, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from services.extraction_cache import ExtractionCache, day_start_ms, parse_date_expression
+
+TODAY = date(2025, 3, 12)  # 星期三
+VOCABULARY = ["上海", "北京", "智能申请单项目"]
+
+
+def new_cache() -> ExtractionCache:
+    return ExtractionCache(path=os.path.join(tempfile.mkdtemp(), "cache.json"), max_entries=10, enabled=True)
+
+
+def test_parse_date_expression():
+    assert parse_date_expression("明天", TODAY) == date(2025, 3, 13)
+    assert parse_date_expression("下周一", TODAY) == date(2025, 3, 17)
+    assert parse_date_expression("3天后", TODAY) == date(2025, 3, 15)
+    assert parse_date_expression("4月1日", TODAY) == date(2025, 4, 1)
+    assert parse_date_expression("2025-02-30", TODAY) is None
+
+
+def test_canonicalize():
+    pattern = new_cache().canonicalize("出差上海3000元，明天出发，备注2号线", VOCABULARY, TODAY)
+    assert pattern.text == "出差{{N}}{{A}}元，{{D}}出发，备注2号线", pattern.text
+    assert [(slot.name, slot.raw) for slot in pattern.slots] == [("N0", "上海"), ("A0", "3000"), ("D0", "明天")]
+
+
+def test_skeleton_refill():
+    """同一模式的输入回填出新的金额、日期和城市"""
+    cache = new_cache()
+    first = "出差上海3000元，明天出发"
+    pattern = cache.canonicalize(first, VOCABULARY, TODAY)
+    mapping = {
+        "title": "出差上海",
+        "description": first,
+        "requisitionMoney": {"standard": "3000.00", "standardUnit": "元"},
+        "requisitionDate": day_start_ms(TODAY + timedelta(days=1)) + 9 * 3600 * 1000,
+        "u_城市": "上海"
+    }
+    assert asyncio.run(cache.store("tpl:v1", pattern, first, mapping))
+
+    second = "出差北京2500元，下周一出发"
+    now = day_start_ms(TODAY) / 1000 + 3600
+    filled, _ = cache.lookup("tpl:v1", second, VOCABULARY, now=now)
+    assert filled == {
+        "title": "出差北京",
+        "description": second,
+        "requisitionMoney": {"standard": "2500.00", "standardUnit": "元"},
+        "requisitionDate": day_start_ms(date(2025, 3, 17)) + 9 * 3600 * 1000,
+        "u_城市": "北京"
+    }, filled
+
+    # 其他模板版本不共享骨架
+    missed, _ = cache.lookup("tpl:v2", second, VOCABULARY, now=now)
+    assert missed is None
+    assert cache.hit_rate() == 0.5
+
+
+def test_uncacheable_mapping():
+    """AI结果中找不到输入片段时不缓存，避免回填出过期的值"""
+    cache = new_cache()
+    user_input = "培训费5000元"
+    pattern = cache.canonicalize(user_input, VOCABULARY, TODAY)
+    mapping = {"title": "培训申请", "requisitionMoney": {"standard": "五千元"}}
+    assert not asyncio.run(cache.store("tpl:v1", pattern, user_input, mapping))
+
+
+def test_persistence():
+    cache = new_cache()
+    user_input = "培训费5000元"
+    pattern = cache.canonicalize(user_input, VOCABULARY, TODAY)
+    assert asyncio.run(cache.store("tpl:v1", pattern, user_input, {"requisitionMoney": {"standard": "5000.00"}}))
+
+    reloaded = ExtractionCache(path=cache.path, enabled=True)
+    filled, _ = reloaded.lookup("tpl:v1", "培训费800元", VOCABULARY)
+    assert filled == {"requisitionMoney": {"standard": "800.00"}}, filled
+
+    changed_rules = ExtractionCache(path=cache.path, enabled=True, fingerprint="other")
+    assert changed_rules.lookup("tpl:v1", "培训费800元", VOCABULARY)[0] is None
+
+
+async def check_repeated_pattern_skips_llm():
+    """相同模式的第二次创建不再调用DeepSeek"""
+    mcp, recorder = await warm_mcp(extraction_cache=new_cache())
+
+    await mcp.create_smart_expense("帮我申请出差上海3000元，明天出发")
+    with recorder.unit_of_work("create_smart_expense") as calls:
+        result = await mcp.create_smart_expense("帮我申请出差北京2500元，明天出发")
+
+    assert result["success"], result
+    assert result["data"]["form_data"]["title"] == "出差北京"
+    calls.assert_budget({"ekuaibao:flow/data": 1})
+
+
+def test_repeated_pattern_skips_llm():
+    asyncio.run(check_repeated_pattern_skips_llm())
+
+
+if __name__ == "__main__":
+    test_parse_date_expression()
+    test_canonicalize()
+    test_skeleton_refill()
+    test_uncacheable_mapping()
+    test_persistence()
+    test_repeated_pattern_skips_llm()
+    print("✅ 字段提取模式缓存测试通过")
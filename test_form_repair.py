@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+测试提交前的表单校验与自动修复
+确定性修复、无法修复的字段报告，以及从400错误中学习约束后自动重新提交
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from services.form_repair import FormRepairer
+from services.template_schema import TemplateSchema
+
+NOW = time.time()
+FIELDS = [
+    {"name": "title", "label": "标题", "type": "文本", "required": True},
+    {"name": "description", "label": "申请事由", "type": "长文本", "required": False},
+    {"name": "requisitionMoney", "label": "申请金额", "type": "金额", "required": True},
+    {"name": "requisitionDate", "label": "申请日期", "type": "日期", "required": True},
+    {"name": "u_城市", "label": "城市", "type": "选择", "required": False, "valueFrom": "basedata.Dimension.城市"}
+]
+OPTIONS = {"u_城市": ["上海", "北京", "南京"]}
+
+
+def new_schema() -> TemplateSchema:
+    return TemplateSchema.from_fields_info("tpl:v1", "AI申请单", FIELDS)
+
+
+def test_deterministic_repairs():
+    repairer = FormRepairer(base_rules={"title": {"max_length": 14}})
+    mapping = {
+        "title": "  关于上海出差的差旅费用申请单据  ",
+        "requisitionMoney": "3,000元",
+        "u_城市": "上海市"
+    }
+    result = repairer.repair(new_schema(), mapping, OPTIONS, now=NOW)
+
+    assert not result.violations, result.violations
+    assert result.mapping["title"] == "关于上海出差的差旅费用申请单"
+    assert result.mapping["requisitionMoney"]["standard"] == "3000.00"
+    assert result.mapping["requisitionMoney"]["standardScale"] == 2
+    assert result.mapping["requisitionDate"] == int(NOW * 1000)
+    assert result.mapping["u_城市"] == "上海"
+    assert len(result.fixes) == 4, result.fixes
+    assert mapping["u_城市"] == "上海市"  # 不修改传入的映射
+
+
+def test_unrepairable_fields():
+    repairer = FormRepairer()
+    mapping = {"title": "出差", "requisitionMoney": {"standard": "-5"}, "requisitionDate": "很久以前", "u_城市": "广州"}
+    result = repairer.repair(new_schema(), mapping, OPTIONS, now=NOW)
+    assert {violation.field: violation.reason for violation in result.violations} == {
+        "requisitionMoney": "必须大于0",
+        "requisitionDate": "格式无效",
+        "u_城市": "不在可选项中"
+    }, result.violations
+    assert result.violations[2].options == OPTIONS["u_城市"]
+
+    # 最终修复：日期回退为当前时间，档案值保留原值交给档案解析
+    final = repairer.repair(new_schema(), mapping, OPTIONS, final=True, now=NOW)
+    assert [violation.field for violation in final.violations] == ["requisitionMoney"]
+    assert final.mapping["requisitionDate"] == int(NOW * 1000)
+
+    missing = repairer.repair(new_schema(), {"requisitionMoney": 100}, OPTIONS, now=NOW)
+    assert [violation.message for violation in missing.violations] == ["缺少必填字段：标题"]
+
+
+def test_non_text_values_untouched():
+    """复选框、附件列表、收款信息等非字符串值不转成字符串，也不算作修复"""
+    fields = FIELDS + [
+        {"name": "isUrgent", "label": "加急", "type": "复选框", "required": False},
+        {"name": "attachments", "label": "附件", "type": "附件", "required": False},
+        {"name": "payee", "label": "收款信息", "type": "选择", "required": False},
+    ]
+    schema = TemplateSchema.from_fields_info("tpl:v1", "AI申请单", fields)
+    mapping = {
+        "title": "出差", "requisitionMoney": {"standard": "100.00", "standardUnit": "元", "standardScale": 2},
+        "requisitionDate": int(NOW * 1000), "isUrgent": True, "attachments": [{"key": "a"}], "payee": {"id": "P1"}
+    }
+    result = FormRepairer().repair(schema, mapping, OPTIONS, now=NOW)
+    assert not result.violations, result.violations
+    assert result.mapping["isUrgent"] is True
+    assert result.mapping["attachments"] == [{"key": "a"}] and result.mapping["payee"] == {"id": "P1"}
+    assert not [fix for fix in result.fixes if fix.startswith(("加急", "附件", "收款信息"))], result.fixes
+
+
+def test_learn_from_rejection():
+    repairer = FormRepairer()
+    assert repairer.learn(new_schema(), '{"errorMessage": "字段[申请事由]长度不能超过20个字符"}') == {
+        "description": {"max_length": 20}
+    }
+    assert repairer.learn(new_schema(), "城市不能为空") == {"u_城市": {"required": True}}
+    assert repairer.learn(new_schema(), "系统繁忙") == {}
+
+
+async def check_learned_constraint_resubmits():
+    """第一次400后学到长度约束并重新提交；之后的请求提交前就在本地修复"""
+    mcp, recorder = await warm_mcp(flow_max_lengths={"description": 20})
+
+    with recorder.unit_of_work("create_smart_expense") as calls:
+        result = await mcp.create_smart_expense("帮我申请出差上海3000元，明天出发，拜访客户并参加行业交流会")
+    assert result["success"], result
+    assert len(result["data"]["form_data"]["description"]) == 20
+    assert calls.count("ekuaibao:flow/data") == 2
+
+    with recorder.unit_of_work("create_smart_expense") as calls:
+        result = await mcp.create_smart_expense("帮我申请出差北京2500元，后天出发，参加公司年度技术大会和培训")
+    assert result["success"], result
+    assert len(result["data"]["form_data"]["description"]) == 20
+    calls.assert_budget({"ekuaibao:flow/data": 1, "deepseek": 1})
+
+
+def test_learned_constraint_resubmits():
+    asyncio.run(check_learned_constraint_resubmits())
+
+
+if __name__ == "__main__":
+    test_deterministic_repairs()
+    test_unrepairable_fields()
+    test_non_text_values_untouched()
+    test_learn_from_rejection()
+    test_learned_constraint_resubmits()
+    print("✅ 表单校验与自动修复测试通过")
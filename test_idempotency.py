@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试申请单创建幂等
+同一幂等键的重复提交（并发重试、完成后重试）只创建一次申请单，不再调用上游
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import uuid
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from smart_expense_mcp import SmartExpenseMCP
+
+USER_INPUT = "帮我申请出差上海3000元，明天出发"
+
+
+def test_derive_key():
+    guard = SmartExpenseMCP().idempotency
+    session = uuid.uuid4().hex
+    assert guard.derive_key(None, session, "出差上海3000元。") == guard.derive_key(None, session, " 出差上海 3000元")
+    assert guard.derive_key(None, session, "出差上海3000元") != guard.derive_key(None, uuid.uuid4().hex, "出差上海3000元")
+    assert guard.derive_key(None, session, "出差上海3000元") != guard.derive_key(None, session, "出差北京3000元")
+    assert guard.derive_key("key-1", session, "出差上海3000元") == guard.derive_key("key-1", None, "出差北京3000元")
+    assert guard.derive_key(None, None, "出差上海3000元") is None
+
+
+async def check_duplicate_submissions():
+    mcp, recorder = await warm_mcp(latency_scale=0.05)
+    mcp.idempotency.bind(mcp.idempotency.derive_key(None, uuid.uuid4().hex, USER_INPUT))
+
+    # 进行中的创建：重试请求等待并共享结果
+    with recorder.unit_of_work("concurrent_retry") as calls:
+        first, retry = await asyncio.gather(
+            mcp.create_smart_expense(USER_INPUT),
+            mcp.create_smart_expense(USER_INPUT)
+        )
+    assert first["success"] and retry["success"], (first, retry)
+    assert retry["deduplicated"] and "deduplicated" not in first
+    assert retry["data"]["document_code"] == first["data"]["document_code"]
+    calls.assert_budget({"ekuaibao:flow/data": 1, "deepseek": 1})
+
+    # 已完成的创建：直接返回保存的结果
+    with recorder.unit_of_work("completed_retry") as calls:
+        replay = await mcp.create_smart_expense(USER_INPUT)
+    assert replay["deduplicated"]
+    assert replay["data"]["document_code"] == first["data"]["document_code"]
+    calls.assert_budget({})
+
+    # 其他会话的相同输入照常创建
+    mcp.idempotency.bind(mcp.idempotency.derive_key(None, uuid.uuid4().hex, USER_INPUT))
+    other = await mcp.create_smart_expense(USER_INPUT)
+    assert other["success"] and other["data"]["document_code"] != first["data"]["document_code"]
+
+
+def test_duplicate_submissions():
+    asyncio.run(check_duplicate_submissions())
+
+
+if __name__ == "__main__":
+    test_derive_key()
+    test_duplicate_submissions()
+    print("✅ 申请单创建幂等测试通过")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试增量JSON解析
+成员一完整就产出、字符串中的分隔符不影响拆分、忽略对象前后的文字，以及不合法的成员（多余逗号等）被拒绝
+（可直接运行，也可用pytest执行）
+"""
+
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.json_stream import IncrementalObjectParser
+
+
+def feed_all(text: str, chunk_size: int = 3):
+    parser = IncrementalObjectParser()
+    completed = []
+    for start in range(0, len(text), chunk_size):
+        completed.extend(parser.feed(text[start:start + chunk_size]))
+    return parser, completed
+
+
+def test_members_complete_incrementally():
+    text = '说明：\n```json\n{"title": "出差{北京}, \\"三天\\"", "amount": 1200, "tags": ["a", {"b": [1, 2]}]}\n```\n以上。'
+    parser = IncrementalObjectParser()
+    assert parser.feed('说明：{"title": "出差{北京}, \\"三') == []
+    assert parser.feed('天\\"", "amount": 12') == [("title", '出差{北京}, "三天"')]
+    assert parser.feed('00,') == [("amount", 1200)]
+    assert parser.close() is None  # 对象尚未结束
+
+    parser, completed = feed_all(text)
+    expected = json.loads(text[text.index("{"):text.rindex("}") + 1])
+    assert parser.close() == expected
+    assert [name for name, _ in completed] == ["title", "amount", "tags"]
+
+    # 第一个对象结束后的内容不再解析
+    parser, completed = feed_all('{"a": 1} {"b": 2}')
+    assert parser.close() == {"a": 1} and completed == [("a", 1)]
+
+
+def test_empty_and_incomplete_objects():
+    parser, completed = feed_all('{ }')
+    assert parser.close() == {} and completed == []
+    parser, _ = feed_all('没有JSON')
+    assert parser.close() is None
+    parser, completed = feed_all('{"a": 1, "b": [1, 2')
+    assert parser.close() is None and completed == [("a", 1)]
+
+
+def test_invalid_members_rejected():
+    for text in ('{"a": 1,}', '{,}', '{"a": 1,, "b": 2}', '{"a": }', '{"a" 1}'):
+        try:
+            feed_all(text)
+        except json.JSONDecodeError:
+            continue
+        raise AssertionError(f"应拒绝不合法的JSON: {text}")
+
+
+if __name__ == "__main__":
+    test_members_complete_incrementally()
+    test_empty_and_incomplete_objects()
+    test_invalid_members_rejected()
+    print("✅ 增量JSON解析测试通过")
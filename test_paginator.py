@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试易快报列表接口分页
+总数已知时并发拉取、总数未知时逐页预取、提前结束时取消未完成的拉取，超过单页条数的档案项全部返回，以及多页列表逐页重新验证
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from benchmarks.mock_upstream import MockUpstream
+from services.metrics import metrics
+from services.paginator import paginate
+
+ITEMS = list(range(95))
+
+
+class FakeListApi:
+    """按 start/count 分页的列表接口，记录请求和同时在途的最大页数"""
+
+    def __init__(self, items, with_total: bool = True, delay: float = 0.01):
+        self.items = items
+        self.with_total = with_total
+        self.delay = delay
+        self.requests = []
+        self.cancelled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def fetch_page(self, start: int, count: int):
+        self.requests.append(start)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        page = {"items": self.items[start:start + count]}
+        if self.with_total:
+            page["count"] = len(self.items)
+        return page
+
+
+async def check_known_total_fetches_in_parallel():
+    api = FakeListApi(ITEMS)
+    result = [item async for item in paginate(api.fetch_page, page_size=10, parallel=4)]
+    assert result == ITEMS
+    assert sorted(api.requests) == list(range(0, 100, 10))
+    assert api.max_in_flight == 4, api.max_in_flight
+
+
+def test_known_total_fetches_in_parallel():
+    asyncio.run(check_known_total_fetches_in_parallel())
+
+
+async def check_unknown_total_prefetches_next_page():
+    api = FakeListApi(ITEMS, with_total=False)
+    result = [item async for item in paginate(api.fetch_page, page_size=10, parallel=4)]
+    assert result == ITEMS
+    # 最后一页不满时不再请求下一页；总数未知时只预取一页
+    assert api.requests == list(range(0, 100, 10)) and api.max_in_flight == 1
+
+    exact = FakeListApi(list(range(20)), with_total=False)
+    assert [item async for item in paginate(exact.fetch_page, page_size=10)] == list(range(20))
+    assert exact.requests == [0, 10, 20]  # 满页之后的空页作为结束标志
+
+
+def test_unknown_total_prefetches_next_page():
+    asyncio.run(check_unknown_total_prefetches_next_page())
+
+
+async def check_early_stop_cancels_pending():
+    api = FakeListApi(ITEMS, delay=0.05)
+    pages = paginate(api.fetch_page, page_size=10, parallel=4)
+    assert [await pages.__anext__() for _ in range(3)] == [0, 1, 2]
+    await asyncio.sleep(0.01)  # 后续页已在途
+    await pages.aclose()
+    assert api.cancelled == 4 and api.in_flight == 0
+
+    # 达到读取上限时截断，并记录截断次数
+    truncated = metrics.counters.get("paginate.capped.truncated", 0)
+    capped = FakeListApi(ITEMS)
+    assert [item async for item in paginate(capped.fetch_page, page_size=10, max_items=25, name="capped")] == list(range(25))
+    assert sorted(capped.requests) == [0, 10, 20]
+    exact = FakeListApi(ITEMS)
+    assert len([item async for item in paginate(exact.fetch_page, page_size=10, max_items=30, name="capped")]) == 30
+    assert metrics.counters["paginate.capped.truncated"] == truncated + 2
+
+    # 恰好读完时不算截断
+    complete = FakeListApi(list(range(30)))
+    assert len([item async for item in paginate(complete.fetch_page, page_size=10, max_items=30, name="capped")]) == 30
+    assert metrics.counters["paginate.capped.truncated"] == truncated + 2
+
+
+def test_early_stop_cancels_pending():
+    asyncio.run(check_early_stop_cancels_pending())
+
+
+async def check_archive_items_beyond_one_page():
+    upstream = MockUpstream(latency_scale=0, extra_dimension_items=248)
+    mcp, recorder = await warm_mcp(warm=False, upstream=upstream)
+    with recorder.unit_of_work("archive_items_paginated") as calls:
+        result = await mcp.get_archive_items("ID01dim:project")
+    assert result["success"], result
+    items = result["data"]["items"]
+    assert len(items) == 250 and items[0]["id"] == "ID01item:p1" and items[-1]["id"] == "ID01item:x247"
+    calls.assert_budget({"ekuaibao:dimensions/items": 3}, strict=False)
+
+    # 多页列表每页都重新验证：各页均未变化（304）时复用上次结果
+    with recorder.unit_of_work("archive_items_revalidated") as calls:
+        again = await mcp._fetch_archive_items("ID01dim:project")
+    assert again == result
+    calls.assert_budget({"ekuaibao:dimensions/items": 3}, strict=False)
+
+    # 第一页未变化而后续页有修改时，返回修改后的列表
+    upstream.dimension_items["ID01dim:project"][150]["name"] = "改名项目"
+    changed = await mcp._fetch_archive_items("ID01dim:project")
+    assert changed["data"]["items"][150]["name"] == "改名项目"
+    assert len(changed["data"]["items"]) == 250
+
+    # 只有一页的列表第一页未变化时直接复用上次结果
+    cities = await mcp._fetch_archive_items("ID01dim:city")
+    with recorder.unit_of_work("single_page_revalidated") as calls:
+        assert await mcp._fetch_archive_items("ID01dim:city") == cities
+    calls.assert_budget({"ekuaibao:dimensions/items": 1})
+
+
+def test_archive_items_beyond_one_page():
+    asyncio.run(check_archive_items_beyond_one_page())
+
+
+if __name__ == "__main__":
+    test_known_total_fetches_in_parallel()
+    test_unknown_total_prefetches_next_page()
+    test_early_stop_cancels_pending()
+    test_archive_items_beyond_one_page()
+    print("✅ 易快报列表分页测试通过")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试存活/就绪探针在启动预热期间的状态变化
+预热未开始和进行中时 /readyz 返回503、/livez 始终200；预热完成或超出时间预算降级后 /readyz 返回200
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+
+import httpx
+
+import main
+from services.warmup import WarmupService
+
+
+async def probe(client: httpx.AsyncClient):
+    live = await client.get("/livez")
+    ready = await client.get("/readyz")
+    assert live.status_code == 200 and live.json() == {"status": "alive"}
+    return ready.status_code, ready.json()
+
+
+async def check_probes_during_warmup(timeout: float, expected: str):
+    # 替身带延迟，预热步骤才会在探测时仍在进行
+    mcp, _ = await warm_mcp(warm=False, latency_scale=0.5)
+    warmup = WarmupService(mcp, mcp.auth_service, timeout=timeout)
+    original, main.warmup_service = main.warmup_service, warmup
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://probe") as client:
+            status, body = await probe(client)
+            assert status == 503 and body["status"] == "warming_up" and body["warmup"]["status"] == "pending"
+
+            running = asyncio.ensure_future(warmup.run())
+            await asyncio.sleep(0.02)
+            status, body = await probe(client)
+            assert status == 503 and body["warmup"]["status"] == "running", body
+            assert body["warmup"]["steps"]["template"]["status"] == "running"
+
+            await running
+            status, body = await probe(client)
+            assert status == 200 and body["status"] == "ready", body
+            assert body["warmup"]["status"] == expected and body["warmup"]["duration_ms"] is not None
+    finally:
+        main.warmup_service = original
+        await warmup.aclose()
+
+
+def test_probes_ready_after_warmup():
+    asyncio.run(check_probes_during_warmup(timeout=10, expected="ready"))
+
+
+def test_probes_ready_when_warmup_degraded():
+    asyncio.run(check_probes_during_warmup(timeout=0.05, expected="degraded"))
+
+
+if __name__ == "__main__":
+    test_probes_ready_after_warmup()
+    test_probes_ready_when_warmup_degraded()
+    print("✅ 存活/就绪探针测试通过")
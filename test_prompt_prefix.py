@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+测试提示词前缀逐字节稳定
+同一模板版本的字段提取请求、字段重新提取请求和意图识别请求，在易变内容（当前时间、用户输入）之前的请求体字节完全相同，
+可以命中DeepSeek的上下文缓存
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+
+import httpx
+
+from services.json_codec import dumps_bytes
+from services.prompt_builder import ExtractionPromptBuilder
+from services.resilience import get_gateway
+from services.template_schema import TemplateSchema
+
+VOLATILE_MARKER = dumps_bytes("当前时间: ")[1:-1]  # 易变内容的开头
+
+
+def stable_prefix(first: bytes, second: bytes, marker: bytes) -> bytes:
+    """两个请求体在marker之前的部分必须逐字节相同，返回该部分"""
+    position = first.index(marker)
+    assert second.index(marker) == position and first[:position] == second[:position]
+    return first[:position]
+
+
+async def capture_bodies(send_all) -> list:
+    """截获发往DeepSeek的请求体"""
+    bodies = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(request.content)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "{}"}}]})
+
+    get_gateway().set_transport(httpx.MockTransport(handler))
+    try:
+        await send_all()
+    finally:
+        get_gateway().set_transport(None)
+    return bodies
+
+
+async def check_extraction_prefix_stable():
+    mcp, _ = await warm_mcp()
+    template = await mcp.get_template_fields()
+    schema = mcp._template_schema(template["data"])
+    builder, service = mcp.prompt_builder, mcp.deepseek_service
+
+    async def send_all():
+        await service.chat(builder.build(schema, "帮我申请出差上海3000元", now=1736870400), call_site="extract")
+        await service.chat(builder.build(schema, "培训费5000，下周一", now=1736956800.5), call_site="extract")
+        await service.chat(builder.build_repair(schema, "帮我申请出差上海3000元", [
+            ("u_城市", "出差城市", "不在可选项中", ["上海", "北京"])
+        ], now=1736870400), call_site="repair")
+
+    first, second, repair = await capture_bodies(send_all)
+    prefix = stable_prefix(first, second, VOLATILE_MARKER)
+    assert dumps_bytes(builder.prefix(schema))[1:-1] in prefix
+    # 重新提取使用另一个调用场景的模型参数，但系统提示词（字段目录）逐字节相同
+    assert dumps_bytes(builder.prefix(schema))[1:-1] in repair[:repair.index(VOLATILE_MARKER)]
+
+    # 共享缓存命中后按字段列表重建的字段模型、新的构建器，生成的前缀也逐字节相同
+    rebuilt = TemplateSchema.from_fields_info(schema.template_id, schema.template_name, schema.fields_info)
+    assert ExtractionPromptBuilder().prefix(rebuilt).encode("utf-8") == builder.prefix(schema).encode("utf-8")
+    assert builder.prefix(schema) is builder.prefix(schema)  # 同一版本只生成一次
+
+
+def test_extraction_prefix_stable():
+    asyncio.run(check_extraction_prefix_stable())
+
+
+async def check_intent_prefix_stable():
+    mcp, _ = await warm_mcp(warm=False)
+    service = mcp.deepseek_service
+    user_marker = b'{"role":"user"'
+
+    async def send_all():
+        for message in ("帮我申请出差上海3000元", "查询单据S25000089"):
+            await service.chat_with_tools([{"role": "user", "content": message}], mcp.tools.schemas_json)
+
+    first, second = await capture_bodies(send_all)
+    stable_prefix(first, second, user_marker)
+    # 预先序列化的工具定义原样拼接在请求体末尾
+    tools_suffix = b',"tools":' + mcp.tools.schemas_json + b',"tool_choice":"required"}'
+    assert first.endswith(tools_suffix) and second.endswith(tools_suffix)
+
+
+def test_intent_prefix_stable():
+    asyncio.run(check_intent_prefix_stable())
+
+
+if __name__ == "__main__":
+    test_extraction_prefix_stable()
+    test_intent_prefix_stable()
+    print("✅ 提示词前缀稳定性测试通过")
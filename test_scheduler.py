@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试DeepSeek出站调度
+优先级放行顺序、低优先级不饿死、令牌桶限速、429暂停和取消等待
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.scheduler import PriorityScheduler
+
+
+async def run_queued(scheduler: PriorityScheduler, priorities):
+    """占满并发后按给定顺序排队，释放后返回实际放行顺序"""
+    order = []
+
+    async def call(index, priority):
+        async with scheduler.slot(priority):
+            order.append((index, priority))
+
+    await scheduler.acquire("interactive")
+    tasks = [asyncio.ensure_future(call(index, priority)) for index, priority in enumerate(priorities)]
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth() == len(priorities)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_priority_order():
+    scheduler = PriorityScheduler(rate=0, max_in_flight=1, name="test_order")
+    order = asyncio.run(run_queued(scheduler, ["bulk", "probe", "interactive", "extraction"]))
+    assert [priority for _, priority in order] == ["interactive", "extraction", "bulk", "probe"], order
+
+
+def test_low_priority_not_starved():
+    """交互请求持续排队时，批量请求按权重分得名额，而不是等全部交互请求结束"""
+    scheduler = PriorityScheduler(rate=0, max_in_flight=1, name="test_fair")
+    order = asyncio.run(run_queued(scheduler, ["interactive"] * 40 + ["bulk"] * 2))
+    positions = [position for position, (_, priority) in enumerate(order) if priority == "bulk"]
+    assert positions[0] < 12 and positions[1] < 24, positions
+    assert scheduler.queue_depth() == 0 and scheduler._in_flight == 0
+
+
+async def check_rate_limit():
+    scheduler = PriorityScheduler(rate=50, burst=1, max_in_flight=0, name="test_rate")
+    started = time.perf_counter()
+    for _ in range(6):
+        async with scheduler.slot("bulk"):
+            pass
+    assert time.perf_counter() - started >= 0.09  # 首个用掉突发额度，其余5个每个间隔20ms
+
+    scheduler.throttle(0.15)
+    started = time.perf_counter()
+    async with scheduler.slot("interactive"):
+        pass
+    assert time.perf_counter() - started >= 0.14
+
+
+def test_rate_limit():
+    asyncio.run(check_rate_limit())
+
+
+async def check_cancelled_waiter():
+    scheduler = PriorityScheduler(rate=0, max_in_flight=1, name="test_cancel")
+    await scheduler.acquire("interactive")
+    waiter = asyncio.ensure_future(scheduler.acquire("bulk"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.queue_depth() == 0
+    scheduler.release()
+
+    async with scheduler.slot("probe"):
+        assert scheduler._in_flight == 1
+    assert scheduler._in_flight == 0
+
+
+def test_cancelled_waiter():
+    asyncio.run(check_cancelled_waiter())
+
+
+if __name__ == "__main__":
+    test_priority_order()
+    test_low_priority_not_starved()
+    test_rate_limit()
+    test_cancelled_waiter()
+    print("✅ DeepSeek出站调度测试通过")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+测试共享缓存的租约
+释放时只删除自己的租约、等待超时自行回源时不删除别人的租约、租约锁获取超时
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.shared_cache import CacheTier, MemoryCache, SQLiteCache
+
+
+async def check_waiter_past_deadline_keeps_holder_lease(backend):
+    holder, waiter = CacheTier(backend), CacheTier(backend)
+    release_holder = asyncio.Event()
+
+    async def slow_loader():
+        await release_holder.wait()
+        return "holder"
+
+    holding = asyncio.ensure_future(holder.get_or_load("ns", "k", slow_loader, ttl=60, lease_ttl=5))
+    await asyncio.sleep(0.05)
+    lease_key = f"lease:{await holder._versioned_key('ns', 'k')}"
+    assert await backend.get(lease_key)
+
+    # 等待方租约等待期很短：超时后自行回源，但不能删除持有者的租约
+    async def fallback_loader():
+        return "waiter"
+
+    assert await waiter.get_or_load("ns", "k", fallback_loader, ttl=60, lease_ttl=0.2) == "waiter"
+    assert await backend.get(lease_key), "等待方不应删除持有者的租约"
+
+    release_holder.set()
+    assert await holding == "holder"
+    assert await backend.get(lease_key) is None
+
+
+async def check_expired_holder_keeps_next_lease(backend):
+    cache = CacheTier(backend)
+    async with cache.lock("job", ttl=1):
+        await asyncio.sleep(1.1)  # 租约已过期，被另一个worker拿走
+        assert await backend.set("lock:job", "other-worker", ex=30, nx=True)
+    assert await backend.get("lock:job") == "other-worker", "过期的持有者不应删除新持有者的租约"
+
+    try:
+        async with cache.lock("job", ttl=30, timeout=0.2):
+            raise AssertionError("租约被占用时不应拿到锁")
+    except TimeoutError:
+        pass
+
+
+def test_memory_backend():
+    asyncio.run(check_waiter_past_deadline_keeps_holder_lease(MemoryCache()))
+    asyncio.run(check_expired_holder_keeps_next_lease(MemoryCache()))
+
+
+def test_sqlite_backend():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    asyncio.run(check_waiter_past_deadline_keeps_holder_lease(SQLiteCache(path)))
+    asyncio.run(check_expired_holder_keeps_next_lease(SQLiteCache(path)))
+
+
+if __name__ == "__main__":
+    test_memory_backend()
+    test_sqlite_backend()
+    print("✅ 共享缓存租约测试通过")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+测试投机预取的结算
+用到的预取被同一请求取用，未用到的预取被取消，且不影响合并到同一回源的其他请求
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.metrics import metrics
+from services.shared_cache import CacheTier, MemoryCache
+from services.speculation import SpeculativeExecutor, take_prefetched
+
+
+async def check_used_prefetch_taken():
+    speculation = SpeculativeExecutor("test_used")
+
+    async def prefetch():
+        return {"template_id": "tpl:v1"}
+
+    task = speculation.start(prefetch())
+    await asyncio.sleep(0)
+    speculation.settle(task, used=True)
+    assert await take_prefetched() == {"template_id": "tpl:v1"}
+    assert await take_prefetched() is None  # 每个请求只取用一次
+    assert metrics.counters["speculation.test_used.ready_in_time"] == 1
+
+
+def test_used_prefetch_taken():
+    asyncio.run(check_used_prefetch_taken())
+
+
+async def check_wasted_prefetch_cancelled():
+    speculation = SpeculativeExecutor("test_wasted")
+    cache = CacheTier(MemoryCache())
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.1)
+        return {"template_id": "tpl:v1"}
+
+    # 投机预取先发起回源，另一个请求合并到同一回源
+    task = speculation.start(cache.get_or_load("template", "current", loader, ttl=60))
+    await asyncio.sleep(0.02)
+    other = asyncio.ensure_future(cache.get_or_load("template", "current", loader, ttl=60))
+    await asyncio.sleep(0.02)
+
+    speculation.settle(task, used=False)
+    await asyncio.gather(task, return_exceptions=True)
+    assert task.cancelled()
+    assert metrics.counters["speculation.test_wasted.wasted"] == 1
+    assert metrics.counters["speculation.test_wasted.cancelled"] == 1
+    assert metrics.gauges["speculation.test_wasted.in_flight"]() == 0
+
+    assert await other == {"template_id": "tpl:v1"} and len(loads) == 1
+
+    # 已完成的预取不算取消，结果留在缓存中
+    done = speculation.start(cache.get_or_load("template", "current", loader, ttl=60))
+    await done
+    speculation.settle(done, used=False)
+    assert metrics.counters["speculation.test_wasted.cancelled"] == 1 and len(loads) == 1
+
+
+def test_wasted_prefetch_cancelled():
+    asyncio.run(check_wasted_prefetch_cancelled())
+
+
+if __name__ == "__main__":
+    test_used_prefetch_taken()
+    test_wasted_prefetch_cancelled()
+    print("✅ 投机预取结算测试通过")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试编译后的模板字段模型
+TemplateSchema.build_form构建的请求体和校验结果与原来逐字段线性扫描、手工拼装的请求体一致
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+from benchmarks.mock_upstream import TEMPLATE_DETAIL
+from services.template_schema import TemplateSchema
+
+SUBMITTER_ID = "ID01IBfgTxKWAL:S6g73MppKM3A00"
+
+MAPPINGS = [
+    # 各类字段齐全，另有模板之外的字段
+    {"title": "上海出差申请", "description": "客户拜访", "requisitionMoney": "3000", "requisitionDate": "2025-01-15",
+     "u_项目": "智能申请单", "u_城市": "上海", "u_备注": "模板外字段"},
+    # 秒级时间戳、数字金额、匹配不到的档案项（默认第一项）和空档案值
+    {"title": "培训", "requisitionMoney": 5000, "requisitionDate": 1736870400, "u_项目": "", "u_城市": "广州"},
+    # 缺少必填字段
+    {"title": "北京出差", "requisitionMoney": "1200"},
+    # 标题超长
+    {"title": "这是一个超过十四个字符长度限制的申请单标题", "requisitionMoney": "1", "requisitionDate": "2025-02-01"},
+    # 同时缺少必填字段和标题超长：缺少必填字段优先
+    {"title": "这是一个超过十四个字符长度限制的申请单标题", "requisitionDate": "2025-02-01"},
+]
+
+
+async def legacy_request_body(mcp, field_mapping, template_id, fields_info):
+    """原来的实现：每个字段线性扫描字段列表，按类型逐个处理后拼装请求体"""
+    request_body = {"form": {"specificationId": template_id, "submitterId": SUBMITTER_ID}}
+    field_mapping["submitterId"] = SUBMITTER_ID
+    for field_name, field_value in field_mapping.items():
+        field_config = next((field for field in fields_info if field["name"] == field_name), None)
+        value_from = field_config.get("valueFrom", "") if field_config else ""
+        if value_from.startswith("basedata.Dimension."):
+            processed_value = await mcp._process_archive_field(field_value, value_from, field_name)
+        elif field_config and field_config.get("type", "文本") == "日期":
+            processed_value = mcp._process_date_field(field_value)
+        else:
+            processed_value = field_value
+        request_body["form"][field_name] = processed_value
+    return request_body
+
+
+def legacy_validate(field_mapping, fields_info):
+    """原来的必填字段和标题长度校验"""
+    for field in fields_info:
+        if field["required"] and field["name"] not in field_mapping:
+            return f"缺少必填字段：{field['label']}"
+    if len(field_mapping.get("title", "")) > 14:
+        return "标题长度超过14个字符"
+    return None
+
+
+async def check_build_form_matches_legacy_payload():
+    mcp, _ = await warm_mcp()
+    template = await mcp.get_template_fields()
+    schema = mcp._template_schema(template["data"])
+    template_id = template["data"]["template_id"]
+
+    for mapping in MAPPINGS:
+        expected_error = legacy_validate(mapping, schema.fields_info)
+        expected = await legacy_request_body(mcp, dict(mapping), template_id, schema.fields_info)
+        body, error = await mcp._build_request_body(dict(mapping), template_id, schema)
+        assert body == expected, (mapping, body, expected)
+        assert error == expected_error, (mapping, error, expected_error)
+
+
+def test_build_form_matches_legacy_payload():
+    asyncio.run(check_build_form_matches_legacy_payload())
+
+
+async def check_compiled_and_cached_schema_agree():
+    mcp, _ = await warm_mcp(warm=False)
+    detail = TEMPLATE_DETAIL["items"][0]
+    compiled = TemplateSchema.compile(detail["id"], detail["name"], detail["form"], mcp._translate_field_type,
+                                      mcp._field_converters(), mcp._field_validators())
+    rebuilt = TemplateSchema.from_fields_info(detail["id"], detail["name"], compiled.fields_info,
+                                              mcp._field_converters(), mcp._field_validators())
+    assert rebuilt.fields_info == compiled.fields_info
+    assert [field.name for field in compiled.archive_fields] == ["u_项目", "u_城市"]
+    assert compiled.date_fields == {"requisitionDate"} and compiled.money_fields == {"requisitionMoney"}
+
+    resolved = {"u_城市": "ID01item:c1"}
+    for mapping in MAPPINGS:
+        assert compiled.build_form(mapping, resolved) == rebuilt.build_form(mapping, resolved)
+
+
+def test_compiled_and_cached_schema_agree():
+    asyncio.run(check_compiled_and_cached_schema_agree())
+
+
+if __name__ == "__main__":
+    test_build_form_matches_legacy_payload()
+    test_compiled_and_cached_schema_agree()
+    print("✅ 模板字段模型测试通过")
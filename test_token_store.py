@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+测试Token存储
+原子写入失败时保留原文件、两个存储实例（模拟两个worker）经文件锁串行刷新，
+以及等待文件锁时被取消不会留下无人释放的锁
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.token_store import TokenStore, atomic_write_json, read_json
+
+
+def test_atomic_write_keeps_previous_file():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "token.json")
+    atomic_write_json(path, {"accessToken": "old"})
+    try:
+        atomic_write_json(path, {"accessToken": object()})  # 写到一半失败
+        raise AssertionError("不可序列化的内容应写入失败")
+    except TypeError:
+        pass
+    assert read_json(path) == {"accessToken": "old"}
+    assert sorted(os.listdir(directory)) == ["token.json"], "失败的写入不应留下临时文件"
+
+
+async def check_two_stores_refresh_once():
+    path = os.path.join(tempfile.mkdtemp(), "token.json")
+    refreshes = []
+    holders = []
+
+    async def get_token(store: TokenStore) -> str:
+        # 与AuthService.get_access_token相同的流程：持锁后重新读取磁盘，仍无效才刷新
+        async with store.exclusive():
+            holders.append(1)
+            assert len(holders) == 1, "同一时刻只能有一个存储持有锁"
+            await store.load()
+            if not store.is_valid():
+                refreshes.append(1)
+                await asyncio.sleep(0.1)
+                await store.save({"accessToken": f"token-{len(refreshes)}",
+                                  "expireTime": (time.time() + 3600) * 1000})
+            holders.pop()
+            return store.token["accessToken"]
+
+    first, second = TokenStore(path, lock_timeout=5), TokenStore(path, lock_timeout=5)
+    tokens = await asyncio.gather(get_token(first), get_token(second), get_token(first))
+    assert tokens == ["token-1"] * 3 and len(refreshes) == 1
+    assert read_json(path)["accessToken"] == "token-1"
+
+
+def test_two_stores_refresh_once():
+    asyncio.run(check_two_stores_refresh_once())
+
+
+async def check_cancelled_waiter_releases_lock():
+    path = os.path.join(tempfile.mkdtemp(), "token.json")
+    holder, waiter, later = (TokenStore(path, lock_timeout=timeout) for timeout in (5, 5, 1))
+
+    async with holder.exclusive():
+        waiting = asyncio.ensure_future(waiter.exclusive().__aenter__())
+        await asyncio.sleep(0.1)  # 等待方的线程正在等文件锁
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert waiting.cancelled()
+
+    # 持有者释放后等待方的线程会拿到锁，随即被释放，其他实例仍能获取
+    await asyncio.sleep(0.2)
+    async with later.exclusive():
+        pass
+
+
+def test_cancelled_waiter_releases_lock():
+    asyncio.run(check_cancelled_waiter_releases_lock())
+
+
+if __name__ == "__main__":
+    test_atomic_write_keeps_previous_file()
+    test_two_stores_refresh_once()
+    test_cancelled_waiter_releases_lock()
+    print("✅ Token存储测试通过")
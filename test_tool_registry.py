@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试MCP工具注册表
+按定义顺序收集工具（子类覆盖同名工具）、预先序列化的工具定义、按名称分发，以及参数校验
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.tool_registry import ToolError, ToolRegistry, mcp_tool
+
+
+class BaseTools:
+    @mcp_tool("查询档案类别")
+    async def list_categories(self):
+        return {"success": True, "message": "base"}
+
+    @mcp_tool("按编号查询单据", parameters={"code": {"type": "string"}, "limit": {"type": "integer"}},
+              required=["code"], response_type="document")
+    async def find_document(self, code: str, limit: int = 1):
+        return {"success": True, "message": f"{code}:{limit}"}
+
+    async def not_a_tool(self):
+        return {}
+
+
+class Tools(BaseTools):
+    @mcp_tool("查询档案类别（覆盖）")
+    async def list_categories(self):
+        return {"success": True, "message": "override"}
+
+    @mcp_tool("切换开关", parameters={"enabled": {"type": "boolean"}, "ratio": {"type": "number"}})
+    async def toggle(self, enabled: bool = False, ratio: float = 0.0):
+        return {"success": True, "message": f"{enabled}:{ratio}"}
+
+
+REGISTRY = ToolRegistry.collect(Tools)
+
+
+def test_collect_and_schemas():
+    assert list(REGISTRY.specs) == ["list_categories", "find_document", "toggle"]
+    assert "not_a_tool" not in REGISTRY and "find_document" in REGISTRY
+    assert REGISTRY.specs["list_categories"].description == "查询档案类别（覆盖）"
+    assert [schema["function"]["name"] for schema in REGISTRY.schemas] == list(REGISTRY.specs)
+    assert REGISTRY.schemas[0]["function"]["description"] == "查询档案类别（覆盖）"
+    assert json.loads(REGISTRY.schemas_json) == REGISTRY.schemas
+    function = REGISTRY.schemas[1]["function"]
+    assert function["name"] == "find_document" and function["parameters"]["required"] == ["code"]
+    assert function["parameters"]["properties"]["limit"] == {"type": "integer"}
+
+
+async def check_dispatch():
+    tools = Tools()
+    spec, result = await REGISTRY.dispatch(tools, "find_document", '{"code": "S25000089", "extra": 1}')
+    assert spec.response_type == "document" and result["message"] == "S25000089:1"  # 未声明的参数被忽略
+    _, result = await REGISTRY.dispatch(tools, "find_document", {"code": "S1", "limit": 5})
+    assert result["message"] == "S1:5"
+    _, result = await REGISTRY.dispatch(tools, "list_categories", "")
+    assert result["message"] == "override"
+    _, result = await REGISTRY.dispatch(tools, "toggle", {"enabled": True, "ratio": 2})
+    assert result["message"] == "True:2"
+
+
+def test_dispatch():
+    asyncio.run(check_dispatch())
+
+
+def test_argument_validation():
+    for name, arguments, message in (
+        ("delete_everything", {}, "未知的工具调用"),
+        ("find_document", "{}", "缺少参数: code"),
+        ("find_document", '{"code": 1}', "参数 code 应为 string"),
+        ("find_document", {"code": "S1", "limit": True}, "参数 limit 应为 integer"),
+        ("find_document", {"code": "S1", "limit": 1.5}, "参数 limit 应为 integer"),
+        ("toggle", {"enabled": "yes"}, "参数 enabled 应为 boolean"),
+        ("toggle", {"ratio": False}, "参数 ratio 应为 number"),
+        ("find_document", '{"code": ', "不是合法JSON"),
+        ("find_document", '["S1"]', "必须是JSON对象"),
+    ):
+        try:
+            REGISTRY.parse_call(name, arguments)
+        except ToolError as e:
+            assert message in str(e), (name, arguments, str(e))
+            continue
+        raise AssertionError(f"应拒绝的工具调用: {name} {arguments!r}")
+
+
+if __name__ == "__main__":
+    test_collect_and_schemas()
+    test_dispatch()
+    test_argument_validation()
+    print("✅ MCP工具注册表测试通过")
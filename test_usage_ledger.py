@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+测试DeepSeek用量记账与预算
+按调用场景/用户汇总、未提供用户时按会话记账、写入SQLite后跨实例可见、
+流式输出中断时同样记账，以及超出预算时降级为本地提取
+（可直接运行，也可用pytest执行）
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.fixtures import warm_mcp
+
+import httpx
+
+from services.deepseek_service import DeepSeekService
+from services.resilience import get_gateway
+from services.usage_ledger import UsageLedger, bind_usage_context
+
+INTENT_USAGE = {"prompt_tokens": 1000, "prompt_cache_hit_tokens": 900, "completion_tokens": 20}
+EXTRACT_USAGE = {"prompt_tokens": 800, "prompt_cache_hit_tokens": 0, "completion_tokens": 200}
+
+
+def new_ledger(**budgets) -> UsageLedger:
+    return UsageLedger(path=os.path.join(tempfile.mkdtemp(), "usage.db"), **budgets)
+
+
+def test_report_by_call_site_and_user():
+    ledger = new_ledger()
+    bind_usage_context("s1", "alice")
+    ledger.record("intent", INTENT_USAGE, 0.2)
+    ledger.record("intent", INTENT_USAGE, 0.4)
+    ledger.record("extract", EXTRACT_USAGE, 1.0)
+    bind_usage_context("s2", "bob")
+    ledger.record("intent", INTENT_USAGE, 0.3)
+
+    by_site = {row["call_site"]: row for row in ledger.report(group_by="call_site")}
+    assert by_site["intent"]["calls"] == 3 and by_site["intent"]["prompt_tokens"] == 3000
+    assert by_site["intent"]["cache_hit_ratio"] == 0.9 and by_site["intent"]["avg_latency_ms"] == 300.0
+    assert by_site["extract"]["completion_tokens"] == 200
+    # 输入800×2元 + 输出200×8元 每百万token
+    assert abs(by_site["extract"]["cost"] - 0.0032) < 1e-9, by_site["extract"]
+
+    by_user = {row["user_id"]: row["calls"] for row in ledger.report(group_by="user_id")}
+    assert by_user == {"alice": 3, "bob": 1}
+
+    # 第二次报表不重复累加
+    assert {row["call_site"]: row["calls"] for row in ledger.report()} == {"intent": 3, "extract": 1}
+
+
+def test_session_stands_in_for_missing_user():
+    ledger = new_ledger(user_daily_budget=0.005)
+    bind_usage_context("s3", None)
+    ledger.record("extract", EXTRACT_USAGE, 1.0)
+    ledger.record("extract", EXTRACT_USAGE, 1.0)
+    bind_usage_context(None, None)
+    ledger.record("intent", INTENT_USAGE, 0.2)
+
+    by_user = {row["user_id"]: row["calls"] for row in ledger.report(group_by="user_id")}
+    assert by_user == {"session:s3": 2, "anonymous": 1}
+    assert not ledger.within_budget("session:s3") and ledger.within_budget("anonymous")
+
+
+async def check_interrupted_stream_billed():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def events():
+            for piece in ("你好，", "这是", "一段回复"):
+                yield f'data: {{"choices": [{{"delta": {{"content": "{piece}"}}}}]}}\n\n'.encode("utf-8")
+            yield b'data: {"choices": [], "usage": {"prompt_tokens": 50, "completion_tokens": 8}}\n\n'
+            yield b"data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+
+    get_gateway().set_transport(httpx.MockTransport(handler))
+    service = DeepSeekService()
+    service.usage = new_ledger()
+    messages = [{"role": "user", "content": "一" * 100}]
+    bind_usage_context("s4", "carol")
+    try:
+        assert [chunk async for chunk in service.chat_stream(messages)] == ["你好，", "这是", "一段回复"]
+
+        # 调用方读到第一段就结束：还没收到用量，按字符数估算
+        stream = service.chat_stream(messages)
+        assert await stream.__anext__() == "你好，"
+        await stream.aclose()
+    finally:
+        get_gateway().set_transport(None)
+
+    chat = {row["call_site"]: row for row in service.usage.report()}["chat"]
+    assert chat["calls"] == 2, chat
+    assert chat["prompt_tokens"] == 50 + 60 and chat["completion_tokens"] == 8 + 2, chat
+
+
+def test_interrupted_stream_billed():
+    asyncio.run(check_interrupted_stream_billed())
+
+
+def test_budgets():
+    ledger = new_ledger(user_daily_budget=0.005)
+    bind_usage_context("s1", "alice")
+    ledger.record("extract", EXTRACT_USAGE, 1.0)
+    assert ledger.within_budget()
+    ledger.record("extract", EXTRACT_USAGE, 1.0)
+    assert not ledger.within_budget()
+    assert ledger.within_budget("bob")
+
+    # 写入后其他worker（同一个库）也能看到已花费用
+    ledger.flush()
+    assert not ledger.within_budget("alice")
+    other_worker = UsageLedger(path=ledger.path, user_daily_budget=0.005)
+    other_worker.flush()
+    assert not other_worker.within_budget("alice")
+
+
+async def check_over_budget_degrades_to_local_extraction():
+    mcp, recorder = await warm_mcp(usage=new_ledger(global_daily_budget=0.001))
+
+    bind_usage_context("s1", "alice")
+    mcp.deepseek_service.usage.record("extract", EXTRACT_USAGE, 1.0)
+    with recorder.unit_of_work("create_over_budget") as calls:
+        result = await mcp.create_smart_expense("帮我申请出差上海3000元，明天出发")
+    assert result["success"], result
+    calls.assert_budget({"ekuaibao:flow/data": 1})
+
+
+def test_over_budget_degrades_to_local_extraction():
+    asyncio.run(check_over_budget_degrades_to_local_extraction())
+
+
+if __name__ == "__main__":
+    test_report_by_call_site_and_user()
+    test_session_stands_in_for_missing_user()
+    test_interrupted_stream_billed()
+    test_budgets()
+    test_over_budget_degrades_to_local_extraction()
+    print("✅ DeepSeek用量记账与预算测试通过")